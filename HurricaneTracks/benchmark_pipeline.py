@@ -0,0 +1,164 @@
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import datetime
+import platform
+import subprocess
+import shutil
+import json
+import time
+import os
+
+from synthetic_data import write_synthetic_data
+from track_functions import combine_event_tracks, write_storm_summary
+from track_functions import get_combined_track_dir, read_combined_tracks
+from tract_functions import read_tract_population, read_all_state_tracts
+import exposure_functions
+from exposure_functions import get_hurricane_exposure
+from windfield_functions import get_hurricane_wind_exposure
+from parcel_functions import read_parcels
+from landfall_functions import count_state_landfalls
+from coastline_functions import load_coastline_segments, make_coastline_index, distance_to_coast
+
+# this code times the main steps of the hurricane exposure pipeline
+# on synthetic tracks, tracts, and parcels (made by synthetic_data.py),
+# so it runs offline and gives the same inputs every time
+# results are written to benchmark_results as json, and each run
+# is compared with the previous result file
+
+# synthetic data settings
+synthetic_settings = {'seed': 0, 'start_year': 2010, 'num_years': 5, 'storms_per_year': 15,
+                      'points_per_storm': 40, 'num_states': 12, 'num_tracts': 5000, 'num_parcels': 100000}
+# number of times each step is run (the fastest run is reported)
+num_repeats = 3
+# synthetic inputs are written here (and re-used while the settings stay the same)
+data_dir = 'benchmark_data'
+results_dir = 'benchmark_results'
+
+def time_stage(stage_results, stage_name, stage_function, *stage_args, **stage_kwargs):
+  # run a step num_repeats times, record the run times and the
+  # number of rows in its result, and return the result of the last run
+  run_times = []
+  for repeat_num in range(num_repeats):
+    start_time = time.perf_counter()
+    stage_output = stage_function(*stage_args, **stage_kwargs)
+    run_times.append(time.perf_counter() - start_time)
+    plt.close('all')
+  stage_rows = stage_output[0] if isinstance(stage_output, tuple) else stage_output
+  stage_results[stage_name] = {'best_seconds': min(run_times), 'mean_seconds': float(np.mean(run_times)),
+                               'runs': run_times, 'rows': int(len(stage_rows)) if hasattr(stage_rows, '__len__') else None}
+  print(stage_name.ljust(32) + ' ' + ('%.3f' % min(run_times)).rjust(9) + ' s')
+  return stage_output
+
+def combine_fresh(dt, ender):
+  # combine all events (no combined files from an earlier run)
+  if os.path.exists(get_combined_track_dir('combined_tracks', dt)):
+    shutil.rmtree(get_combined_track_dir('combined_tracks', dt))
+  return combine_event_tracks('nhd_tracks', 'combined_tracks', dt, ender, epsg = 3857)
+
+def join_tract_population(max_workers):
+  tract_population = read_tract_population('ACSDT5Y2023.B01003-Data.csv')
+  return read_all_state_tracts('CensusTracts', tract_population, epsg = 32618, max_workers = max_workers)
+
+def build_coastline(us_states):
+  # coastline segments built from the states (no cached copy)
+  if os.path.exists('coastline'):
+    shutil.rmtree('coastline')
+  return load_coastline_segments(os.path.join('cb_2018_us_state_500k', 'cb_2018_us_state_500k.shp'),
+                                 6343, 'coastline', us_states = us_states)
+
+def exposure_area_uncached(exposure_gdf, exposure_column, exposure_label):
+  # area-weighted exposure with the area fraction memo cache emptied first,
+  # so every run works out the area fractions again
+  exposure_functions._area_fraction_cache.clear()
+  return get_hurricane_exposure(exposure_gdf, exposure_column, exposure_label, weighting = 'area', write_outputs = False)
+
+def measure_distance_to_coast(hurricane_points, coastline_segments):
+  return distance_to_coast(hurricane_points.geometry.values, make_coastline_index(coastline_segments))
+
+def get_git_commit():
+  # commit of the code being timed (blank outside of a git checkout)
+  try:
+    return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                          cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+  except OSError:
+    return ''
+
+if __name__ == '__main__':
+  # write synthetic inputs (only if the settings have changed)
+  settings_path = os.path.join(data_dir, 'synthetic_settings.json')
+  old_settings = None
+  if os.path.exists(settings_path):
+    with open(settings_path) as settings_file:
+      old_settings = json.load(settings_file)
+  if old_settings != synthetic_settings:
+    print('Writing synthetic data....')
+    if os.path.exists(data_dir):
+      shutil.rmtree(data_dir)
+    write_synthetic_data(data_dir, **synthetic_settings)
+    with open(settings_path, 'w') as settings_file:
+      json.dump(synthetic_settings, settings_file, indent = 1)
+  results_dir = os.path.abspath(results_dir)
+  # pipeline functions use paths relative to the HurricaneTracks folder
+  os.chdir(data_dir)
+  os.makedirs('combined_tracks', exist_ok = True)
+
+  stage_results = {}
+  # combine_nhc_tracks.py
+  time_stage(stage_results, 'combine_tracks_points', combine_fresh, 'points', ['position', 'pts'])
+  time_stage(stage_results, 'combine_tracks_lines', combine_fresh, 'lines', ['lin', 'track'])
+  time_stage(stage_results, 'combine_tracks_unchanged', combine_event_tracks, 'nhd_tracks',
+             'combined_tracks', 'points', ['position', 'pts'], epsg = 3857)
+  all_points = time_stage(stage_results, 'read_combined_tracks', read_combined_tracks,
+                          get_combined_track_dir('combined_tracks', 'points'))
+  all_lines = read_combined_tracks(get_combined_track_dir('combined_tracks', 'lines'))
+  time_stage(stage_results, 'storm_summary', write_storm_summary, all_points, 'combined_tracks')
+  # tract shapes + population (estimate_hurricane_exposure.py)
+  time_stage(stage_results, 'tract_population_join', join_tract_population, 1)
+  population_tracts_gdf = time_stage(stage_results, 'tract_population_join_parallel', join_tract_population, None)[0]
+  # exposure within each radius of every storm peak (csv and plots are not written while timing)
+  time_stage(stage_results, 'exposure_population', get_hurricane_exposure, population_tracts_gdf, 'Population', 'population',
+             write_outputs = False)
+  # area-weighted tracts, with the area fractions worked out in every run
+  time_stage(stage_results, 'exposure_population_area', exposure_area_uncached, population_tracts_gdf, 'Population', 'population')
+  # and read from the memo cache filled by the runs above
+  time_stage(stage_results, 'exposure_population_area_cached', get_hurricane_exposure, population_tracts_gdf, 'Population',
+             'population', weighting = 'area', write_outputs = False)
+  parcels = read_parcels([os.path.join('Parcels', 'synthetic_parcels_pt.shp')], columns = ['IMPROVVAL']).to_crs(epsg = 32618)
+  time_stage(stage_results, 'exposure_parcels', get_hurricane_exposure, parcels, 'IMPROVVAL', 'structure_value',
+             write_outputs = False)
+  time_stage(stage_results, 'wind_field_parcels', get_hurricane_wind_exposure, parcels, 'IMPROVVAL', 'structure_value',
+             write_outputs = False)
+  # state landfall counts (explore_hurricane_tracks.py)
+  us_states = gpd.read_file(os.path.join('cb_2018_us_state_500k', 'cb_2018_us_state_500k.shp'))
+  years = np.arange(synthetic_settings['start_year'], synthetic_settings['start_year'] + synthetic_settings['num_years'])
+  time_stage(stage_results, 'state_landfalls', count_state_landfalls, all_lines, us_states.to_crs(epsg = 3857), years)
+  # distance to coast (coastal_windspeed_hazards.py)
+  coastline_segments = time_stage(stage_results, 'coastline_segments', build_coastline, us_states.to_crs(epsg = 6343))
+  time_stage(stage_results, 'distance_to_coast', measure_distance_to_coast, all_points.to_crs(epsg = 6343), coastline_segments)
+
+  # write results
+  benchmark_report = {'time': datetime.datetime.now().isoformat(timespec = 'seconds'), 'commit': get_git_commit(),
+                      'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+                                  'python': platform.python_version(), 'numpy': np.__version__,
+                                  'pandas': pd.__version__, 'geopandas': gpd.__version__},
+                      'settings': synthetic_settings, 'repeats': num_repeats, 'stages': stage_results}
+  os.makedirs(results_dir, exist_ok = True)
+  earlier_results = sorted(os.listdir(results_dir))
+  results_path = os.path.join(results_dir, 'benchmark_' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+  with open(results_path, 'w') as results_file:
+    json.dump(benchmark_report, results_file, indent = 1)
+  print('Results written to ' + results_path)
+  # compare with the previous run (if it used the same settings)
+  if len(earlier_results) > 0:
+    with open(os.path.join(results_dir, earlier_results[-1])) as results_file:
+      previous_report = json.load(results_file)
+    if previous_report['settings'] == synthetic_settings:
+      print('Change since ' + earlier_results[-1] + ' (commit ' + previous_report['commit'] + '):')
+      for stage_name in stage_results:
+        if stage_name in previous_report['stages']:
+          time_ratio = stage_results[stage_name]['best_seconds'] / previous_report['stages'][stage_name]['best_seconds']
+          print(stage_name.ljust(32) + ' ' + ('%+.1f' % (100.0 * (time_ratio - 1.0))).rjust(8) + ' %')
@@ -0,0 +1,60 @@
+import pandas as pd
+import os
+
+from grid_functions import write_exposure_grid, read_grid_settings, load_exposure_grid, get_grid_error_report
+from data_access_functions import load_tracts, load_storm_summary, get_layer_fingerprint, default_tract_path
+from parcel_functions import read_store_parcels, read_parcels
+from instrumentation import stage
+
+# this code rasterizes tract population (and optionally parcel structure value)
+# onto a fixed grid and writes a summed-area table for each layer to grid_dir,
+# for fast approximate radius exposure (see grid_functions.py)
+# grids are only rebuilt if their source layer or cell size changes, and the
+# grid sums at every storm peak are compared with the exact radius exposure
+
+# settings
+grid_dir = 'exposure_grids'
+cell_size = 1000.0 # meters
+buffer_radii = [200000.0, 150000.0, 100000.0, 50000.0]
+# set to True to also grid parcel IMPROVVAL (from the parcel store if it
+# has been written by build_parcel_store.py, otherwise the county shapefiles)
+include_parcels = False
+store_dir = 'parcel_store'
+parcel_files = [os.path.join('Parcels', 'nc_' + nc_county + '_parcels_pt.shp') for nc_county in ['brunswick', 'newhanover']]
+
+# layers to grid: (grid name, exposure column, source files, loader)
+grid_layers = [('population', 'Population', [default_tract_path,], lambda: load_tracts(epsg = 32618, columns = ['Population', 'geometry']))]
+if include_parcels:
+  if os.path.exists(os.path.join(store_dir, 'parcel_store_manifest.json')):
+    grid_layers.append(('structure_value', 'IMPROVVAL', [os.path.join(store_dir, 'parcel_store_manifest.json'),],
+                        lambda: read_store_parcels(store_dir, columns = ['IMPROVVAL'])))
+  else:
+    grid_layers.append(('structure_value', 'IMPROVVAL', parcel_files,
+                        lambda: read_parcels(parcel_files, columns = ['IMPROVVAL']).to_crs(epsg = 32618)))
+
+storm_peaks = load_storm_summary(epsg = 32618)
+for grid_name, exposure_column, source_files, load_exposure in grid_layers:
+  source_key = ' '.join(get_layer_fingerprint(source_file) for source_file in source_files) + ' ' + str(cell_size)
+  grid_settings = read_grid_settings(grid_dir, grid_name)
+  exposure_gdf = None
+  if grid_settings is not None and grid_settings['source_key'] == source_key:
+    print(grid_name + ' grid is up to date')
+  else:
+    with stage('build ' + grid_name + ' grid') as timer:
+      exposure_gdf = load_exposure()
+      grid_settings = write_exposure_grid(exposure_gdf, exposure_column, grid_dir, grid_name, cell_size = cell_size,
+                                          source_key = source_key)
+      timer.rows = len(exposure_gdf.index)
+    print(grid_name + ' grid: ' + str(grid_settings['num_rows']) + ' x ' + str(grid_settings['num_columns']) + ' cells')
+  # error of the grid disc sums against the exact exposure at every storm peak
+  # ('intersects' counts whole tracts that touch the circle, so the grid reads lower;
+  # 'area' counts the part of each tract inside the circle, like the grid)
+  with stage('grid error report ' + grid_name):
+    if exposure_gdf is None:
+      exposure_gdf = load_exposure()
+    exposure_grid = load_exposure_grid(grid_dir, grid_name)
+    error_report = pd.concat({weighting: get_grid_error_report(exposure_grid, exposure_gdf, exposure_column, storm_peaks,
+                                                               buffer_radii, weighting = weighting)
+                              for weighting in ['intersects', 'area']}, names = ['Weighting'])
+  print(error_report)
+  error_report.to_csv(os.path.join(grid_dir, grid_name + '_grid_error.csv'))
@@ -0,0 +1,21 @@
+import os
+
+from parcel_functions import write_parcel_store, read_row_group_bounds
+from instrumentation import stage
+
+# this code copies the county parcel shapefiles into the parcel store
+# (GeoParquet, one file per state/county, projected and spatially sorted,
+# with a bounding box for every row group) so exposure runs only read
+# the parcels near each storm. Counties that have not changed are skipped
+store_dir = 'parcel_store'
+parcel_layers = []
+for nc_county in ['brunswick', 'newhanover']:
+  parcel_layers.append(('nc', nc_county, os.path.join('Parcels', 'nc_' + nc_county + '_parcels_pt.shp')))
+
+with stage('write parcel store') as timer:
+  written_counties = write_parcel_store(parcel_layers, store_dir, columns = ['IMPROVVAL'], epsg = 32618, row_group_size = 10000)
+  timer.rows = len(written_counties)
+for written_county in written_counties:
+  print(written_county)
+row_group_bounds = read_row_group_bounds(store_dir)
+print(str(int(row_group_bounds['rows'].sum())) + ' parcels in ' + str(len(row_group_bounds.index)) + ' row groups')
@@ -1,26 +1,50 @@
-import pandas as pd
-import geopandas as gpd
 import os
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 from exposure_functions import get_hurricane_exposure
-full_exposure_df = pd.DataFrame()
+from parcel_functions import read_parcels, read_all_parcel_batches
+from parcel_functions import read_store_batches, read_store_parcels
+from data_access_functions import load_storm_summary
+from windfield_functions import get_hurricane_wind_exposure
+from instrumentation import stage
+
+# set to True to read parcels in batches and add up exposure batch by batch
+# (memory use depends on batch size, not on the number of parcels)
+stream_parcels = False
+parcel_batch_size = 100000
+# set to True to also estimate winds at every parcel from every track point
+# and report structure value by saffir-simpson category
+# (needs all parcels in memory, so it is not used with stream_parcels)
+wind_field_exposure = False
+# parcel store written by build_parcel_store.py - if it exists, only the
+# row groups within the largest buffer radius of a storm peak are read
+# (the wind field uses every track point, so it reads the whole store)
+store_dir = 'parcel_store'
+buffer_radii = [200000.0, 150000.0, 100000.0, 50000.0]
+
+parcel_files = []
 for nc_county in ['brunswick', 'newhanover']:
-  print(nc_county)
-  file_pathway = os.path.join('Parcels', 'nc_' + nc_county + '_parcels_pt.shp')
-  columns_keep = ['IMPROVVAL', 'geometry']
-  i = 0
-  chunk_size = 10000
-  while True:
-    chunk = slice(i, i + chunk_size, 1)
-    exposure_int = gpd.read_file(file_pathway, rows=chunk)
-    print(chunk)
-    if exposure_int.shape[0] == 0:
-      break
-    full_exposure_df = pd.concat([full_exposure_df, exposure_int[columns_keep]], axis = 0)
-    i += chunk_size
-full_exposure_gdf = gpd.GeoDataFrame(full_exposure_df, crs = exposure_int.crs, geometry = full_exposure_df.geometry)
-print(full_exposure_gdf.head())
-full_exposure_gdf = full_exposure_gdf.to_crs(epsg = 32618)
-get_hurricane_exposure(full_exposure_gdf, 'IMPROVVAL', 'structure_value')
+  parcel_files.append(os.path.join('Parcels', 'nc_' + nc_county + '_parcels_pt.shp'))
+if os.path.exists(store_dir):
+  storm_peaks = None if wind_field_exposure else load_storm_summary(epsg = 32618)
+  if stream_parcels:
+    full_exposure_gdf = read_store_batches(store_dir, storm_peaks, max(buffer_radii), columns = ['IMPROVVAL'])
+  else:
+    with stage('read parcel store') as timer:
+      full_exposure_gdf = read_store_parcels(store_dir, storm_peaks, max(buffer_radii), columns = ['IMPROVVAL'])
+      timer.rows = len(full_exposure_gdf.index)
+elif stream_parcels:
+  # batches are reprojected to match the hurricane tracks as they are used
+  full_exposure_gdf = read_all_parcel_batches(parcel_files, columns = ['IMPROVVAL'], batch_size = parcel_batch_size)
+else:
+  # read only the structure value and geometry from each county file
+  with stage('read parcels') as timer:
+    full_exposure_gdf = read_parcels(parcel_files, columns = ['IMPROVVAL'])
+    timer.rows = len(full_exposure_gdf.index)
+  print(full_exposure_gdf.head())
+  with stage('reproject parcels'):
+    full_exposure_gdf = full_exposure_gdf.to_crs(epsg = 32618)
+with stage('parcel exposure'):
+  get_hurricane_exposure(full_exposure_gdf, 'IMPROVVAL', 'structure_value', buffer_radii = buffer_radii)
+if wind_field_exposure and not stream_parcels:
+  with stage('parcel wind field exposure'):
+    get_hurricane_wind_exposure(full_exposure_gdf, 'IMPROVVAL', 'structure_value')
@@ -2,35 +2,60 @@ import numpy as np
 import geopandas as gpd
 from matplotlib import pyplot
 import os
+
+from coastline_functions import load_coastline_segments, make_coastline_index, distance_to_coast
+from coastline_functions import get_distance_raster, check_distance_raster
+from data_access_functions import load_states, load_track_points
+from instrumentation import stage
 ###########################################################################################
 ### Visualizing TC Hazard #######################################################
 ###########################################################################################
 # load combined hurricane track file
 output_dir = 'combined_tracks'
 # load combined file with points and windspeeds
-file_name = os.path.join(output_dir, output_dir + '_points.shp')
-all_hurricane_points = gpd.read_file(file_name) # read file
-all_hurricane_points = all_hurricane_points.to_crs(epsg = 6343) # set coordinate projection
+with stage('read track points') as timer:
+  all_hurricane_points = load_track_points(epsg = 6343, combined_dir = output_dir) # read file + set coordinate projection
+  timer.rows = len(all_hurricane_points.index)
 
 state_path = 'cb_2018_us_state_500k'
-us_states = gpd.read_file(os.path.join(state_path, state_path + '.shp')) # read file
-us_states = us_states.to_crs(epsg = 6343) # set coordinate projection
+with stage('read states') as timer:
+  us_states = load_states(epsg = 6343, state_path = os.path.join(state_path, state_path + '.shp')) # read file + set coordinate projection
+  timer.rows = len(us_states.index)
 # initialize figure
 fig, ax = pyplot.subplots(figsize = (16,16))
 # only keep hurricane points within the boundaries of the us
-us_hr_pnts = gpd.sjoin(all_hurricane_points, us_states, how = 'inner', predicate = 'within')
-# only keep us states with hurricane point contained within boundary
-us_bounds = us_states.dissolve()
-intensity = []
-distances = []
-for index, row in us_hr_pnts.iterrows():
-  # calculate distance between each point (row['geometry'])
-  # and the boundary of the dissolved us shape (us_bounds.geometry[0].boundary)
-  distance=row['geometry'].distance(us_bounds.geometry[0].boundary) 
-  # store the windspeed in mph
-  intensity.append(float(row['INTENSITY'])* 1.15)
-  # store the distance
-  distances.append(distance)
+with stage('points in states sjoin') as timer:
+  us_hr_pnts = gpd.sjoin(all_hurricane_points, us_states, how = 'inner', predicate = 'within')
+  timer.rows = len(us_hr_pnts.index)
+# split the boundary of the dissolved us shape into indexed segments
+# (cached in 'coastline', only rebuilt if the state file changes)
+with stage('coastline segments') as timer:
+  coastline_segments = load_coastline_segments(os.path.join(state_path, state_path + '.shp'), 6343, 
+                                               'coastline', us_states = us_states)
+  coastline_index = make_coastline_index(coastline_segments)
+  timer.rows = len(coastline_segments)
+# calculate distance between each point and the
+# nearest segment of the us boundary, for all points at once
+with stage('distance to coast') as timer:
+  distances = distance_to_coast(us_hr_pnts.geometry.values, coastline_index)
+  timer.rows = len(distances)
+# store the windspeed in mph
+intensity = us_hr_pnts['INTENSITY'].to_numpy(dtype = float) * 1.15
+# precomputed 1 km distance-to-coast raster over the area covered by the us
+# hurricane points, for fast approximate distances for large batches of points
+# (built once in 'coastline', memory-mapped after that)
+# the margin is the largest distance to the coast (plus a cell), so the nearest
+# coastline of every point is inside the raster and the error bound holds
+# (covering every atlantic track point instead would take several GB to build)
+with stage('distance raster'):
+  distance_raster, raster_info = get_distance_raster(coastline_segments, us_hr_pnts.total_bounds, 1000.0,
+                                                     'coastline', crs = 'EPSG:6343', margin = np.nanmax(distances) + 1000.0)
+# compare raster distances with exact distances for the us hurricane points
+with stage('distance raster check') as timer:
+  raster_check = check_distance_raster(distance_raster, raster_info, coastline_index, us_hr_pnts.geometry.values)
+  timer.rows = raster_check['points']
+print('Distance raster error (m): max ' + str(round(raster_check['max_error'])) + ', mean ' + 
+      str(round(raster_check['mean_error'])) + ', bound ' + str(round(raster_check['error_bound'])))
   
 fig, ax = pyplot.subplots()
 ax.plot(np.asarray(distances)/1000.0, intensity, marker = 'o', linewidth = 0.0)
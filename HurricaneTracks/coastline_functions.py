@@ -0,0 +1,153 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+from scipy import ndimage
+import hashlib
+import json
+import os
+
+from download_functions import get_layer_checksum
+
+def build_coastline_segments(us_states):
+  # dissolve all states into one shape and split its boundary
+  # into straight segments, returned as an array of [x0, y0, x1, y1] rows
+  us_bounds = us_states.dissolve()
+  boundary_lines = shapely.get_parts(shapely.boundary(us_bounds.geometry.values))
+  boundary_coords, line_index = shapely.get_coordinates(boundary_lines, return_index = True)
+  # consecutive coordinates on the same line make a segment
+  same_line = line_index[:-1] == line_index[1:]
+  return np.hstack([boundary_coords[:-1][same_line], boundary_coords[1:][same_line]])
+
+def load_coastline_segments(state_shp_path, epsg, cache_dir, us_states = None):
+  # coastline segments for the state file projected to epsg,
+  # cached on disk (with the dissolved outline) and only rebuilt if the state file changes
+  cache_key = get_layer_checksum(state_shp_path)[:16] + '_' + str(epsg)
+  segment_path = os.path.join(cache_dir, 'coastline_segments_' + cache_key + '.npy')
+  if os.path.exists(segment_path):
+    return np.load(segment_path)
+  if us_states is None:
+    us_states = gpd.read_file(state_shp_path)
+  us_states = us_states.to_crs(epsg = epsg)
+  coastline_segments = build_coastline_segments(us_states)
+  os.makedirs(cache_dir, exist_ok = True)
+  us_states.dissolve()[['geometry']].to_parquet(os.path.join(cache_dir, 'coastline_outline_' + cache_key + '.parquet'))
+  np.save(segment_path, coastline_segments)
+  with open(os.path.join(cache_dir, 'coastline_segments_' + cache_key + '.json'), 'w') as info_file:
+    json.dump({'state_file': state_shp_path, 'epsg': epsg, 'segments': len(coastline_segments)}, info_file, indent = 1)
+  return coastline_segments
+
+def make_coastline_index(coastline_segments):
+  # spatial index over the coastline segments
+  return shapely.STRtree(shapely.linestrings(coastline_segments.reshape(-1, 2, 2)))
+
+def distance_to_coast(points, coastline_index):
+  # distance from each point (array of shapely geometries, in the
+  # coastline crs) to the nearest coastline segment
+  # one bulk nearest-neighbor query on the segment index answers all points
+  points = np.asarray(points)
+  nearest_index, nearest_distance = coastline_index.query_nearest(points, return_distance = True, all_matches = False)
+  distances = np.full(len(points), np.nan)
+  distances[nearest_index[0]] = nearest_distance
+  return distances
+
+# distance-to-coast raster
+# approximate distances for large batches of points come from a precomputed
+# grid of distances (a euclidean distance transform), stored as a .npy file
+# that is memory-mapped on load, plus a .json file with its georeferencing
+# grid values are stored at nodes x = x0 + i * cell_size, y = y0 + j * cell_size
+# (raster[j, i]) and sampled with bilinear interpolation
+# error bound: the coastline is marked on the grid at points spaced
+# cell_size / 2 apart, each snapped to its nearest node (at most cell_size / sqrt(2) away),
+# so node values are within (1/4 + 1/sqrt(2)) * cell_size of the exact distance;
+# distance to coast changes by at most 1 m per m, so bilinear interpolation adds
+# at most cell_size / sqrt(2) - in total |raster - exact| <= (1/4 + sqrt(2)) * cell_size
+# (about 1.66 km for a 1 km grid). This holds wherever the nearest coastline
+# is inside the raster bounds (everywhere, if the bounds cover the whole coastline)
+# memory: the raster is stored as float32 (4 bytes per node on disk and when sampled),
+# but building it holds the mask, the feature indices, and the float64 distance
+# transform at once - about 34 bytes per node (e.g. 3000 x 2500 km at 1 km is 7.5 million
+# nodes, about 245 MB to build and 30 MB to store). Bounds should cover the points that
+# will be sampled plus their largest distance to the coast, not a whole basin of track points
+def get_distance_raster_error_bound(cell_size):
+  return (0.25 + np.sqrt(2.0)) * cell_size
+
+def get_distance_raster_memory(bounds, cell_size):
+  # about how many MB building (and storing) a raster over bounds takes
+  num_nodes = (np.ceil((bounds[2] - bounds[0]) / cell_size) + 1) * (np.ceil((bounds[3] - bounds[1]) / cell_size) + 1)
+  return num_nodes * 34.0 / (1024.0 * 1024.0), num_nodes * 4.0 / (1024.0 * 1024.0)
+
+def build_distance_raster(coastline_segments, bounds, cell_size):
+  # grid of distances (in crs units) from each node to the coastline
+  xmin, ymin, xmax, ymax = bounds
+  nx = int(np.ceil((xmax - xmin) / cell_size)) + 1
+  ny = int(np.ceil((ymax - ymin) / cell_size)) + 1
+  # points along every coastline segment, no more than cell_size / 2 apart
+  segment_lengths = np.hypot(coastline_segments[:, 2] - coastline_segments[:, 0], coastline_segments[:, 3] - coastline_segments[:, 1])
+  points_per_segment = np.ceil(segment_lengths / (cell_size / 2.0)).astype(int) + 1
+  segment_index = np.repeat(np.arange(len(coastline_segments)), points_per_segment)
+  segment_start = np.cumsum(points_per_segment) - points_per_segment
+  fraction = (np.arange(len(segment_index)) - segment_start[segment_index]) / (points_per_segment[segment_index] - 1)
+  coast_x = coastline_segments[segment_index, 0] + fraction * (coastline_segments[segment_index, 2] - coastline_segments[segment_index, 0])
+  coast_y = coastline_segments[segment_index, 1] + fraction * (coastline_segments[segment_index, 3] - coastline_segments[segment_index, 1])
+  # mark the node nearest to each coastline point
+  node_i = np.rint((coast_x - xmin) / cell_size).astype(int)
+  node_j = np.rint((coast_y - ymin) / cell_size).astype(int)
+  in_grid = (node_i >= 0) & (node_i < nx) & (node_j >= 0) & (node_j < ny)
+  not_coast = np.ones((ny, nx), dtype = bool)
+  not_coast[node_j[in_grid], node_i[in_grid]] = False
+  # distance from every node to the nearest marked node
+  distance_raster = ndimage.distance_transform_edt(not_coast, sampling = cell_size).astype(np.float32)
+  raster_info = {'x0': float(xmin), 'y0': float(ymin), 'cell_size': float(cell_size), 'nx': nx, 'ny': ny,
+                 'error_bound': float(get_distance_raster_error_bound(cell_size))}
+  return distance_raster, raster_info
+
+def get_distance_raster(coastline_segments, bounds, cell_size, cache_dir, crs = None, margin = 0.0, max_build_mb = 4000.0):
+  # load the distance raster for these coastline segments and bounds
+  # (built and saved the first time; bounds are expanded by margin on every side)
+  # rasters that would take more than max_build_mb to build are refused
+  bounds = [bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin]
+  build_memory, raster_memory = get_distance_raster_memory(bounds, cell_size)
+  if build_memory > max_build_mb:
+    raise ValueError('distance raster would take about ' + str(round(build_memory)) + ' MB to build '
+                     '(limit ' + str(round(max_build_mb)) + ' MB), use smaller bounds or a larger cell size')
+  cache_key = hashlib.sha256(np.ascontiguousarray(coastline_segments).tobytes())
+  cache_key.update(json.dumps([float(bound) for bound in bounds] + [float(cell_size)]).encode('utf-8'))
+  raster_path = os.path.join(cache_dir, 'distance_raster_' + cache_key.hexdigest()[:16])
+  if not os.path.exists(raster_path + '.npy'):
+    distance_raster, raster_info = build_distance_raster(coastline_segments, bounds, cell_size)
+    raster_info['crs'] = str(crs)
+    os.makedirs(cache_dir, exist_ok = True)
+    # write georeferencing last, so a raster is only used once it has been fully written
+    np.save(raster_path + '.npy', distance_raster)
+    with open(raster_path + '.json', 'w') as info_file:
+      json.dump(raster_info, info_file, indent = 1)
+  return load_distance_raster(raster_path)
+
+def load_distance_raster(raster_path):
+  # memory-mapped raster (no data is read until it is sampled) and its georeferencing
+  with open(raster_path + '.json') as info_file:
+    raster_info = json.load(info_file)
+  return np.load(raster_path + '.npy', mmap_mode = 'r'), raster_info
+
+def sample_distance_raster(distance_raster, raster_info, x, y):
+  # bilinear interpolation of the raster at arrays of x, y coordinates
+  # (nan for coordinates outside the raster)
+  node_x = (np.asarray(x, dtype = float) - raster_info['x0']) / raster_info['cell_size']
+  node_y = (np.asarray(y, dtype = float) - raster_info['y0']) / raster_info['cell_size']
+  in_raster = (node_x >= 0) & (node_x <= raster_info['nx'] - 1) & (node_y >= 0) & (node_y <= raster_info['ny'] - 1)
+  # lower-left node of the cell containing each point
+  i0 = np.clip(np.floor(node_x), 0, raster_info['nx'] - 2).astype(int)
+  j0 = np.clip(np.floor(node_y), 0, raster_info['ny'] - 2).astype(int)
+  tx = np.clip(node_x - i0, 0.0, 1.0)
+  ty = np.clip(node_y - j0, 0.0, 1.0)
+  distances = ((1.0 - tx) * (1.0 - ty) * distance_raster[j0, i0] + tx * (1.0 - ty) * distance_raster[j0, i0 + 1] + 
+               (1.0 - tx) * ty * distance_raster[j0 + 1, i0] + tx * ty * distance_raster[j0 + 1, i0 + 1])
+  return np.where(in_raster, distances, np.nan)
+
+def check_distance_raster(distance_raster, raster_info, coastline_index, points):
+  # compare raster distances with exact distances for an array of points
+  exact_distances = distance_to_coast(points, coastline_index)
+  raster_distances = sample_distance_raster(distance_raster, raster_info, shapely.get_x(points), shapely.get_y(points))
+  distance_error = np.abs(raster_distances - exact_distances)
+  return {'points': int(np.sum(~np.isnan(distance_error))), 'max_error': float(np.nanmax(distance_error)), 
+          'mean_error': float(np.nanmean(distance_error)), 'error_bound': raster_info['error_bound']}
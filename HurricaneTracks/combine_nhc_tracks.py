@@ -1,8 +1,9 @@
-import pandas as pd
-import numpy as np
-import geopandas as gpd
 import os
 
+from track_functions import combine_event_tracks, update_storm_summary
+from track_functions import get_combined_track_dir, read_combined_tracks
+from instrumentation import stage
+
 # this code reads each individual 
 # hurricane event shapefile and 
 # combines them into one geodataframe
@@ -21,53 +22,29 @@ os.makedirs(combined_dir, exist_ok = True)
 data_type_list = ['points', 'lines']
 ender_list = [['position', 'pts'], ['lin', 'track']]
 
+# also write a shapefile copy of each combined layer
+# (reads every season, so it is off unless a shapefile is needed)
+write_shapefiles = False
+
 # there are four different kinds of nhd track data
 # for each event in database:
 # points, lines, radii, and shape
 # we want to read and combine each separately
 for dt, ender in zip(data_type_list, ender_list):
-  # initialized combined gdf
-  all_tracks = gpd.GeoDataFrame()
-  all_geoms = [] # list to store geometries
-  # loop through all event folders
-  # each folder contains nhd data from a single event
-  tot_len = 0
-  for hurricane_event in os.listdir(output_dir):
-    if os.path.isdir(os.path.join(output_dir, hurricane_event)):
-      
-      # filenames can change over the course of the simulation
-      # loop through each potential name - try to find one that
-      # exists
-      pt_cnt = 0
-      for shp_end in ender:
-        try:
-          # read single-event data
-          hurricane_path = gpd.read_file(os.path.join(output_dir, hurricane_event, hurricane_event + '_' + shp_end + '.shp'))
-        except:
-          pt_cnt += 1
-      # if at least one of the files exist,
-      # add it to the combined dataset
-      if pt_cnt < len(ender):
-        tot_len += len(hurricane_path.index)
-        # extract year from event name
-        year_use = int(hurricane_event[4:8])
-        # combine each line or windswath into a
-        # single geometry for each event
-        # points/radii are left as multiple geometries
-        if dt == 'shape' or dt == 'lines':
-          hurricane_path = hurricane_path.dissolve()
-        # add in a data column for the year of the event
-        year_col = pd.DataFrame(np.ones(len(hurricane_path.index)) * year_use, columns = ['TCYR'])
-        hurricane_path = pd.concat([hurricane_path,year_col], axis = 1)
-        # add in this event to combined gdf
-        all_tracks = pd.concat([all_tracks, hurricane_path], axis = 0)
-        # keep track of geometry
-        for index, row in hurricane_path.iterrows():
-          all_geoms.append(row.geometry)
-      else:
-        print('no data ' + hurricane_event + ' ' + dt) # make note if data reads an error
-  # use all_geoms to make the new geodataframe
-  all_tracks = gpd.GeoDataFrame(all_tracks, geometry = all_geoms, crs = hurricane_path.crs)
-  all_tracks = all_tracks.to_crs(epsg = 3857)
-  # write to file
-  all_tracks.to_file(os.path.join(combined_dir, 'combined_tracks_' + dt + '.shp'))
+  # combined tracks are stored as one GeoParquet file per season with a manifest
+  # of the event files they include, so only new or changed events are read
+  # and only their seasons are rewritten
+  with stage('combine ' + dt) as timer:
+    changed_seasons, read_events = combine_event_tracks(output_dir, combined_dir, dt, ender, epsg = 3857)
+    timer.rows = len(read_events)
+  print(dt + ': read ' + str(len(read_events)) + ' new or changed events, rewrote ' + str(len(changed_seasons)) + ' seasons')
+  # write shapefile copy to file
+  if write_shapefiles:
+    with stage('write shapefile ' + dt):
+      all_tracks = read_combined_tracks(get_combined_track_dir(combined_dir, dt))
+      all_tracks.to_file(os.path.join(combined_dir, 'combined_tracks_' + dt + '.shp'))
+  # per-storm summary (peak intensity/location, names, times)
+  # used by the exposure scripts (only storms in changed seasons are rebuilt)
+  if dt == 'points':
+    with stage('storm summary'):
+      update_storm_summary(combined_dir, changed_seasons)
@@ -0,0 +1,102 @@
+import geopandas as gpd
+import functools
+import hashlib
+import os
+
+from track_functions import read_storm_summary, get_combined_track_dir, read_combined_tracks
+
+# shared loaders for the layers every script reads (states, track points/lines,
+# storm summary, census tracts)
+# each layer is projected once per crs and the projected copy is kept as GeoParquet
+# in layer_cache_dir (named by the source file's name, size, and modification time),
+# so later runs in any script read the projected copy instead of re-projecting
+# loads are also memoized in the running process (e.g. notebook cells, or
+# get_hurricane_exposure called for several exposure layers), and a changed
+# source file is read again. Callers get a deep copy, so changing a loaded
+# layer (adding columns or editing values in place) does not change the memoized one
+
+layer_cache_dir = os.environ.get('HURRICANE_LAYER_CACHE', 'projected_layers')
+default_state_path = os.path.join('cb_2018_us_state_500k', 'cb_2018_us_state_500k.shp')
+default_tract_path = os.path.join('CensusTracts', 'census_tracts_with_population.parquet')
+
+def get_layer_fingerprint(layer_path):
+  # name, size, and modification time of a layer file
+  # (for shapefiles, of every file that makes up the layer, and for
+  # combined track folders, of every season file)
+  layer_dir, layer_name = os.path.split(layer_path)
+  layer_stem, layer_ext = os.path.splitext(layer_name)
+  if os.path.isdir(layer_path):
+    layer_dir = layer_path
+    layer_files = sorted(os.listdir(layer_path))
+  elif layer_ext == '.shp':
+    layer_files = [file_name for file_name in sorted(os.listdir(layer_dir or '.')) if os.path.splitext(file_name)[0] == layer_stem]
+  else:
+    layer_files = [layer_name,]
+  fingerprint = hashlib.sha256(os.path.abspath(layer_path).encode('utf-8'))
+  for file_name in layer_files:
+    file_stat = os.stat(os.path.join(layer_dir, file_name))
+    fingerprint.update((file_name + ' ' + str(file_stat.st_size) + ' ' + str(file_stat.st_mtime_ns) + '\n').encode('utf-8'))
+  return fingerprint.hexdigest()
+
+@functools.lru_cache(maxsize = 32)
+def _load_layer(layer_path, epsg, columns, fingerprint):
+  # fingerprint is only part of the memo key (a changed file is a new key)
+  read_columns = None if columns is None else list(columns)
+  # combined tracks are a folder with one GeoParquet file per season
+  is_parquet = os.path.isdir(layer_path) or layer_path.endswith('.parquet')
+  read_parquet = read_combined_tracks if os.path.isdir(layer_path) else gpd.read_parquet
+  if epsg is None and is_parquet:
+    return read_parquet(layer_path, columns = read_columns)
+  layer_stem = os.path.splitext(os.path.basename(layer_path))[0]
+  cache_path = os.path.join(layer_cache_dir, layer_stem + '_' + str(epsg) + '_' + fingerprint[:16] + '.parquet')
+  if os.path.exists(cache_path):
+    return gpd.read_parquet(cache_path, columns = read_columns)
+  # all columns are projected and cached, so any set of columns can be read from the copy
+  if is_parquet:
+    layer_gdf = read_parquet(layer_path)
+  else:
+    layer_gdf = gpd.read_file(layer_path)
+  if epsg is not None:
+    if is_parquet and layer_gdf.crs is not None and layer_gdf.crs.to_epsg() == epsg:
+      # already GeoParquet in the requested crs, no copy needed
+      return layer_gdf if read_columns is None else layer_gdf[read_columns]
+    layer_gdf = layer_gdf.to_crs(epsg = epsg)
+  os.makedirs(layer_cache_dir, exist_ok = True)
+  layer_gdf.to_parquet(cache_path + '.part')
+  os.replace(cache_path + '.part', cache_path)
+  return layer_gdf if read_columns is None else layer_gdf[read_columns]
+
+def load_layer(layer_path, epsg = None, columns = None):
+  # any shapefile or GeoParquet layer, projected to epsg (None keeps the file's crs)
+  # the geometry column is always read, so the result is always a geodataframe
+  if columns is not None:
+    columns = tuple(columns) + (('geometry',) if 'geometry' not in columns else ())
+  return _load_layer(layer_path, epsg, columns, get_layer_fingerprint(layer_path)).copy(deep = True)
+
+def load_states(epsg = None, state_path = default_state_path):
+  return load_layer(state_path, epsg = epsg)
+
+def get_track_path(combined_dir, dt):
+  # season files of the combined tracks if they have been written, otherwise the shapefile
+  track_dir = get_combined_track_dir(combined_dir, dt)
+  if os.path.isdir(track_dir):
+    return track_dir
+  return os.path.join(combined_dir, 'combined_tracks_' + dt + '.shp')
+
+def load_track_points(epsg = None, combined_dir = 'combined_tracks'):
+  return load_layer(get_track_path(combined_dir, 'points'), epsg = epsg)
+
+def load_track_lines(epsg = None, combined_dir = 'combined_tracks'):
+  return load_layer(get_track_path(combined_dir, 'lines'), epsg = epsg)
+
+def load_storm_summary(epsg = None, combined_dir = 'combined_tracks'):
+  summary_path = os.path.join(combined_dir, 'storm_summary.parquet')
+  if not os.path.exists(summary_path):
+    # built from the combined points (not cached until combine_nhc_tracks.py writes it)
+    return read_storm_summary(combined_dir, epsg = epsg)
+  return load_layer(summary_path, epsg = epsg)
+
+def load_tracts(epsg = None, columns = ['Population', 'geometry'], tract_path = default_tract_path):
+  # census tracts with population, indexed by tract id (see read_population_tracts)
+  read_columns = ['GEOID',] + [column for column in columns if column != 'GEOID']
+  return load_layer(tract_path, epsg = epsg, columns = read_columns).set_index('GEOID').rename_axis(None)
@@ -0,0 +1,174 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import hashlib
+import json
+import os
+
+def make_session(max_connections = 8, retries = 5, backoff_factor = 0.5):
+  # one session shares pooled connections between all requests
+  # failed requests (connection errors, 429/5xx) are retried with
+  # exponential backoff: backoff_factor * 2 ** (retry number - 1) seconds
+  retry = Retry(total = retries, backoff_factor = backoff_factor,
+                status_forcelist = [429, 500, 502, 503, 504], allowed_methods = ['GET', 'HEAD'])
+  adapter = HTTPAdapter(pool_connections = max_connections, pool_maxsize = max_connections, max_retries = retry)
+  session = requests.Session()
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+  return session
+
+def get_cache_paths(cache_dir, url):
+  # cached files are named by a hash of the url
+  url_key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+  return os.path.join(cache_dir, url_key + '.bin'), os.path.join(cache_dir, url_key + '.json')
+
+def fetch_cached(session, url, cache_dir, timeout = 60):
+  # download url, using a local copy if the server says it has not changed
+  # returns (status, content) where status is one of
+  # 'downloaded' (new or changed file), 'cached' (local copy still current),
+  # 'missing' (404, no file on the server) or 'error'
+  os.makedirs(cache_dir, exist_ok = True)
+  content_path, header_path = get_cache_paths(cache_dir, url)
+  # ask the server to only send the file if it changed since the cached copy
+  request_headers = {}
+  if os.path.exists(content_path) and os.path.exists(header_path):
+    with open(header_path) as header_file:
+      cached_headers = json.load(header_file)
+    if cached_headers.get('ETag'):
+      request_headers['If-None-Match'] = cached_headers['ETag']
+    if cached_headers.get('Last-Modified'):
+      request_headers['If-Modified-Since'] = cached_headers['Last-Modified']
+  try:
+    response = session.get(url, headers = request_headers, timeout = timeout)
+  except requests.RequestException as error:
+    return 'error', str(error)
+  if response.status_code == 304:
+    with open(content_path, 'rb') as content_file:
+      return 'cached', content_file.read()
+  if response.status_code == 404:
+    return 'missing', None
+  if response.status_code != 200:
+    return 'error', 'HTTP ' + str(response.status_code)
+  # write file before headers (and via a temporary file) so an
+  # interrupted run never leaves headers for an incomplete file
+  with open(content_path + '.tmp', 'wb') as content_file:
+    content_file.write(response.content)
+  os.replace(content_path + '.tmp', content_path)
+  with open(header_path, 'w') as header_file:
+    json.dump({'url': url, 'ETag': response.headers.get('ETag'),
+               'Last-Modified': response.headers.get('Last-Modified')}, header_file)
+  return 'downloaded', response.content
+
+def get_resume_headers(part_path):
+  # Range request for the rest of a partial download, sent with If-Range so the
+  # server sends the whole file (200) instead if it changed since the partial
+  # file was started (validator saved next to the partial file)
+  # returns None if the partial file can't be resumed safely
+  validator_path = part_path + '.json'
+  if not os.path.exists(validator_path):
+    return None
+  with open(validator_path) as validator_file:
+    part_validator = json.load(validator_file)
+  # If-Range needs a strong ETag, otherwise the modification date is used
+  if part_validator.get('ETag') and not part_validator['ETag'].startswith('W/'):
+    if_range = part_validator['ETag']
+  elif part_validator.get('Last-Modified'):
+    if_range = part_validator['Last-Modified']
+  else:
+    return None
+  return {'Range': 'bytes=' + str(os.path.getsize(part_path)) + '-', 'If-Range': if_range}
+
+def get_range_start(content_range):
+  # first byte of a 206 response ('bytes 1000-1999/2000' -> 1000), None if it can't be read
+  try:
+    return int(content_range.split()[1].split('-')[0])
+  except (AttributeError, IndexError, ValueError):
+    return None
+
+def remove_partial_download(part_path):
+  for old_path in [part_path, part_path + '.json']:
+    if os.path.exists(old_path):
+      os.remove(old_path)
+
+def download_to_file(session, url, output_path, chunk_size = 1024 * 1024, timeout = 60, attempts = 5):
+  # stream url to output_path in chunks, so only one chunk is held in memory
+  # data is written to output_path + '.part' first, and an interrupted
+  # download is resumed from the end of the partial file with an HTTP Range request
+  # (only if the file on the server is still the one the partial file came from)
+  # returns 'downloaded', 'missing' (404) or 'error'
+  part_path = output_path + '.part'
+  for attempt in range(attempts):
+    request_headers = {}
+    if os.path.exists(part_path) and os.path.getsize(part_path) > 0:
+      request_headers = get_resume_headers(part_path)
+      if request_headers is None:
+        # no validator for the partial file, start over
+        remove_partial_download(part_path)
+        request_headers = {}
+    try:
+      with session.get(url, headers = request_headers, stream = True, timeout = timeout) as response:
+        if response.status_code == 404:
+          return 'missing'
+        if response.status_code == 416:
+          # partial file does not match the file on the server, start over
+          remove_partial_download(part_path)
+          continue
+        if response.status_code not in [200, 206]:
+          return 'error'
+        if response.status_code == 206:
+          # server sent the rest of the file, it has to start where the partial file ends
+          part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+          if get_range_start(response.headers.get('Content-Range')) != part_size:
+            remove_partial_download(part_path)
+            continue
+          write_mode = 'ab'
+        else:
+          # server sent the whole file (new download, or the file changed on the server)
+          # the validator is saved before any data, so a resumed download can be checked
+          with open(part_path + '.json', 'w') as validator_file:
+            json.dump({'url': url, 'ETag': response.headers.get('ETag'),
+                       'Last-Modified': response.headers.get('Last-Modified')}, validator_file)
+          write_mode = 'wb'
+        with open(part_path, write_mode) as part_file:
+          for chunk in response.iter_content(chunk_size = chunk_size):
+            part_file.write(chunk)
+    except requests.RequestException:
+      # keep the partial file, the next attempt picks up where this one stopped
+      continue
+    os.replace(part_path, output_path)
+    remove_partial_download(part_path)
+    return 'downloaded'
+  return 'error'
+
+def get_file_checksum(file_path, chunk_size = 1024 * 1024):
+  # sha256 of a file, read in chunks
+  checksum = hashlib.sha256()
+  with open(file_path, 'rb') as checked_file:
+    for chunk in iter(lambda: checked_file.read(chunk_size), b''):
+      checksum.update(chunk)
+  return checksum.hexdigest()
+
+def get_folder_checksums(folder_path):
+  # sha256 of every file in a folder, keyed by file name
+  return {file_name: get_file_checksum(os.path.join(folder_path, file_name)) 
+          for file_name in sorted(os.listdir(folder_path))}
+
+def folder_matches_checksums(folder_path, checksums):
+  # True if every recorded file exists and still has the recorded checksum
+  if not checksums or not os.path.isdir(folder_path):
+    return False
+  for file_name, checksum in checksums.items():
+    file_path = os.path.join(folder_path, file_name)
+    if not os.path.exists(file_path) or get_file_checksum(file_path) != checksum:
+      return False
+  return True
+
+def get_layer_checksum(shp_path):
+  # checksum of all files that make up a shapefile (.shp, .shx, .dbf, .prj, ...)
+  layer_dir, shp_name = os.path.split(shp_path)
+  layer_stem = os.path.splitext(shp_name)[0]
+  checksum = hashlib.sha256()
+  for file_name in sorted(os.listdir(layer_dir or '.')):
+    if os.path.splitext(file_name)[0] == layer_stem:
+      checksum.update((file_name + ' ' + get_file_checksum(os.path.join(layer_dir, file_name)) + '\n').encode('utf-8'))
+  return checksum.hexdigest()
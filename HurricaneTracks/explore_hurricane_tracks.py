@@ -1,4 +1,3 @@
-import pandas as pd
 import numpy as np
 import geopandas as gpd
 from matplotlib import cm, colors, pyplot
@@ -6,6 +5,11 @@ from scipy.stats import poisson
 import os
 import seaborn as sns
 
+from landfall_functions import count_state_landfalls, count_state_exceedances
+from landfall_functions import clip_tracks_by_state_cached
+from data_access_functions import load_states, load_track_lines, load_track_points, get_track_path
+from instrumentation import stage
+
 # this script calculates and visualizes
 # the frequency of atlantic tropical cyclones
 ###########################################################################################
@@ -13,14 +17,17 @@ import seaborn as sns
 ###########################################################################################
 # load combined hurricane track file
 output_dir = 'combined_tracks'
-file_name = os.path.join(output_dir, output_dir + '_lines.shp')
-all_hurricane_lines = gpd.read_file(file_name) # read file
-all_hurricane_lines = all_hurricane_lines.to_crs(epsg = 3857) # set coordinate projection
+# (layers are read through data_access_functions, which keeps
+# projected copies in projected_layers)
+with stage('read track lines') as timer:
+  all_hurricane_lines = load_track_lines(epsg = 3857, combined_dir = output_dir) # read file + set coordinate projection
+  timer.rows = len(all_hurricane_lines.index)
 
 # load state boundaries
 state_path = 'cb_2018_us_state_500k'
-us_states = gpd.read_file(os.path.join(state_path, state_path + '.shp')) # read file
-us_states = us_states.to_crs(epsg = 3857) # set coordinate projection
+with stage('read states') as timer:
+  us_states = load_states(epsg = 3857, state_path = os.path.join(state_path, state_path + '.shp')) # read file + set coordinate projection
+  timer.rows = len(us_states.index)
 
 # visualize combined data
 fig, ax = pyplot.subplots(figsize = (16, 12))
@@ -38,7 +45,8 @@ cax = ax.inset_axes([-0.125, 0.1, 0.05, 0.8], transform=ax.transAxes)
 clb = fig.colorbar(cm.ScalarMappable(norm=norm, cmap='YlOrBr'),
              ax=ax, cax = cax, ticks=[2010, 2015, 2020, 2025])
 # save figure
-pyplot.savefig('hurricane_tracks_preliminary.png', bbox_inches='tight', dpi = 150)
+with stage('savefig track map'):
+  pyplot.savefig('hurricane_tracks_preliminary.png', bbox_inches='tight', dpi = 150)
 pyplot.close()
 
 ########################################################################################
@@ -50,18 +58,12 @@ pyplot.close()
 ###########################################################################################
 ### Creating Tropical Cyclone Timeseries ##################################################
 ###########################################################################################
-hurricane_rates = pd.DataFrame(index = np.arange(2010, 2025),
-                               columns = ['Total',])
-
-# make a new column in the dataframe 
-# to store all landfalling hurricanes
-hurricane_rates['Total'] = np.zeros(len(hurricane_rates.index))
-
-# loop through each row of geodataframe
-for index, row in all_hurricane_lines.iterrows():
-  # each row represents a separate event
-  # the year of the event is stored in the 'TCYR' column
-  hurricane_rates.loc[int(row['TCYR']), 'Total'] += 1.0
+# count tracks in each year (Total) and tracks that
+# intersect each state in each year, with one spatial join
+# of all tracks against all states
+with stage('state landfall counts') as timer:
+  hurricane_rates = count_state_landfalls(all_hurricane_lines, us_states, np.arange(2010, 2025))
+  timer.rows = len(all_hurricane_lines.index)
 
 # visualize timeseries data
 # initialize a new figure
@@ -84,26 +86,9 @@ pyplot.close()
 ###########################################################################################
 ### Creating Tropical Cyclone Timeseries By State #########################################
 ###########################################################################################
-# this loops through each row in the 'us_states' geodataframe
-# each row represents a single state
-for idx, row in us_states.iterrows():
-  # use geodataframe index to isolate each state
-  # this is called a dataframe 'slice'
-  this_state = us_states[us_states.index == idx]
-  # find all hurricane tracks that intersect
-  # the state with 'sjoin' function in geopandas
-  hurricane_state_pth = gpd.sjoin(all_hurricane_lines, this_state, 
-                                  how = 'inner', predicate = 'intersects')  
-  # add a new column to our hurricane count dataframe
-  state_name = row['NAME'] # name of state from us_states dataframe
-  hurricane_rates[state_name] = np.zeros(len(hurricane_rates.index))
-  # loop through all hurricane events that intersect state
-  for idx_event, row_event in hurricane_state_pth.iterrows():
-    # find the year of the event
-    year_event = int(row_event['TCYR'])
-    # record 
-    hurricane_rates.loc[year_event, state_name] += 1.0
-    
+# number of tracks that intersect each state in each year
+# was counted above (one column per state in hurricane_rates)
+# write year x state table so figures can be made without recounting
 hurricane_rates.to_csv('hurricane_landfall_timeseries.csv')    
 ########################################################################################
 
@@ -153,23 +138,24 @@ pyplot.close()
 fig, ax = pyplot.subplots(figsize = (16, 16))
 # colorbar for choropleth
 track_colors = sns.color_palette('RdYlBu_r', 30)
-# this loops through each row in the 'us_states' geodataframe
-# each row represents a single state
-for idx, row in us_states.iterrows():
-  # use geodataframe index to isolate each state
-  # this is called a dataframe 'slice'
-  this_state = us_states[us_states.index == idx]
-  # find all hurricane tracks that intersect
-  # the state with 'overlay' function in geopandas
-  # this is like sjoin but it clips the lines inside the state boundary
-  hurricane_state_pth = gpd.overlay(all_hurricane_lines, this_state, how = 'intersection')
-  # only plot states that intersect iwth hurricane tracks
-  if len(hurricane_state_pth) > 0:
-    # color state based on the total number of hurricanes tracks that intersect
-    number_of_hurricanes = len(hurricane_state_pth.index)
-    this_state.plot(ax = ax, facecolor = track_colors[number_of_hurricanes - 1], 
-                    edgecolor = 'black', linewidth = 1.0, alpha = 1.0)
-    hurricane_state_pth.plot(ax = ax, color = 'slategray', linewidth = 1.5, linestyle = '--')
+# clip all hurricane tracks to the boundary of every state they cross
+# (like 'overlay' for each state, but with one spatial index query)
+# clipped tracks are cached in 'clipped_tracks', so redrawing the map only
+# repeats this step if the track/state files or the settings below change
+state_simplify_tolerance = None # e.g. 1000.0 to clip against states simplified to 1 km
+with stage('clip tracks by state') as timer:
+  clipped_tracks, track_counts = clip_tracks_by_state_cached(all_hurricane_lines, us_states, 
+                                                             [get_track_path(output_dir, 'lines'), 
+                                                              os.path.join(state_path, state_path + '.shp')], 
+                                                             'clipped_tracks', simplify_tolerance = state_simplify_tolerance)
+  timer.rows = len(clipped_tracks.index)
+# only plot states that intersect with hurricane tracks
+states_with_tracks = us_states[track_counts.to_numpy() > 0]
+number_of_hurricanes = track_counts.to_numpy()[track_counts.to_numpy() > 0]
+# color state based on the total number of hurricanes tracks that intersect
+states_with_tracks.plot(ax = ax, color = [track_colors[n - 1] for n in number_of_hurricanes], 
+                        edgecolor = 'black', linewidth = 1.0, alpha = 1.0)
+clipped_tracks.plot(ax = ax, color = 'slategray', linewidth = 1.5, linestyle = '--')
 
 # Take annual mean of landfalls in each state, sort the states lowest to highest
 sorted_hurricane_rates = np.sort(np.asarray(hurricane_rates.mean()))
@@ -192,7 +178,8 @@ clb.ax.tick_params(labelsize=20)
 clb.ax.set_title('Total Hurricane Landfalls, 2010 - 2024',fontsize=22)
 # save figure
 ax.axis('off')
-pyplot.savefig('landfalls_by_state.png', bbox_inches='tight', dpi = 150)
+with stage('savefig landfall map'):
+  pyplot.savefig('landfalls_by_state.png', bbox_inches='tight', dpi = 150)
 pyplot.close()
 ########################################################################################
 
@@ -202,15 +189,17 @@ pyplot.close()
 # load combined hurricane track file
 output_dir = 'combined_tracks'
 # load combined file with points and windspeeds
-file_name = os.path.join(output_dir, output_dir + '_points.shp')
-all_hurricane_points = gpd.read_file(file_name) # read file
-all_hurricane_points = all_hurricane_points.to_crs(epsg = 3857) # set coordinate projection
+with stage('read track points') as timer:
+  all_hurricane_points = load_track_points(epsg = 3857, combined_dir = output_dir) # read file + set coordinate projection
+  timer.rows = len(all_hurricane_points.index)
 # initialize figure
 fig, ax = pyplot.subplots(figsize = (16,16))
 # only keep hurricane points within the boundaries of the us
-us_hr_pnts = gpd.sjoin(all_hurricane_points, us_states, how = 'inner', predicate = 'within')
-# only keep us states with hurricane point contained within boundary
-states_hr = gpd.sjoin(us_states, all_hurricane_points, how = 'inner', predicate = 'contains')
+with stage('points in states sjoin') as timer:
+  us_hr_pnts = gpd.sjoin(all_hurricane_points, us_states, how = 'inner', predicate = 'within')
+  # only keep us states with hurricane point contained within boundary
+  states_hr = gpd.sjoin(us_states, all_hurricane_points, how = 'inner', predicate = 'contains')
+  timer.rows = len(us_hr_pnts.index)
 #plot clipped states + hurricane points
 states_hr.plot(ax = ax, facecolor = 'steelblue', edgecolor = 'black')
 # color hurricane points by INTENSITY (windspeed in knots)
@@ -224,7 +213,8 @@ clb.ax.tick_params(labelsize=20)
 clb.ax.set_title('6-hour Average Windspeed',fontsize=22)
 # save figure
 ax.axis('off')
-pyplot.savefig('windspeeds.png', bbox_inches='tight', dpi = 150)
+with stage('savefig windspeed map'):
+  pyplot.savefig('windspeeds.png', bbox_inches='tight', dpi = 150)
 pyplot.close()
 ###########################################################################################
 
@@ -233,51 +223,36 @@ pyplot.close()
 ###########################################################################################
 # initialize figure
 fig, ax = pyplot.subplots(figsize = (12,6))
-other_states = gpd.GeoDataFrame() # dataframe to store hurricanes in minor states
 cumulative_hours = np.zeros(30) # forms the bottom of the stacked bar chart
 state_colors = sns.color_palette('cubehelix', 10) # colors for plot
 st_cnt = 0 # state counter
+# use five knot time step
+knot_vals = np.arange(1, 31) * 5.0
+# find total number of 6-hour timesteps where hurricane track windspeeds
+# were above each threshold, for all states with one spatial join
+# each timestep is 6 hours, divided by 15 year timeperiod
+# if only a small number of landfalling hurricanes
+# points are added to the 'Other States' row
+with stage('state windspeed exceedances') as timer:
+  state_hours = count_state_exceedances(all_hurricane_points, us_states, knot_vals, 6.0 / 15.0, 
+                                        min_points = 21, other_hours_per_point = 0.25)
+  timer.rows = len(all_hurricane_points.index)
+# write state x threshold table so figures can be made without recounting
+state_hours.to_csv('wind_hazard_by_state.csv')
+start_position = 0 # set to 11 to plot > 60 knots only
 # loop through all states
-for idx, row in us_states.iterrows():
-  # use geodataframe index to isolate each state
-  # this is called a dataframe 'slice'
-  this_state = us_states[us_states.index == idx]
-  # find all hurricane tracks that intersect
-  # the state with 'overlay' function in geopandas
-  # this is like sjoin but it clips the lines inside the state boundary
-  hurricane_state_pnts = gpd.sjoin(all_hurricane_points, this_state, how = 'inner', 
-                                   predicate = 'within')
-  # if only a small number of landfalling hurricanes
-  # add points to 'other' geodataframe
-  if len(hurricane_state_pnts.index) < 21:
-    other_states = pd.concat([other_states, hurricane_state_pnts])
+for state_name, total_hours in state_hours.iterrows():
+  total_hours = total_hours.to_numpy()
+  if state_name == 'Other States':
+    # plot bars for 'other' category
+    ax.bar(knot_vals[start_position:], total_hours[start_position:], bottom = cumulative_hours[start_position:], 
+           label = 'Other States', width = 4.5)
   else:
-    total_hours = np.zeros(30) # initialize array for number of hours
-    knot_vals = np.zeros(30) # initialize array for windspeeds
-    # loop through different windspeeds, find total number
-    # of 6-hour timesteps where hurricane track windspeeds were abnove threshold
-    for step in range(0, 30):
-      timestep_above = len(hurricane_state_pnts[hurricane_state_pnts['INTENSITY'] > (step + 1) * 5])
-      # each timestep is 6 hours, divided by 15 year timeperiod
-      total_hours[step] = timestep_above * 6.0 / 15.0
-      knot_vals[step] = (step + 1) * 5 # use five knot time step
-    if len(hurricane_state_pnts.index) > 0:
-      start_position = 0 # set to 11 to plot > 60 knots only
-      ax.bar(knot_vals[start_position:], total_hours[start_position:], 
-             bottom = cumulative_hours[start_position:], label = row['NAME'], color = state_colors[st_cnt], 
-             width = 4.5)
-      st_cnt += 1
-      cumulative_hours += total_hours # bottom of next bar
-# plot bars for 'other' category
-total_hours = np.zeros(30)
-knot_vals = np.zeros(30)
-for step in range(0, 30):
-  timestep_above = len(other_states[other_states['INTENSITY'] > (step + 1) * 5])
-  total_hours[step]= timestep_above * 0.25
-  knot_vals[step] = (step + 1)*5
-if len(other_states.index) > 0:
-  ax.bar(knot_vals[start_position:], total_hours[start_position:], bottom = cumulative_hours[start_position:], 
-         label = 'Other States', width = 4.5)
+    ax.bar(knot_vals[start_position:], total_hours[start_position:], 
+           bottom = cumulative_hours[start_position:], label = state_name, color = state_colors[st_cnt], 
+           width = 4.5)
+    st_cnt += 1
+    cumulative_hours += total_hours # bottom of next bar
 # format plot
 ax.legend(fontsize = 18, ncol = 2)
 ax.set_ylabel('Hours per Year Above Windspeed', fontsize = 22) 
@@ -1,80 +1,256 @@
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
+import hashlib
 import os
 import matplotlib.pyplot as plt
 import seaborn as sns
 #import pyproj
 #pyproj.network.set_network_enabled(False)
 
-def get_hurricane_exposure(exposure_gdf, exposure_column, exposure_label): 
-  hurricane_pathway = os.path.join('combined_tracks', 'combined_tracks_points.shp')
-  all_hurricane_points = gpd.read_file(hurricane_pathway) # read file
-  all_hurricane_points = all_hurricane_points.to_crs(epsg = 32618)
-  # find only points that fall within one of the census tracts
-  # get a list of the range of years
-  all_years = all_hurricane_points['TCYR'].unique()
-  # initialize dataframe to store populations
-  hurricane_classification_df = pd.DataFrame()
-  hurricane_counter = 0 # count of hurricanes
-  # loop through all years in range
+from data_access_functions import load_storm_summary
+from instrumentation import stage
+
+def exposure_column_name(exposure_label, buffer_radius):
+  # column label used in the exposure tables, e.g. 'Exposed Population < 50km'
+  return 'Exposed ' + exposure_label + ' < ' + str(int(buffer_radius/1000.0)) + 'km'
+
+def find_storm_exposure_pairs(exposure_gdf, storm_points, max_radius):
+  # find every (storm, exposed shape) pair within max_radius of the storm point
+  # (max_radius is one distance for all storms, or an array with one per storm)
+  # one spatial index over the exposure layer is queried for all storms at once
+  # returns storm positions, exposure positions, and the distance between them
+  # (exposure_gdf must be in the same crs as storm_points)
+  storm_geoms = storm_points.geometry.values
+  exposure_geoms = exposure_gdf.geometry.values
+  max_radius = np.broadcast_to(np.asarray(max_radius, dtype = float), (len(storm_geoms),))
+  # bulk query - pairs of (storm, exposed shape) inside the bounding box
+  # of the largest radius (box queries are much faster than 'dwithin')
+  storm_x = shapely.get_x(storm_geoms)
+  storm_y = shapely.get_y(storm_geoms)
+  search_boxes = shapely.box(storm_x - max_radius, storm_y - max_radius, storm_x + max_radius, storm_y + max_radius)
+  storm_idx, exposure_idx = exposure_gdf.sindex.query(search_boxes)
+  # distance between the storm point and the closest part of each exposed shape
+  if np.all(shapely.get_type_id(exposure_geoms) == 0):
+    # exposure points (e.g. parcels) - distance straight from the coordinates
+    distances = np.hypot(shapely.get_x(exposure_geoms)[exposure_idx] - storm_x[storm_idx], 
+                         shapely.get_y(exposure_geoms)[exposure_idx] - storm_y[storm_idx])
+  else:
+    distances = shapely.distance(storm_geoms[storm_idx], exposure_geoms[exposure_idx])
+  # drop shapes in the corners of the box, outside the largest radius
+  in_radius = distances <= max_radius[storm_idx]
+  return storm_idx[in_radius], exposure_idx[in_radius], distances[in_radius]
+
+def sum_radius_exposure(storm_idx, exposure_values, distances, num_storms, buffer_radii):
+  # total exposure within each buffer radius of every storm, from (storm, exposed shape) pairs
+  # each exposed shape is binned into nested rings by its distance to the storm
+  # returns a (storm x radius) array, radii in the order given
+  # sort radii smallest to largest (these are the outer edges of each ring)
+  ring_edges = np.sort(np.asarray(buffer_radii, dtype = float))
+  # smallest ring that contains each exposed shape
+  ring_idx = np.searchsorted(ring_edges, distances, side = 'left')
+  in_rings = ring_idx < len(ring_edges)
+  # sum exposure in each (storm, ring) bin
+  ring_sums = np.bincount(storm_idx[in_rings] * len(ring_edges) + ring_idx[in_rings], weights = exposure_values[in_rings], 
+                          minlength = num_storms * len(ring_edges))
+  # rings are nested, so exposure within a radius is the sum of all smaller rings
+  radius_sums = np.cumsum(ring_sums.reshape(num_storms, len(ring_edges)), axis = 1)
+  return radius_sums[:, np.searchsorted(ring_edges, np.asarray(buffer_radii, dtype = float))]
+
+# area fractions of the shapes that cross a buffer edge, kept for the rest of the run
+# {(layer key, storm x, storm y, buffer radius): (exposure positions, area fractions)}
+_area_fraction_cache = {}
+
+def get_layer_key(exposure_geoms):
+  # cheap fingerprint of an exposure layer (the bounds of every shape)
+  return hashlib.sha1(shapely.bounds(exposure_geoms).tobytes()).hexdigest()
+
+def get_area_fractions(exposure_geoms, exposure_areas, storm_geoms, storm_idx, exposure_idx, distances, buffer_radius, layer_key):
+  # fraction of each exposed shape's area that is within buffer_radius of the storm point, for every pair
+  # shapes whose bounding box is inside the circle count fully, shapes farther than
+  # buffer_radius not at all, and only the shapes that cross the edge of the circle
+  # are intersected with it (points and other shapes without area count fully if they are within the radius)
+  # fractions for each (storm, radius) are memoized, so repeated calls skip the intersections
+  area_fractions = (distances <= buffer_radius).astype(float)
+  storm_x = shapely.get_x(storm_geoms)
+  storm_y = shapely.get_y(storm_geoms)
+  exposure_bounds = shapely.bounds(exposure_geoms[exposure_idx])
+  # farthest corner of each shape's bounding box from the storm point
+  corner_distances = np.hypot(np.maximum(np.abs(storm_x[storm_idx] - exposure_bounds[:, 0]), np.abs(storm_x[storm_idx] - exposure_bounds[:, 2])),
+                              np.maximum(np.abs(storm_y[storm_idx] - exposure_bounds[:, 1]), np.abs(storm_y[storm_idx] - exposure_bounds[:, 3])))
+  boundary_pairs = np.flatnonzero((distances <= buffer_radius) & (corner_distances > buffer_radius) & (exposure_areas[exposure_idx] > 0.0))
+  # boundary pairs grouped by storm, in exposure order within each storm
+  boundary_pairs = boundary_pairs[np.lexsort((exposure_idx[boundary_pairs], storm_idx[boundary_pairs]))]
+  boundary_storms, storm_starts = np.unique(storm_idx[boundary_pairs], return_index = True)
+  storm_ends = np.r_[storm_starts[1:], len(boundary_pairs)]
+  new_pairs = []
+  for storm_num, pair_start, pair_end in zip(boundary_storms, storm_starts, storm_ends):
+    storm_pairs = boundary_pairs[pair_start:pair_end]
+    cached_fractions = _area_fraction_cache.get((layer_key, storm_x[storm_num], storm_y[storm_num], buffer_radius))
+    if cached_fractions is not None and np.array_equal(cached_fractions[0], exposure_idx[storm_pairs]):
+      area_fractions[storm_pairs] = cached_fractions[1]
+    else:
+      new_pairs.append(storm_pairs)
+  if len(new_pairs) > 0:
+    # one vectorized intersection for all pairs that are not cached
+    new_pairs = np.concatenate(new_pairs)
+    new_storms, storm_pos = np.unique(storm_idx[new_pairs], return_inverse = True)
+    storm_circles = shapely.buffer(storm_geoms[new_storms], buffer_radius, quad_segs = 32)
+    intersected_areas = shapely.area(shapely.intersection(exposure_geoms[exposure_idx[new_pairs]], storm_circles[storm_pos]))
+    area_fractions[new_pairs] = np.minimum(intersected_areas / exposure_areas[exposure_idx[new_pairs]], 1.0)
+    new_starts = np.r_[0, np.flatnonzero(np.diff(storm_pos)) + 1, len(new_pairs)]
+    for storm_num, pair_start, pair_end in zip(new_storms, new_starts[:-1], new_starts[1:]):
+      storm_pairs = new_pairs[pair_start:pair_end]
+      _area_fraction_cache[(layer_key, storm_x[storm_num], storm_y[storm_num], buffer_radius)] = (exposure_idx[storm_pairs], area_fractions[storm_pairs])
+  return area_fractions
+
+def calculate_radius_exposure(exposure_gdf, exposure_column, storm_points, buffer_radii, weighting = 'intersects'):
+  # find the total exposure within each buffer radius of every storm point
+  # weighting = 'intersects' counts all of a shape's exposure if any part of it is within the radius,
+  # 'area' counts the fraction of the shape's area that is within the radius
+  # (exposure is assumed to be spread evenly over each shape)
+  if weighting not in ['intersects', 'area']:
+    raise ValueError("weighting must be 'intersects' or 'area'")
+  if exposure_gdf.crs != storm_points.crs:
+    with stage('reproject exposure') as timer:
+      exposure_gdf = exposure_gdf.to_crs(storm_points.crs)
+      timer.rows = len(exposure_gdf.index)
+  with stage('exposure pairs') as timer:
+    storm_idx, exposure_idx, distances = find_storm_exposure_pairs(exposure_gdf, storm_points, max(buffer_radii))
+    timer.rows = len(storm_idx)
+  exposure_values = exposure_gdf[exposure_column].to_numpy(dtype = float)[exposure_idx]
+  if weighting == 'intersects':
+    radius_sums = sum_radius_exposure(storm_idx, exposure_values, distances, len(storm_points.index), buffer_radii)
+  else:
+    with stage('area fractions') as timer:
+      exposure_geoms = exposure_gdf.geometry.values
+      exposure_areas = shapely.area(exposure_geoms)
+      layer_key = get_layer_key(exposure_geoms)
+      radius_sums = np.zeros((len(storm_points.index), len(buffer_radii)))
+      for radius_num, buffer_radius in enumerate(buffer_radii):
+        area_fractions = get_area_fractions(exposure_geoms, exposure_areas, storm_points.geometry.values, storm_idx,
+                                            exposure_idx, distances, float(buffer_radius), layer_key)
+        radius_sums[:, radius_num] = np.bincount(storm_idx, weights = exposure_values * area_fractions,
+                                                 minlength = len(storm_points.index))
+      timer.rows = len(storm_idx)
+  return pd.DataFrame(radius_sums, index = storm_points.index, columns = [float(buffer_radius) for buffer_radius in buffer_radii])
+
+def calculate_swath_exposure(exposure_gdf, exposure_column, track_points, buffer_radii, 
+                             min_intensity = 75.0 / 1.15, storm_keys = ['TCYR', 'STORMNUM']):
+  # total exposure within each buffer radius of the swath of every storm -
+  # all track points with INTENSITY above min_intensity (knots), not just the peak
+  # each exposed shape is counted once per storm, at its closest distance to any
+  # swath point (so shapes near several track points are not counted twice)
+  # swath points for all storms are found with one spatial index query
+  # returns exposure (storm x radius) and the highest INTENSITY of the swath points
+  # that are within the largest radius of at least one exposed shape (0 for none),
+  # both indexed by storm_keys
+  if exposure_gdf.crs != track_points.crs:
+    exposure_gdf = exposure_gdf.to_crs(track_points.crs)
+  storm_codes = track_points.groupby(storm_keys, sort = False).ngroup().to_numpy()
+  storm_index = pd.MultiIndex.from_frame(track_points[storm_keys].drop_duplicates())
+  swath_points = (track_points['INTENSITY'] > min_intensity).to_numpy()
+  swath_codes = storm_codes[swath_points]
+  swath_intensity = track_points['INTENSITY'].to_numpy(dtype = float)[swath_points]
+  point_idx, exposure_idx, distances = find_storm_exposure_pairs(exposure_gdf, track_points[swath_points], max(buffer_radii))
+  # closest distance from each exposed shape to each storm's swath
+  num_units = len(exposure_gdf.index)
+  pair_key = swath_codes[point_idx].astype(np.int64) * num_units + exposure_idx
+  pair_order = np.argsort(pair_key, kind = 'stable')
+  pair_key = pair_key[pair_order]
+  key_starts = np.flatnonzero(np.r_[True, pair_key[1:] != pair_key[:-1]]) if len(pair_key) > 0 else np.array([], dtype = int)
+  unit_distance = np.minimum.reduceat(distances[pair_order], key_starts) if len(key_starts) > 0 else distances
+  unit_storm = pair_key[key_starts] // num_units
+  unit_values = exposure_gdf[exposure_column].to_numpy(dtype = float)[pair_key[key_starts] % num_units]
+  radius_sums = sum_radius_exposure(unit_storm, unit_values, unit_distance, len(storm_index), buffer_radii)
+  swath_exposure = pd.DataFrame(radius_sums, index = storm_index, columns = [float(buffer_radius) for buffer_radius in buffer_radii])
+  # strongest swath point that exposes anything
+  exposing_intensity = np.zeros(len(storm_index))
+  np.maximum.at(exposing_intensity, swath_codes[point_idx], swath_intensity[point_idx])
+  return swath_exposure, pd.Series(exposing_intensity, index = storm_index, name = 'INTENSITY')
+
+def find_exposed_units(exposure_gdf, storm_points, buffer_radii):
+  # index labels of the exposure shapes within each buffer radius of every storm point
+  # returns one dictionary per storm, {buffer_radius: array of index labels}
+  if exposure_gdf.crs != storm_points.crs:
+    exposure_gdf = exposure_gdf.to_crs(storm_points.crs)
+  storm_idx, exposure_idx, distances = find_storm_exposure_pairs(exposure_gdf, storm_points, max(buffer_radii))
+  # group pairs by storm
+  storm_order = np.argsort(storm_idx, kind = 'stable')
+  storm_starts = np.searchsorted(storm_idx[storm_order], np.arange(len(storm_points.index) + 1))
+  exposure_labels = exposure_gdf.index.to_numpy()
+  exposed_units = []
+  for storm_num in range(len(storm_points.index)):
+    this_storm = storm_order[storm_starts[storm_num]:storm_starts[storm_num + 1]]
+    exposed_units.append({buffer_radius: exposure_labels[exposure_idx[this_storm][distances[this_storm] <= buffer_radius]]
+                          for buffer_radius in buffer_radii})
+  return exposed_units
+
+def accumulate_radius_exposure(exposure_chunks, exposure_column, storm_points, buffer_radii, weighting = 'intersects'):
+  # same as calculate_radius_exposure, but the exposure layer is given
+  # as an iterator of geodataframe chunks (e.g. batches of parcels read from file)
+  # partial sums are added chunk by chunk, so only one chunk is held in memory
+  radius_exposure = pd.DataFrame(0.0, index = storm_points.index, columns = [float(buffer_radius) for buffer_radius in buffer_radii])
+  for exposure_chunk in exposure_chunks:
+    if len(exposure_chunk.index) > 0:
+      radius_exposure += calculate_radius_exposure(exposure_chunk, exposure_column, storm_points, buffer_radii, weighting)
+  return radius_exposure
+
+def get_hurricane_exposure(exposure_gdf, exposure_column, exposure_label, buffer_radii = [200000.0, 150000.0, 100000.0, 50000.0],
+                           weighting = 'intersects', write_outputs = True): 
+  # exposure can also be given as the path to a GeoParquet file,
+  # in which case only the exposure column and geometry are read,
+  # or as an iterator of geodataframe chunks, which are processed one at a time
+  # weighting = 'area' only counts the part of each shape inside the radius (see calculate_radius_exposure)
+  # write_outputs = False skips the csv and plots (e.g. when timing), and only returns the exposure table
+  if isinstance(exposure_gdf, str):
+    with stage('read exposure') as timer:
+      exposure_gdf = gpd.read_parquet(exposure_gdf, columns = [exposure_column, 'geometry'])
+      timer.rows = len(exposure_gdf.index)
+  # location (point geometry) of highest windspeed for every storm
+  # from the storm summary written next to the combined tracks
+  with stage('read storm summary') as timer:
+    storm_peaks = load_storm_summary(epsg = 32618)
+    timer.rows = len(storm_peaks.index)
+  # initialize dataframe to store exposure
+  hurricane_classification_df = pd.DataFrame(index = np.arange(len(storm_peaks.index)))
+  hurricane_classification_df['Year'] = storm_peaks['TCYR'].to_numpy(dtype = float)
+  hurricane_classification_df['HurricaneNo'] = storm_peaks['STORMNUM'].to_numpy(dtype = float)
+  hurricane_classification_df['Name'] = storm_peaks['STORMNAME'].to_numpy()
+  hurricane_classification_df['Landfall Windspeed'] = storm_peaks['INTENSITY'].to_numpy(dtype = float) * 1.15
+  # find exposure within each radius for all storms at once
+  with stage('radius exposure ' + exposure_label):
+    if isinstance(exposure_gdf, gpd.GeoDataFrame):
+      radius_exposure = calculate_radius_exposure(exposure_gdf, exposure_column, storm_peaks, buffer_radii, weighting)
+    else:
+      radius_exposure = accumulate_radius_exposure(exposure_gdf, exposure_column, storm_peaks, buffer_radii, weighting)
+  for buffer_radius in buffer_radii:
+    hurricane_classification_df[exposure_column_name(exposure_label, buffer_radius)] = radius_exposure[float(buffer_radius)].to_numpy()
+  if not write_outputs:
+    return hurricane_classification_df
+
   map_output_dir = 'HurricaneExposures'
   os.makedirs(map_output_dir, exist_ok = True)
-  for year_num in all_years:
-    # find all the hurricanes that occurred in an individual years
-    this_yr_hurricanes = all_hurricane_points[all_hurricane_points['TCYR'] == year_num]
-    # stormnum gives the order that the hurricanes happened within an individual year
-    hurricane_nums = this_yr_hurricanes['STORMNUM'].unique()
-    # loop through storms in the current year one-by-one
-    for strm_num in hurricane_nums:
-      print(year_num, end = " ")
-      print(strm_num)
-      # select points from current storm
-      this_hurricane = this_yr_hurricanes[this_yr_hurricanes['STORMNUM'] == strm_num]
-      # each storm has multiple points, find point of highest windspeed
-      # argsort orders from smallest to largest
-      ordered_intensity = np.argsort(this_hurricane['INTENSITY'])
-      # timing of highest windspeed
-      new_val = ordered_intensity.iloc[-1]
-      # find value of highest windspeed
-      hurricane_classification_df.loc[hurricane_counter, 'Year'] = year_num * 1
-      hurricane_classification_df.loc[hurricane_counter, 'HurricaneNo'] = strm_num * 1
-      hurricane_classification_df.loc[hurricane_counter, 'Name'] = this_hurricane.loc[this_hurricane.index[new_val], 'STORMNAME']
-      hurricane_classification_df.loc[hurricane_counter, 'Landfall Windspeed'] = this_hurricane.loc[this_hurricane.index[new_val], 'INTENSITY'] * 1.15
-      # find location (point geometry) of highest windspeed
-      point_geom = this_hurricane.loc[this_hurricane.index[new_val], 'geometry']
-      # loop through hurricane radius sizes
-      for buffer_radius in [200000.0, 150000.0, 100000.0, 50000.0]:
-        # buffer radius around landfalling point
-        buffer_geom = point_geom.buffer(buffer_radius)
-        # create new dataframe for circle created by radius
-        gdf_point_buffer = gpd.GeoDataFrame([0,], crs = this_hurricane.crs, geometry = [buffer_geom,])      
-        # find intersection of hurricane radius with census tracts
-        exposed_shapes = gpd.sjoin(exposure_gdf, gdf_point_buffer, how = 'inner', predicate = 'intersects')
-        # find total population contained in those census tracts
-        total_exposure = 0 
-        for index, row in exposed_shapes.iterrows():
-          total_exposure += np.sum(row[exposure_column])
-        hurricane_classification_df.loc[hurricane_counter, 'Exposed ' + exposure_label + ' < ' + str(int(buffer_radius/1000.0)) + 'km'] = total_exposure * 1.0
-        # remove axis ticks/labels
-      hurricane_counter += 1
-
   # write population/windspeed data to file    
   hurricane_classification_df.to_csv('hurricane_exposed_' + exposure_label + '.csv') 
-  hurricane_exposures = hurricane_classification_df[hurricane_classification_df['Exposed ' + exposure_label + ' < 200km'] > 0.0]
-  fig, ax = plt.subplots(2,2)
-  x_cnt = 0
-  y_cnt = 0
-  for distance in ['50km', '100km', '150km', '200km']:
-    sns.kdeplot(ax = ax[x_cnt][y_cnt], x=hurricane_exposures['Landfall Windspeed'], 
-                y=hurricane_exposures['Exposed ' + exposure_label + ' < ' + distance], 
-                cmap="Blues", shade=True, bw_adjust=.5)
-    ax[x_cnt][y_cnt].plot(hurricane_exposures['Landfall Windspeed'], 
-            hurricane_exposures['Exposed ' + exposure_label + ' < ' + distance], 
-            marker = 'o', linewidth = 0.0, color = 'red', label = '<' + distance)
-    x_cnt += 1
-    if x_cnt == 2:
-      y_cnt += 1
-      x_cnt = 0
-  plt.savefig(os.path.join('HurricaneExposures', 'exposure_' + exposure_label + '.png'))
+  hurricane_exposures = hurricane_classification_df[hurricane_classification_df[exposure_column_name(exposure_label, max(buffer_radii))] > 0.0]
+  with stage('exposure plots'):
+    fig, ax = plt.subplots(2,2)
+    x_cnt = 0
+    y_cnt = 0
+    for buffer_radius in sorted(buffer_radii)[:4]:
+      distance = str(int(buffer_radius/1000.0)) + 'km'
+      sns.kdeplot(ax = ax[x_cnt][y_cnt], x=hurricane_exposures['Landfall Windspeed'], 
+                  y=hurricane_exposures[exposure_column_name(exposure_label, buffer_radius)], 
+                  cmap="Blues", shade=True, bw_adjust=.5)
+      ax[x_cnt][y_cnt].plot(hurricane_exposures['Landfall Windspeed'], 
+              hurricane_exposures[exposure_column_name(exposure_label, buffer_radius)], 
+              marker = 'o', linewidth = 0.0, color = 'red', label = '<' + distance)
+      x_cnt += 1
+      if x_cnt == 2:
+        y_cnt += 1
+        x_cnt = 0
+    plt.savefig(os.path.join('HurricaneExposures', 'exposure_' + exposure_label + '.png'))
+  return hurricane_classification_df
 
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+
+from exposure_functions import calculate_radius_exposure
+
+# exposure grids with a summed-area table, for fast approximate radius exposure
+# exposure (e.g. tract population or parcel IMPROVVAL) is added to the grid cell
+# holding a representative point of each shape, and the summed-area table
+# (sat[i, j] = total exposure in rows < i and columns < j) gives the sum over any
+# block of cells from four lookups
+#   rectangles - one block per query, O(1)
+#   discs      - one block per row of cells the disc covers, O(radius / cell size)
+# a cell counts if its center is inside the rectangle/disc, so results are
+# within about half a cell of the exact distances (see get_grid_error_report)
+# tables are stored as .npy and opened memory-mapped, so queries only read
+# the rows of the table they need
+
+def get_exposure_grid_memory(num_rows, num_columns):
+  # about how many MB building a grid and its summed-area table takes
+  # (8 bytes per cell for the cell totals, the table, and the cumulative sum between them)
+  return num_rows * num_columns * 24.0 / (1024.0 * 1024.0)
+
+def rasterize_exposure(exposure_gdf, exposure_column, cell_size, padding = 0.0, max_build_mb = 4000.0):
+  # total exposure in each grid cell (row x column, rows going north)
+  # the grid covers the exposure layer plus padding on every side
+  # grids that would take more than max_build_mb to build are refused
+  # returns the cell totals and the x/y of the grid's lower-left corner
+  exposure_points = exposure_gdf.geometry
+  if not (exposure_points.geom_type == 'Point').all():
+    exposure_points = exposure_points.representative_point()
+  exposure_x = exposure_points.x.to_numpy()
+  exposure_y = exposure_points.y.to_numpy()
+  exposure_values = exposure_gdf[exposure_column].to_numpy(dtype = float)
+  x_origin = exposure_x.min() - padding
+  y_origin = exposure_y.min() - padding
+  num_columns = int(np.ceil((exposure_x.max() + padding - x_origin) / cell_size))
+  num_rows = int(np.ceil((exposure_y.max() + padding - y_origin) / cell_size))
+  build_memory = get_exposure_grid_memory(num_rows, num_columns)
+  if build_memory > max_build_mb:
+    raise ValueError('exposure grid would take about ' + str(round(build_memory)) + ' MB to build '
+                     '(limit ' + str(round(max_build_mb)) + ' MB), use a larger cell size')
+  # points on the far edge go in the last cell
+  exposure_columns = np.minimum(((exposure_x - x_origin) / cell_size).astype(int), num_columns - 1)
+  exposure_rows = np.minimum(((exposure_y - y_origin) / cell_size).astype(int), num_rows - 1)
+  cell_exposure = np.bincount(exposure_rows * num_columns + exposure_columns, weights = exposure_values,
+                              minlength = num_rows * num_columns).reshape(num_rows, num_columns)
+  return cell_exposure, x_origin, y_origin
+
+def build_summed_area_table(cell_exposure):
+  # (rows + 1) x (columns + 1) table with a row and column of zeros in front
+  summed_area = np.zeros((cell_exposure.shape[0] + 1, cell_exposure.shape[1] + 1))
+  np.cumsum(np.cumsum(cell_exposure, axis = 0), axis = 1, out = summed_area[1:, 1:])
+  return summed_area
+
+def write_exposure_grid(exposure_gdf, exposure_column, grid_dir, grid_name, cell_size = 1000.0, source_key = None,
+                        max_build_mb = 4000.0):
+  # rasterize an exposure layer and write its summed-area table (<grid_name>_sat.npy)
+  # and grid settings (<grid_name>_grid.json) to grid_dir
+  # source_key is stored with the settings, so callers can skip rebuilding unchanged grids
+  cell_exposure, x_origin, y_origin = rasterize_exposure(exposure_gdf, exposure_column, cell_size, max_build_mb = max_build_mb)
+  os.makedirs(grid_dir, exist_ok = True)
+  # the table is written first, so settings only exist for a complete table
+  table_path = os.path.join(grid_dir, grid_name + '_sat.npy')
+  with open(table_path + '.part', 'wb') as table_file:
+    np.save(table_file, build_summed_area_table(cell_exposure))
+  os.replace(table_path + '.part', table_path)
+  grid_settings = {'exposure_column': exposure_column, 'cell_size': cell_size, 'x_origin': x_origin, 'y_origin': y_origin,
+                   'num_rows': cell_exposure.shape[0], 'num_columns': cell_exposure.shape[1],
+                   'total': float(cell_exposure.sum()), 'crs': exposure_gdf.crs.to_string() if exposure_gdf.crs is not None else None,
+                   'source_key': source_key}
+  with open(os.path.join(grid_dir, grid_name + '_grid.json'), 'w') as settings_file:
+    json.dump(grid_settings, settings_file, indent = 1)
+  return grid_settings
+
+def read_grid_settings(grid_dir, grid_name):
+  settings_path = os.path.join(grid_dir, grid_name + '_grid.json')
+  if not os.path.exists(settings_path):
+    return None
+  with open(settings_path) as settings_file:
+    return json.load(settings_file)
+
+def load_exposure_grid(grid_dir, grid_name):
+  # grid settings plus the summed-area table (memory-mapped, read only)
+  exposure_grid = read_grid_settings(grid_dir, grid_name)
+  exposure_grid['sat'] = np.load(os.path.join(grid_dir, grid_name + '_sat.npy'), mmap_mode = 'r')
+  return exposure_grid
+
+def sum_cell_blocks(summed_area, row_start, row_end, column_start, column_end):
+  # total exposure in cell rows row_start..row_end and columns column_start..column_end
+  # (inclusive, already clipped to the grid; empty blocks have end < start)
+  block_sums = (summed_area[row_end + 1, column_end + 1] - summed_area[row_start, column_end + 1]
+                - summed_area[row_end + 1, column_start] + summed_area[row_start, column_start])
+  return np.where((row_end >= row_start) & (column_end >= column_start), block_sums, 0.0)
+
+def get_cell_range(low_values, high_values, origin, cell_size, num_cells):
+  # first and last cell whose center is between low_values and high_values, clipped to the grid
+  # ranges off the grid are empty (last < first), and both stay inside the (num_cells + 1) summed-area table
+  first_cell = np.clip(np.ceil((low_values - origin) / cell_size - 0.5), 0, num_cells).astype(np.int64)
+  last_cell = np.clip(np.floor((high_values - origin) / cell_size - 0.5), -1, num_cells - 1).astype(np.int64)
+  return first_cell, last_cell
+
+def query_rectangles(exposure_grid, x_min, y_min, x_max, y_max):
+  # total exposure in each rectangle (arrays of corners, in the grid crs)
+  row_start, row_end = get_cell_range(np.asarray(y_min, dtype = float), np.asarray(y_max, dtype = float),
+                                      exposure_grid['y_origin'], exposure_grid['cell_size'], exposure_grid['num_rows'])
+  column_start, column_end = get_cell_range(np.asarray(x_min, dtype = float), np.asarray(x_max, dtype = float),
+                                            exposure_grid['x_origin'], exposure_grid['cell_size'], exposure_grid['num_columns'])
+  return sum_cell_blocks(exposure_grid['sat'], row_start, row_end, column_start, column_end)
+
+def query_discs(exposure_grid, center_x, center_y, radius, max_strips = 5000000):
+  # total exposure within radius of each center (arrays, or one radius for all centers)
+  # each disc is split into one strip per row of cells it covers, and all strips
+  # are summed from the table at once (queries are done in batches of about max_strips strips)
+  center_x = np.asarray(center_x, dtype = float)
+  center_y = np.asarray(center_y, dtype = float)
+  radius = np.broadcast_to(np.asarray(radius, dtype = float), center_x.shape)
+  cell_size = exposure_grid['cell_size']
+  # rows of cells whose centers are within radius (north-south) of each center
+  first_row, last_row = get_cell_range(center_y - radius, center_y + radius, exposure_grid['y_origin'],
+                                       cell_size, exposure_grid['num_rows'])
+  strip_counts = np.maximum(last_row - first_row + 1, 0)
+  disc_sums = np.zeros(len(center_x))
+  strip_totals = np.cumsum(strip_counts)
+  query_start = 0
+  while query_start < len(center_x):
+    # as many queries as fit in max_strips (at least one)
+    strips_before = strip_totals[query_start - 1] if query_start > 0 else 0
+    query_end = max(int(np.searchsorted(strip_totals, strips_before + max_strips, side = 'right')), query_start + 1)
+    batch_counts = strip_counts[query_start:query_end]
+    strip_query = np.repeat(np.arange(query_start, query_end), batch_counts)
+    strip_row = first_row[strip_query] + np.arange(len(strip_query)) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+    # half-width of the disc at the center of each row of cells
+    strip_dy = exposure_grid['y_origin'] + (strip_row + 0.5) * cell_size - center_y[strip_query]
+    half_width = np.sqrt(np.maximum(radius[strip_query] ** 2 - strip_dy ** 2, 0.0))
+    column_start, column_end = get_cell_range(center_x[strip_query] - half_width, center_x[strip_query] + half_width,
+                                              exposure_grid['x_origin'], cell_size, exposure_grid['num_columns'])
+    strip_sums = sum_cell_blocks(exposure_grid['sat'], strip_row, strip_row, column_start, column_end)
+    disc_sums[query_start:query_end] = np.bincount(strip_query - query_start, weights = strip_sums, minlength = query_end - query_start)
+    query_start = query_end
+  return disc_sums
+
+def get_grid_error_report(exposure_grid, exposure_gdf, exposure_column, storm_points, buffer_radii, weighting = 'intersects'):
+  # grid disc sums against the exact radius exposure (calculate_radius_exposure, as
+  # used by get_hurricane_exposure) at every storm point, for each radius
+  # (only storms with exact exposure above 0 are used for the relative errors)
+  exact_exposure = calculate_radius_exposure(exposure_gdf, exposure_column, storm_points, buffer_radii, weighting = weighting)
+  storm_x = storm_points.geometry.x.to_numpy()
+  storm_y = storm_points.geometry.y.to_numpy()
+  error_rows = []
+  for buffer_radius in buffer_radii:
+    exact_sums = exact_exposure[float(buffer_radius)].to_numpy()
+    grid_sums = query_discs(exposure_grid, storm_x, storm_y, float(buffer_radius))
+    exposed = exact_sums > 0.0
+    relative_error = np.abs(grid_sums[exposed] - exact_sums[exposed]) / exact_sums[exposed]
+    if len(relative_error) == 0:
+      relative_error = np.zeros(1)
+    error_rows.append({'Radius': float(buffer_radius), 'Storms': len(exact_sums), 'Exposed Storms': int(exposed.sum()),
+                       'Exact Total': exact_sums.sum(), 'Grid Total': grid_sums.sum(),
+                       'Mean Absolute Error': np.mean(np.abs(grid_sums - exact_sums)),
+                       'Median Relative Error': np.median(relative_error),
+                       '90th Percentile Relative Error': np.percentile(relative_error, 90),
+                       'Max Relative Error': np.max(relative_error)})
+  return pd.DataFrame(error_rows).set_index('Radius')
@@ -0,0 +1,173 @@
+import numpy as np
+import tracemalloc
+import datetime
+import atexit
+import json
+import time
+import sys
+import os
+try:
+  import resource
+except ImportError:
+  # not available on windows (peak memory is not recorded)
+  resource = None
+
+# opt-in timing and memory records for the pipeline scripts
+# set the environment variable HURRICANE_INSTRUMENT=1 to turn it on
+# (HURRICANE_INSTRUMENT_DIR sets where run reports are written, default 'run_reports')
+#
+#   with stage('read tracts') as timer:
+#     tracts = gpd.read_file(...)
+#     timer.rows = len(tracts.index)
+#
+# records wall time, cpu time, memory, and rows for each named stage
+# (stages inside other stages are named 'outer/inner'), and
+# record_storm_time('render', seconds) keeps per-storm times for histograms
+# when the script ends a summary table is printed and a json report is written
+# when it is turned off, stage() returns the same do-nothing object every time
+#
+# memory columns:
+#   start MB        - resident memory of the process when the stage started (linux only)
+#   stage peak MB   - largest amount of memory allocated during the stage, above what was
+#                     allocated when it started (traced with tracemalloc, so it counts python
+#                     and numpy/pandas arrays but not memory held by GEOS or pyarrow)
+#   process peak MB - peak resident memory of the process so far (not just this stage)
+# tracemalloc slows allocation-heavy code down, so times are a little longer than without it
+
+instrument_on = os.environ.get('HURRICANE_INSTRUMENT', '') not in ['', '0']
+report_dir = os.environ.get('HURRICANE_INSTRUMENT_DIR', 'run_reports')
+
+# records for this run
+_stage_records = {}
+_storm_times = {}
+_stage_names = []
+# traced memory when each open stage started, and the highest traced memory seen in it
+_memory_stack = []
+
+def get_current_memory():
+  # resident memory of this process now, in MB (None where /proc is not available)
+  try:
+    with open('/proc/self/statm') as statm_file:
+      return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+  except (OSError, ValueError, IndexError, AttributeError):
+    return None
+
+def get_peak_memory():
+  # peak resident memory of this process so far, in MB
+  if resource is None:
+    return None
+  peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # linux reports kB, mac reports bytes
+  return peak_memory / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak_memory / 1024.0
+
+class StageTimer:
+  # times one stage and adds it to the records when the stage ends
+  def __init__(self, stage_name):
+    self.stage_name = stage_name
+    self.rows = None
+  def __enter__(self):
+    _stage_names.append(self.stage_name)
+    self.full_name = '/'.join(_stage_names)
+    self.start_memory = get_current_memory()
+    # the tracemalloc peak is reset for every stage, so the peak so far is
+    # kept for the stage this one is inside of
+    traced_memory, traced_peak = tracemalloc.get_traced_memory()
+    if len(_memory_stack) > 0:
+      _memory_stack[-1][1] = max(_memory_stack[-1][1], traced_peak)
+    tracemalloc.reset_peak()
+    _memory_stack.append([traced_memory, traced_memory])
+    self.start_wall = time.perf_counter()
+    self.start_cpu = time.process_time()
+    return self
+  def __exit__(self, *exc_info):
+    wall_seconds = time.perf_counter() - self.start_wall
+    cpu_seconds = time.process_time() - self.start_cpu
+    _stage_names.pop()
+    start_traced, stage_traced_peak = _memory_stack.pop()
+    stage_traced_peak = max(stage_traced_peak, tracemalloc.get_traced_memory()[1])
+    if len(_memory_stack) > 0:
+      _memory_stack[-1][1] = max(_memory_stack[-1][1], stage_traced_peak)
+    stage_peak_memory = (stage_traced_peak - start_traced) / (1024.0 * 1024.0)
+    stage_record = _stage_records.setdefault(self.full_name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                                              'start_memory_mb': None, 'stage_peak_memory_mb': 0.0,
+                                                              'process_peak_memory_mb': None, 'rows': None})
+    stage_record['calls'] += 1
+    stage_record['wall_seconds'] += wall_seconds
+    stage_record['cpu_seconds'] += cpu_seconds
+    # for stages run more than once: memory at the first start, and the largest stage peak
+    if stage_record['calls'] == 1:
+      stage_record['start_memory_mb'] = self.start_memory
+    stage_record['stage_peak_memory_mb'] = max(stage_record['stage_peak_memory_mb'], stage_peak_memory)
+    stage_record['process_peak_memory_mb'] = get_peak_memory()
+    if self.rows is not None:
+      stage_record['rows'] = (stage_record['rows'] or 0) + int(self.rows)
+    return False
+
+class NoTimer:
+  # stand-in for StageTimer when instrumentation is off
+  rows = None
+  def __enter__(self):
+    return self
+  def __exit__(self, *exc_info):
+    return False
+
+_no_timer = NoTimer()
+
+def stage(stage_name):
+  if not instrument_on:
+    return _no_timer
+  return StageTimer(stage_name)
+
+def record_storm_time(stage_name, seconds):
+  # time spent on one storm in a per-storm step
+  if instrument_on:
+    _storm_times.setdefault(stage_name, []).append(float(seconds))
+
+def summarize_storm_times():
+  # percentiles and a 10-bin histogram of the per-storm times for each step
+  storm_summary = {}
+  for stage_name, storm_times in _storm_times.items():
+    bin_counts, bin_edges = np.histogram(storm_times, bins = 10)
+    storm_summary[stage_name] = {'storms': len(storm_times), 'total_seconds': float(np.sum(storm_times)),
+                                 'mean_seconds': float(np.mean(storm_times)),
+                                 'p50_seconds': float(np.percentile(storm_times, 50)),
+                                 'p90_seconds': float(np.percentile(storm_times, 90)),
+                                 'max_seconds': float(np.max(storm_times)),
+                                 'histogram_counts': bin_counts.tolist(), 'histogram_edges': bin_edges.tolist()}
+  return storm_summary
+
+def print_run_summary():
+  print('stage'.ljust(48) + 'calls'.rjust(6) + 'wall s'.rjust(10) + 'cpu s'.rjust(10) + 'start MB'.rjust(10) +
+        'stage peak MB'.rjust(15) + 'process peak MB'.rjust(17) + 'rows'.rjust(12))
+  format_memory = lambda memory_mb: '' if memory_mb is None else '%.0f' % memory_mb
+  for stage_name, stage_record in _stage_records.items():
+    print(stage_name[:47].ljust(48) + str(stage_record['calls']).rjust(6) + ('%.3f' % stage_record['wall_seconds']).rjust(10) +
+          ('%.3f' % stage_record['cpu_seconds']).rjust(10) + format_memory(stage_record['start_memory_mb']).rjust(10) +
+          ('%.1f' % stage_record['stage_peak_memory_mb']).rjust(15) +
+          format_memory(stage_record['process_peak_memory_mb']).rjust(17) +
+          ('' if stage_record['rows'] is None else str(stage_record['rows'])).rjust(12))
+  for stage_name, storm_record in summarize_storm_times().items():
+    print(stage_name + ' per storm: ' + str(storm_record['storms']) + ' storms, median ' + '%.3f' % storm_record['p50_seconds'] +
+          ' s, 90th percentile ' + '%.3f' % storm_record['p90_seconds'] + ' s, max ' + '%.3f' % storm_record['max_seconds'] + ' s')
+
+def write_run_report(report_path = None):
+  # json report of all stages and per-storm times for this run
+  script_name = os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+  run_time = datetime.datetime.now()
+  if report_path is None:
+    report_path = os.path.join(report_dir, script_name + '_' + run_time.strftime('%Y%m%d_%H%M%S') + '.json')
+  os.makedirs(os.path.dirname(report_path) or '.', exist_ok = True)
+  with open(report_path, 'w') as report_file:
+    json.dump({'script': script_name, 'time': run_time.isoformat(timespec = 'seconds'), 'stages': _stage_records,
+               'storms': summarize_storm_times()}, report_file, indent = 1)
+  return report_path
+
+def finish_run():
+  # summary table and report at the end of the script
+  if len(_stage_records) > 0 or len(_storm_times) > 0:
+    print_run_summary()
+    print('Run report written to ' + write_run_report())
+
+if instrument_on:
+  tracemalloc.start()
+  atexit.register(finish_run)
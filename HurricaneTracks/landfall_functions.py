@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import hashlib
+import json
+import os
+
+from download_functions import get_layer_checksum, get_folder_checksums
+
+def count_state_landfalls(hurricane_lines, us_states, years):
+  # number of hurricane tracks per year that intersect each state
+  # (one sjoin of all tracks against all states, then a grouped count)
+  # returns a year x state table with a 'Total' column of all tracks per year
+  hurricane_rates = pd.DataFrame(index = years)
+  hurricane_rates['Total'] = hurricane_lines.groupby(hurricane_lines['TCYR'].astype(int)).size().reindex(years, fill_value = 0).astype(float)
+  hurricane_state_pth = gpd.sjoin(hurricane_lines[['TCYR', 'geometry']], us_states[['NAME', 'geometry']],
+                                  how = 'inner', predicate = 'intersects')
+  state_counts = hurricane_state_pth.groupby([hurricane_state_pth['TCYR'].astype(int), 'NAME']).size().unstack(fill_value = 0)
+  # states are kept in the order of the states file, including states with no tracks
+  state_counts = state_counts.reindex(index = years, columns = us_states['NAME'], fill_value = 0).astype(float)
+  return pd.concat([hurricane_rates, state_counts], axis = 1)
+
+def count_state_exceedances(hurricane_points, us_states, knot_vals, hours_per_point,
+                            min_points = 21, other_hours_per_point = 0.25):
+  # hours per year above each windspeed threshold (knot_vals) for points in each state
+  # (one sjoin of all points against all states, then grouped counts)
+  # states with fewer than min_points points are combined into 'Other States'
+  hurricane_state_pnts = gpd.sjoin(hurricane_points[['INTENSITY', 'geometry']], us_states[['NAME', 'geometry']],
+                                   how = 'inner', predicate = 'within')
+  state_names = hurricane_state_pnts['NAME'].to_numpy()
+  intensity = hurricane_state_pnts['INTENSITY'].to_numpy(dtype = float)
+  # above_threshold[i, j] = point i is above threshold j
+  above_threshold = intensity[:, np.newaxis] > np.asarray(knot_vals, dtype = float)[np.newaxis, :]
+  exceedance_counts = pd.DataFrame(above_threshold, columns = knot_vals).groupby(state_names).sum()
+  points_per_state = pd.Series(state_names).value_counts()
+  # states are kept in the order of the states file
+  major_states = [state_name for state_name in us_states['NAME'] if points_per_state.get(state_name, 0) >= min_points]
+  minor_states = [state_name for state_name in exceedance_counts.index if state_name not in major_states]
+  state_hours = exceedance_counts.loc[major_states] * hours_per_point
+  if len(minor_states) > 0:
+    state_hours.loc['Other States'] = exceedance_counts.loc[minor_states].sum() * other_hours_per_point
+  state_hours.index.name = 'NAME'
+  state_hours.columns.name = 'Knots'
+  return state_hours
+
+def clip_tracks_by_state(hurricane_lines, us_states, simplify_tolerance = None):
+  # clip every hurricane track to every state it crosses
+  # (same as gpd.overlay(lines, state, how = 'intersection') for each state,
+  # but candidate track/state pairs come from one spatial index query and
+  # all pairs are intersected at once)
+  # returns the clipped segments (with state NAME and TCYR) and the
+  # number of tracks clipped to each state
+  state_geoms = us_states.geometry.values
+  if simplify_tolerance is not None:
+    # simplified state boundaries have far fewer vertices to intersect
+    state_geoms = shapely.simplify(state_geoms, simplify_tolerance, preserve_topology = True)
+  line_geoms = hurricane_lines.geometry.values
+  line_idx, state_idx = shapely.STRtree(state_geoms).query(line_geoms, predicate = 'intersects')
+  clipped_geoms = shapely.intersection(line_geoms[line_idx], state_geoms[state_idx])
+  # only keep line parts (tracks that only touch a state border are dropped, as in overlay)
+  clipped_geoms = np.array([get_line_parts(clipped_geom) for clipped_geom in clipped_geoms], dtype = object)
+  has_line = ~shapely.is_empty(clipped_geoms)
+  clipped_tracks = gpd.GeoDataFrame({'NAME': us_states['NAME'].to_numpy()[state_idx[has_line]],
+                                     'TCYR': hurricane_lines['TCYR'].to_numpy()[line_idx[has_line]]},
+                                    geometry = clipped_geoms[has_line], crs = hurricane_lines.crs)
+  # states are kept in the order of the states file
+  track_counts = clipped_tracks['NAME'].value_counts().reindex(us_states['NAME'], fill_value = 0)
+  return clipped_tracks, track_counts
+
+def get_line_parts(clipped_geom):
+  # line part of an intersection result
+  line_type = shapely.get_type_id(clipped_geom)
+  if line_type in [1, 5]:
+    return clipped_geom
+  if line_type == 7:
+    # geometry collection - keep lines, drop points
+    line_parts = [part for part in shapely.get_parts(clipped_geom) if shapely.get_type_id(part) in [1, 5]]
+    if len(line_parts) > 0:
+      return shapely.line_merge(shapely.multilinestrings(shapely.get_parts(line_parts)))
+  return shapely.LineString()
+
+def clip_tracks_by_state_cached(hurricane_lines, us_states, input_paths, cache_dir, simplify_tolerance = None):
+  # clip_tracks_by_state, with the result cached on disk
+  # the cache key is made from the input files and the clipping settings,
+  # so the clipping only runs again if tracks, states, or settings change
+  # (inputs are shapefiles, or folders such as the combined track season files)
+  cache_key = hashlib.sha256()
+  for input_path in input_paths:
+    if os.path.isdir(input_path):
+      cache_key.update(json.dumps(get_folder_checksums(input_path), sort_keys = True).encode('utf-8'))
+    else:
+      cache_key.update(get_layer_checksum(input_path).encode('utf-8'))
+  cache_key.update((str(hurricane_lines.crs) + ' ' + str(simplify_tolerance)).encode('utf-8'))
+  cache_path = os.path.join(cache_dir, 'clipped_tracks_' + cache_key.hexdigest()[:16] + '.parquet')
+  if os.path.exists(cache_path):
+    clipped_tracks = gpd.read_parquet(cache_path)
+    track_counts = clipped_tracks['NAME'].value_counts().reindex(us_states['NAME'], fill_value = 0)
+    return clipped_tracks, track_counts
+  clipped_tracks, track_counts = clip_tracks_by_state(hurricane_lines, us_states, simplify_tolerance)
+  os.makedirs(cache_dir, exist_ok = True)
+  clipped_tracks.to_parquet(cache_path)
+  return clipped_tracks, track_counts
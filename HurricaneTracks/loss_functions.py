@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+# match storms to loss estimates (e.g. billion_dollar_losses.csv) by year and name
+# names are normalized once, the loss table is reduced to one row per (year, name),
+# and every name of every storm is matched in a single join, so the time grows
+# linearly with the number of storms and loss records
+
+# words dropped from the start of loss table names (e.g. 'Hurricane Ian' -> 'IAN')
+storm_name_prefixes = ['HURRICANE', 'TROPICAL STORM', 'TROPICAL DEPRESSION', 'SUBTROPICAL STORM',
+                       'POST-TROPICAL CYCLONE', 'POTENTIAL TROPICAL CYCLONE', 'TROPICAL CYCLONE']
+
+def normalize_storm_names(storm_names):
+  # upper case, accents and punctuation removed, storm type prefixes dropped
+  storm_names = pd.Series(storm_names, dtype = object).fillna('').astype(str)
+  storm_names = storm_names.str.normalize('NFKD').str.encode('ascii', errors = 'ignore').str.decode('ascii')
+  storm_names = storm_names.str.upper().str.strip()
+  prefix_pattern = '^(?:' + '|'.join(name_prefix.replace('-', '[- ]') for name_prefix in storm_name_prefixes) + r')\s+'
+  storm_names = storm_names.str.replace(prefix_pattern, '', regex = True)
+  storm_names = storm_names.str.replace(r'[^A-Z0-9]+', ' ', regex = True).str.strip()
+  return storm_names
+
+def read_loss_records(hurricane_losses, name_column = 'Hurricane', year_column = 'Year', cost_column = 'Cost'):
+  # year, normalized name, position in the file, and cost of every loss record
+  # (records without a year or name are dropped)
+  loss_records = pd.DataFrame({'Year': pd.to_numeric(hurricane_losses[year_column], errors = 'coerce'),
+                               'Loss Name': normalize_storm_names(hurricane_losses[name_column]).to_numpy(),
+                               'Loss Row': np.arange(len(hurricane_losses.index)),
+                               'Cost': pd.to_numeric(hurricane_losses[cost_column], errors = 'coerce').to_numpy()},
+                              index = hurricane_losses.index)
+  loss_records = loss_records[loss_records['Year'].notna() & (loss_records['Loss Name'] != '')]
+  loss_records['Year'] = loss_records['Year'].astype(int)
+  return loss_records
+
+def index_losses(loss_records, combine_records = 'first'):
+  # one loss per (year, normalized name)
+  # combine_records = 'first' keeps the first record in file order (a list of storm totals),
+  # 'sum' adds all records for the same storm (e.g. county-level claims)
+  loss_groups = loss_records.groupby(['Year', 'Loss Name'], sort = False)
+  if combine_records == 'first':
+    # whole first record (groupby first() takes each column's first non-missing value,
+    # which can mix the cost of one record with the row of another)
+    loss_index = loss_records.drop_duplicates(['Year', 'Loss Name'], keep = 'first').set_index(['Year', 'Loss Name'])
+  elif combine_records == 'sum':
+    loss_index = loss_groups.agg({'Loss Row': 'first', 'Cost': 'sum'})
+  else:
+    raise ValueError("combine_records must be 'first' or 'sum'")
+  loss_index['Records'] = loss_groups.size()
+  return loss_index
+
+def match_storm_losses(storm_summary, hurricane_losses, name_column = 'Hurricane', year_column = 'Year',
+                       cost_column = 'Cost', combine_records = 'first', storm_keys = ['TCYR', 'STORMNUM']):
+  # loss for every storm in the storm summary (NAMES = '; ' separated names)
+  # a storm matches a loss if one of its names is the same (after normalizing) in the same year
+  # if more than one of a storm's names match, the first name the storm was called is used
+  # returns (storm_losses, unmatched_storms, unmatched_losses):
+  #   storm_losses has one row per storm in storm summary order with the storm keys, 'Matched' (True if
+  #   a loss was found), 'Matched Name', 'Loss Row' (position in the loss table, -1 if no match),
+  #   and 'Total Damage' (0 if no match)
+  #   unmatched_storms is the storm summary rows that did not match any loss
+  #   unmatched_losses is the loss records that no storm matched
+  loss_records = read_loss_records(hurricane_losses, name_column, year_column, cost_column)
+  loss_index = index_losses(loss_records, combine_records)
+  storm_names = storm_summary[storm_keys + ['NAMES',]].reset_index(drop = True)
+  storm_names['Storm Position'] = np.arange(len(storm_names.index))
+  storm_names['Loss Name'] = storm_names['NAMES'].fillna('').astype(str).str.split('; ')
+  storm_names = storm_names.explode('Loss Name')
+  # position of each name in the storm's list of names
+  storm_names['Name Position'] = storm_names.groupby('Storm Position').cumcount()
+  storm_names['Loss Name'] = normalize_storm_names(storm_names['Loss Name']).to_numpy()
+  storm_names['Year'] = storm_names[storm_keys[0]].astype(int)
+  name_matches = storm_names.join(loss_index, on = ['Year', 'Loss Name'], how = 'inner')
+  name_matches = name_matches.sort_values(['Storm Position', 'Name Position'], kind = 'stable')
+  name_matches = name_matches.drop_duplicates('Storm Position').set_index('Storm Position')
+
+  storm_losses = storm_summary[storm_keys].reset_index(drop = True)
+  storm_losses['Matched'] = storm_losses.index.isin(name_matches.index)
+  storm_losses['Matched Name'] = name_matches['Loss Name'].reindex(storm_losses.index).fillna('').to_numpy()
+  storm_losses['Loss Row'] = name_matches['Loss Row'].reindex(storm_losses.index).fillna(-1).astype(int).to_numpy()
+  storm_losses['Total Damage'] = name_matches['Cost'].reindex(storm_losses.index).fillna(0.0).to_numpy(dtype = float)
+  # loss records that did not match any storm (misspelled names, wrong years, storms without tracks)
+  matched_losses = pd.MultiIndex.from_frame(loss_records[['Year', 'Loss Name']]).isin(
+    pd.MultiIndex.from_arrays([name_matches['Year'], name_matches['Loss Name']]))
+  unmatched_losses = hurricane_losses.iloc[loss_records.loc[~matched_losses, 'Loss Row'].to_numpy()]
+  unmatched_storms = storm_summary[~storm_losses['Matched'].to_numpy()]
+  return storm_losses, unmatched_storms, unmatched_losses
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
+import shapely
+import pyogrio
+import json
+import os
+
+from download_functions import get_layer_checksum
+
+def read_parcel_batches(file_path, columns = ['IMPROVVAL'], batch_size = 100000):
+  # read a parcel file in batches of rows
+  # the file is opened once and only the requested columns
+  # (plus geometry) are read, as arrow record batches
+  with pyogrio.open_arrow(file_path, columns = columns, batch_size = batch_size, use_pyarrow = True) as (meta, reader):
+    geometry_name = meta['geometry_name'] or 'wkb_geometry'
+    for batch in reader:
+      # convert well-known-binary geometry into shapely points
+      parcel_geoms = shapely.from_wkb(batch.column(geometry_name).to_numpy(zero_copy_only = False))
+      parcel_values = batch.drop_columns([geometry_name]).to_pandas()
+      yield gpd.GeoDataFrame(parcel_values, geometry = parcel_geoms, crs = meta['crs'])
+
+def read_all_parcel_batches(file_paths, columns = ['IMPROVVAL'], batch_size = 100000):
+  # batches from each parcel file in turn
+  for file_path in file_paths:
+    for parcel_batch in read_parcel_batches(file_path, columns = columns, batch_size = batch_size):
+      yield parcel_batch
+
+def read_parcels(file_paths, columns = ['IMPROVVAL']):
+  # read parcel files into a single geodataframe
+  # each file is read once (only requested columns + geometry),
+  # and all files are combined in one step
+  all_parcels = []
+  for file_path in file_paths:
+    parcels = gpd.read_file(file_path, columns = columns, engine = 'pyogrio', use_arrow = True)
+    # all files use the crs of the first file
+    if len(all_parcels) > 0 and parcels.crs != all_parcels[0].crs:
+      parcels = parcels.to_crs(all_parcels[0].crs)
+    all_parcels.append(parcels)
+  return gpd.GeoDataFrame(pd.concat(all_parcels, ignore_index = True), crs = all_parcels[0].crs)
+
+# parcel store
+# parcels are copied from the county shapefiles into a GeoParquet dataset with one file
+# per county (<store_dir>/state=<state>/county=<county>/parcels.parquet), projected once,
+# sorted along a hilbert curve so nearby parcels share a row group, and written with
+# a bbox column so every row group has bounding box statistics in the file footer
+# exposure runs then only read the row groups whose bounding box is near a storm
+
+def get_parcel_partition(store_dir, state, county):
+  return os.path.join(store_dir, 'state=' + state, 'county=' + county, 'parcels.parquet')
+
+def write_parcel_store(parcel_layers, store_dir, columns = ['IMPROVVAL'], epsg = 32618, row_group_size = 10000):
+  # parcel_layers is a list of (state, county, shapefile path)
+  # counties whose shapefile has not changed since it was last written are skipped
+  # returns the counties that were written
+  manifest_path = os.path.join(store_dir, 'parcel_store_manifest.json')
+  store_manifest = {}
+  if os.path.exists(manifest_path):
+    with open(manifest_path) as manifest_file:
+      store_manifest = json.load(manifest_file)
+  written_counties = []
+  for state, county, file_path in parcel_layers:
+    partition_path = get_parcel_partition(store_dir, state, county)
+    layer_checksum = get_layer_checksum(file_path)
+    partition_key = state + '/' + county
+    # the settings are part of the checksum, so changing them rewrites the county
+    layer_checksum += ' ' + json.dumps({'columns': columns, 'epsg': epsg, 'row_group_size': row_group_size}, sort_keys = True)
+    if store_manifest.get(partition_key) == layer_checksum and os.path.exists(partition_path):
+      continue
+    parcels = read_parcels([file_path,], columns = columns).to_crs(epsg = epsg)
+    # nearby parcels are kept together (hilbert curve over this county's extent)
+    hilbert_order = np.argsort(parcels.geometry.hilbert_distance(), kind = 'stable')
+    parcels = parcels.iloc[hilbert_order].reset_index(drop = True)
+    os.makedirs(os.path.dirname(partition_path), exist_ok = True)
+    parcels.to_parquet(partition_path + '.part', row_group_size = row_group_size, write_covering_bbox = True)
+    os.replace(partition_path + '.part', partition_path)
+    store_manifest[partition_key] = layer_checksum
+    written_counties.append(partition_key)
+    # manifest is written after every county, so an interrupted run keeps the finished counties
+    with open(manifest_path, 'w') as manifest_file:
+      json.dump(store_manifest, manifest_file, indent = 1, sort_keys = True)
+  return written_counties
+
+def get_store_files(store_dir):
+  # every county file in the parcel store
+  store_files = []
+  for folder_path, folder_names, file_names in os.walk(store_dir):
+    folder_names.sort()
+    store_files.extend(os.path.join(folder_path, file_name) for file_name in sorted(file_names) if file_name == 'parcels.parquet')
+  return store_files
+
+def read_row_group_bounds(store_dir):
+  # bounding box and number of rows of every row group in the store,
+  # from the bbox column statistics in each file footer (no parcel data is read)
+  row_group_bounds = []
+  for store_file in get_store_files(store_dir):
+    file_metadata = pq.ParquetFile(store_file).metadata
+    bbox_columns = {}
+    for column_num in range(file_metadata.num_columns):
+      column_path = file_metadata.schema.column(column_num).path
+      if column_path.startswith('bbox.'):
+        bbox_columns[column_path.split('.')[1]] = column_num
+    for row_group_num in range(file_metadata.num_row_groups):
+      row_group = file_metadata.row_group(row_group_num)
+      row_group_bounds.append({'file': store_file, 'row_group': row_group_num, 'rows': row_group.num_rows,
+                               'xmin': row_group.column(bbox_columns['xmin']).statistics.min,
+                               'ymin': row_group.column(bbox_columns['ymin']).statistics.min,
+                               'xmax': row_group.column(bbox_columns['xmax']).statistics.max,
+                               'ymax': row_group.column(bbox_columns['ymax']).statistics.max})
+  return pd.DataFrame(row_group_bounds, columns = ['file', 'row_group', 'rows', 'xmin', 'ymin', 'xmax', 'ymax'])
+
+def find_storm_row_groups(row_group_bounds, storm_points, max_radius):
+  # row groups whose bounding box is within max_radius of at least one storm point
+  # (one spatial index query of all row group boxes against all storm boxes)
+  storm_x = shapely.get_x(storm_points.geometry.values)
+  storm_y = shapely.get_y(storm_points.geometry.values)
+  storm_boxes = shapely.box(storm_x - max_radius, storm_y - max_radius, storm_x + max_radius, storm_y + max_radius)
+  row_group_boxes = shapely.box(row_group_bounds['xmin'].to_numpy(), row_group_bounds['ymin'].to_numpy(),
+                                row_group_bounds['xmax'].to_numpy(), row_group_bounds['ymax'].to_numpy())
+  row_group_idx = np.unique(shapely.STRtree(storm_boxes).query(row_group_boxes)[0])
+  return row_group_bounds.iloc[row_group_idx]
+
+def read_store_row_groups(store_file, row_groups, columns = ['IMPROVVAL']):
+  # selected row groups of one county file as a geodataframe
+  parcel_file = pq.ParquetFile(store_file)
+  geo_metadata = json.loads(parcel_file.schema_arrow.metadata[b'geo'])
+  geometry_name = geo_metadata['primary_column']
+  parcel_table = parcel_file.read_row_groups(list(row_groups), columns = columns + [geometry_name,])
+  parcel_geoms = shapely.from_wkb(parcel_table.column(geometry_name).to_numpy(zero_copy_only = False))
+  parcel_values = parcel_table.drop_columns([geometry_name]).to_pandas()
+  return gpd.GeoDataFrame(parcel_values, geometry = parcel_geoms, crs = geo_metadata['columns'][geometry_name].get('crs'))
+
+def read_store_crs(store_dir):
+  # crs the store was written in (from the geo metadata of the first county file)
+  store_files = get_store_files(store_dir)
+  if len(store_files) == 0:
+    return None
+  geo_metadata = json.loads(pq.read_schema(store_files[0]).metadata[b'geo'])
+  return geo_metadata['columns'][geo_metadata['primary_column']].get('crs')
+
+def read_store_batches(store_dir, storm_points = None, max_radius = None, columns = ['IMPROVVAL']):
+  # parcels from the store, one county at a time (a streaming iterator, like read_all_parcel_batches)
+  # if storm points are given, only the row groups within max_radius of a storm are read
+  # (storm points must be in the crs the store was written in)
+  row_group_bounds = read_row_group_bounds(store_dir)
+  if storm_points is not None:
+    row_group_bounds = find_storm_row_groups(row_group_bounds, storm_points, max_radius)
+  for store_file, file_row_groups in row_group_bounds.groupby('file', sort = False):
+    yield read_store_row_groups(store_file, file_row_groups['row_group'].to_numpy(), columns = columns)
+
+def read_store_parcels(store_dir, storm_points = None, max_radius = None, columns = ['IMPROVVAL']):
+  # same as read_store_batches, combined into one geodataframe
+  parcel_batches = list(read_store_batches(store_dir, storm_points, max_radius, columns))
+  if len(parcel_batches) == 0:
+    # (no parcels near the storms, but still in the store crs so it can be reprojected)
+    return gpd.GeoDataFrame(columns = columns, geometry = gpd.GeoSeries([]), crs = read_store_crs(store_dir))
+  return gpd.GeoDataFrame(pd.concat(parcel_batches, ignore_index = True), crs = parcel_batches[0].crs)
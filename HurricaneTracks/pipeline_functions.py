@@ -0,0 +1,158 @@
+import hashlib
+import inspect
+import json
+import time
+import sys
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from download_functions import get_file_checksum, get_layer_checksum
+
+# content-addressed pipeline runner
+# each stage is a dictionary with:
+#   'function': module-level function called as function(input_paths, params, output_path)
+#               that writes one output file
+#   'inputs':   {input name: file/folder path, or the name of another stage}
+#   'params':   json-serializable settings passed to the function
+#   'output':   file extension of the stage output (e.g. '.parquet', '.csv')
+# every output is stored in the cache folder under a hash of the stage function's
+# code, the source of the repo modules it uses (e.g. exposure_functions.py), its
+# params, the checksums of its input files, and the hashes of the stages it reads
+# from - a stage only runs again if one of these changes, and stages whose inputs
+# are ready run at the same time in separate processes
+
+def get_input_checksum(input_path):
+  # shapefiles include all of their sidecar files, other files are hashed by content
+  # folders (e.g. all extracted nhc events) are hashed by the name, size, and
+  # modification time of every file in them, so large folders are not re-read
+  if os.path.isdir(input_path):
+    checksum = hashlib.sha256()
+    for folder_path, folder_names, file_names in sorted(os.walk(input_path)):
+      folder_names.sort()
+      for file_name in sorted(file_names):
+        file_stat = os.stat(os.path.join(folder_path, file_name))
+        relative_path = os.path.relpath(os.path.join(folder_path, file_name), input_path)
+        checksum.update((relative_path + ' ' + str(file_stat.st_size) + ' ' + str(file_stat.st_mtime_ns) + '\n').encode('utf-8'))
+    return checksum.hexdigest()
+  if input_path.endswith('.shp'):
+    return get_layer_checksum(input_path)
+  return get_file_checksum(input_path)
+
+def get_stage_order(pipeline_stages):
+  # stage names ordered so that every stage comes after the stages it reads from
+  stage_order = []
+  def add_stage(stage_name, stage_path):
+    if stage_name in stage_path:
+      raise ValueError('pipeline stages form a loop: ' + ' -> '.join(stage_path + [stage_name,]))
+    if stage_name not in stage_order:
+      for input_value in pipeline_stages[stage_name]['inputs'].values():
+        if input_value in pipeline_stages:
+          add_stage(input_value, stage_path + [stage_name,])
+      stage_order.append(stage_name)
+  for stage_name in pipeline_stages:
+    add_stage(stage_name, [])
+  return stage_order
+
+def get_code_names(function_code):
+  # global names used by a function (including functions defined inside it)
+  code_names = set(function_code.co_names)
+  for code_const in function_code.co_consts:
+    if inspect.iscode(code_const):
+      code_names.update(get_code_names(code_const))
+  return code_names
+
+def get_stage_modules(stage_function):
+  # source files of the repo modules (python files in the same folder as the stage
+  # function's module) that the stage function uses, and of every repo module they import
+  repo_dir = os.path.dirname(os.path.abspath(inspect.getfile(stage_function)))
+  def get_repo_module(module_value):
+    if inspect.isfunction(module_value) or inspect.isclass(module_value):
+      module_value = sys.modules.get(module_value.__module__)
+    if not inspect.ismodule(module_value) or getattr(module_value, '__file__', None) is None:
+      return None
+    if os.path.dirname(os.path.abspath(module_value.__file__)) != repo_dir:
+      return None
+    return module_value
+  stage_module = sys.modules.get(stage_function.__module__)
+  module_queue = [get_repo_module(stage_function.__globals__[code_name]) for code_name in get_code_names(stage_function.__code__)
+                  if code_name in stage_function.__globals__]
+  module_files = {}
+  while len(module_queue) > 0:
+    repo_module = module_queue.pop()
+    # the stage's own module is left out, so changing its settings only re-runs the stages that use them
+    if repo_module is None or repo_module is stage_module or repo_module.__name__ in module_files:
+      continue
+    module_files[repo_module.__name__] = os.path.abspath(repo_module.__file__)
+    module_queue.extend(get_repo_module(module_value) for module_value in vars(repo_module).values())
+  return [module_files[module_name] for module_name in sorted(module_files)]
+
+def get_stage_keys(pipeline_stages):
+  # hash of each stage (made in stage order, so upstream hashes are known)
+  stage_keys = {}
+  input_checksums = {}
+  module_checksums = {}
+  for stage_name in get_stage_order(pipeline_stages):
+    pipeline_stage = pipeline_stages[stage_name]
+    stage_key = hashlib.sha256((stage_name + '\n' + inspect.getsource(pipeline_stage['function'])).encode('utf-8'))
+    # library code the stage calls is part of the key, so editing it re-runs the stage
+    for module_file in get_stage_modules(pipeline_stage['function']):
+      if module_file not in module_checksums:
+        module_checksums[module_file] = get_file_checksum(module_file)
+      stage_key.update((os.path.basename(module_file) + ' ' + module_checksums[module_file] + '\n').encode('utf-8'))
+    stage_key.update(json.dumps(pipeline_stage.get('params', {}), sort_keys = True).encode('utf-8'))
+    for input_name, input_value in sorted(pipeline_stage['inputs'].items()):
+      if input_value in pipeline_stages:
+        input_key = stage_keys[input_value]
+      else:
+        if input_value not in input_checksums:
+          input_checksums[input_value] = get_input_checksum(input_value)
+        input_key = input_checksums[input_value]
+      stage_key.update((input_name + ' ' + input_key + '\n').encode('utf-8'))
+    stage_keys[stage_name] = stage_key.hexdigest()
+  return stage_keys
+
+def get_stage_output_path(pipeline_stages, stage_name, stage_key, cache_dir):
+  return os.path.join(cache_dir, stage_name + '_' + stage_key[:16] + pipeline_stages[stage_name]['output'])
+
+def run_stage(stage_function, input_paths, params, output_path):
+  # write to a temporary file first, so a stage that fails part way
+  # through never leaves an output that looks complete
+  start_time = time.perf_counter()
+  stage_function(input_paths, params, output_path + '.part')
+  os.replace(output_path + '.part', output_path)
+  return time.perf_counter() - start_time
+
+def run_pipeline(pipeline_stages, cache_dir, max_workers = None):
+  # run every stage whose output is not already in the cache
+  # returns the output path of every stage
+  os.makedirs(cache_dir, exist_ok = True)
+  stage_keys = get_stage_keys(pipeline_stages)
+  output_paths = {stage_name: get_stage_output_path(pipeline_stages, stage_name, stage_keys[stage_name], cache_dir)
+                  for stage_name in stage_keys}
+  waiting_stages = []
+  for stage_name in get_stage_order(pipeline_stages):
+    if os.path.exists(output_paths[stage_name]):
+      print(stage_name.ljust(28) + ' cached')
+    else:
+      waiting_stages.append(stage_name)
+  running_stages = {}
+  with ProcessPoolExecutor(max_workers = max_workers) as pool:
+    while len(waiting_stages) > 0 or len(running_stages) > 0:
+      # start every stage whose upstream stages are finished
+      for stage_name in list(waiting_stages):
+        upstream_stages = [input_value for input_value in pipeline_stages[stage_name]['inputs'].values() if input_value in pipeline_stages]
+        if all(upstream_stage not in waiting_stages and upstream_stage not in running_stages.values()
+               for upstream_stage in upstream_stages):
+          input_paths = {input_name: output_paths[input_value] if input_value in pipeline_stages else input_value
+                         for input_name, input_value in pipeline_stages[stage_name]['inputs'].items()}
+          stage_future = pool.submit(run_stage, pipeline_stages[stage_name]['function'], input_paths,
+                                     pipeline_stages[stage_name].get('params', {}), output_paths[stage_name])
+          running_stages[stage_future] = stage_name
+          waiting_stages.remove(stage_name)
+      finished_stages, not_finished = wait(list(running_stages), return_when = FIRST_COMPLETED)
+      for stage_future in finished_stages:
+        stage_name = running_stages.pop(stage_future)
+        # stops the pipeline (after running stages finish) if a stage fails
+        stage_seconds = stage_future.result()
+        print(stage_name.ljust(28) + ' ran in ' + '%.1f' % stage_seconds + ' s')
+  return output_paths
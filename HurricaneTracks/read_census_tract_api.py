@@ -1,7 +1,11 @@
-import requests
 import zipfile
 import os
-import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from download_functions import make_session, download_to_file
+from download_functions import get_folder_checksums, folder_matches_checksums
+from instrumentation import stage
 
 # read census tract data
 # partial api path
@@ -10,33 +14,65 @@ url_ender = '_tract.zip' # file ending
 output_dir = 'CensusTracts'
 os.makedirs(output_dir, exist_ok = True)
 
-# loop through all states
-for state_fip in range(1, 73):
-  # fip codes are always two digits
-  state_fip_code = str(state_fip).zfill(2)
+# number of states downloaded at the same time
+max_downloads = 4
+
+# checksums of the extracted files for every state
+# (states whose files still match are not downloaded again)
+manifest_path = os.path.join(output_dir, 'download_manifest.json')
+if os.path.exists(manifest_path):
+  with open(manifest_path) as manifest_file:
+    download_manifest = json.load(manifest_file)
+else:
+  download_manifest = {}
+
+# fip codes of all states, DC, and territories with tract files
+# (fip codes are always two digits)
+state_fip_codes = ['01', '02', '04', '05', '06', '08', '09', '10', '11', '12', '13', '15',
+                   '16', '17', '18', '19', '20', '21', '22', '23', '24', '25', '26', '27',
+                   '28', '29', '30', '31', '32', '33', '34', '35', '36', '37', '38', '39',
+                   '40', '41', '42', '44', '45', '46', '47', '48', '49', '50', '51', '53',
+                   '54', '55', '56', '60', '66', '69', '72']
 
+session = make_session(max_connections = max_downloads)
+def download_state(state_fip_code):
+  filename = 'tl_2024_' + state_fip_code
+  output_directory = os.path.join(output_dir, filename)
+  # skip states that were already extracted and have not changed
+  if folder_matches_checksums(output_directory, download_manifest.get(state_fip_code)):
+    return 'skipped', None
   # full api url
   url_total = url + state_fip_code + url_ender
-  
-  # Send a GET request to the URL
-  response = requests.get(url_total)
-  # Check if the request was successful
-  if response.status_code == 200:
-    # unzip compressed folder that was called with api
-    # (if file doesn't exist, file_found gets set to false)
-    file_found = True
-    try:
-      z = zipfile.ZipFile(io.BytesIO(response.content))
-    except:
-      file_found = False
-    
-    # if data exists, store in unique folder
-    if file_found:
-      filename = 'tl_2024_' + state_fip_code
-      print(filename)
+  # stream compressed folder to disk
+  zip_path = os.path.join(output_dir, filename + url_ender)
+  status = download_to_file(session, url_total, zip_path)
+  if status != 'downloaded':
+    return status, None
+  # unzip compressed folder that was called with api
+  try:
+    with zipfile.ZipFile(zip_path) as z:
       # create dir and extract data
-      output_directory = os.path.join(output_dir, filename)
       os.makedirs(output_directory, exist_ok = True)
       z.extractall(output_directory)
-  else:
+  except zipfile.BadZipFile:
+    return 'error', None
+  finally:
+    os.remove(zip_path)
+  return 'downloaded', get_folder_checksums(output_directory)
+
+# loop through all states
+with stage('download states') as timer:
+  with ThreadPoolExecutor(max_workers = max_downloads) as pool:
+    download_results = list(pool.map(download_state, state_fip_codes))
+  timer.rows = len(state_fip_codes)
+
+for state_fip_code, (status, checksums) in zip(state_fip_codes, download_results):
+  if status == 'downloaded':
+    print('tl_2024_' + state_fip_code)
+    download_manifest[state_fip_code] = checksums
+  elif status != 'skipped':
     print("Failed to download file " + url + state_fip_code + url_ender)
+
+# record checksums for the next run
+with open(manifest_path, 'w') as manifest_file:
+  json.dump(download_manifest, manifest_file, indent = 1, sort_keys = True)
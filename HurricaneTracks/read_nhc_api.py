@@ -1,7 +1,11 @@
-import requests
 import zipfile
 import io
+import time
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+from download_functions import make_session, fetch_cached
+from instrumentation import stage, record_storm_time
 
 # this code reads hurricane track data from nhc
 # unzips the drives and stores the shapefiles
@@ -13,41 +17,66 @@ ender = '_best_track.zip' # multiple file types in directory
 
 # local directory for extracted data
 output_dir = 'nhd_tracks'
+# local copies of downloaded zip files
+# (re-runs only download storms that are new or changed on the server)
+cache_dir = 'nhd_download_cache'
 
 # data availability on web directory is 2010-2025
 start_year = 2010
 end_year = 2025
 
+# number of files downloaded at the same time
+max_downloads = 8
+
 # create directory for storing shapefile output
 os.makedirs(output_dir, exist_ok = True)
 
 # loop through years
+filenames = []
 for year_use in range(start_year, end_year + 1):
-  # keep track of progress
-  print('Reading Hurricane Tracks from year ' + str(year_use))
   # loop through up to 31 hurricanes in a given year
   # not every year has 31 hurricanes
   for hurricane_no in range(0, 31):
-    file_found = True
     hurricane_index = str(hurricane_no + 1).zfill(2)
     # nhc naming convention
     # al = atlantic
     # hurricane index = count of hurricanes in year
     # year_use = year
-    filename = 'al' + hurricane_index + str(year_use)
-    # call nhc api
-    response = requests.get(url + filename + ender, stream=True)
+    filenames.append('al' + hurricane_index + str(year_use))
+
+# call nhc api for all storms, sharing pooled connections
+session = make_session(max_connections = max_downloads)
+def fetch_storm(filename):
+  start_time = time.perf_counter()
+  response = fetch_cached(session, url + filename + ender, cache_dir)
+  if response[0] != 'missing':
+    record_storm_time('download storm', time.perf_counter() - start_time)
+  return response
+with stage('download storms') as timer:
+  with ThreadPoolExecutor(max_workers = max_downloads) as pool:
+    responses = list(pool.map(fetch_storm, filenames))
+  timer.rows = len(filenames)
 
+with stage('extract storms'):
+  for filename, (status, content) in zip(filenames, responses):
+    # no file on the server = no storm with this number
+    if status == 'missing':
+      continue
+    if status == 'error':
+      print('Failed to download ' + filename + ': ' + content)
+      continue
+    output_directory = os.path.join(output_dir, filename)
+    # skip storms that have not changed since the last run
+    if status == 'cached' and os.path.isdir(output_directory):
+      continue
     # unzip compressed folder that was called with api
-    # (if file doesn't exist, file_found gets set to false)
     try:
-      z = zipfile.ZipFile(io.BytesIO(response.content))
-    except:
-      file_found = False
-      
-    # if data exists, store in unique folder
-    if file_found:
-      # create dir and extract data
-      output_directory = os.path.join(output_dir, filename)
-      os.makedirs(output_directory, exist_ok = True)
-      z.extractall(output_directory)
+      z = zipfile.ZipFile(io.BytesIO(content))
+    except zipfile.BadZipFile:
+      print('Not a zip file: ' + filename)
+      continue
+    # keep track of progress
+    print('Extracting Hurricane Tracks ' + filename)
+    # create dir and extract data
+    os.makedirs(output_directory, exist_ok = True)
+    z.extractall(output_directory)
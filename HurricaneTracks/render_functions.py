@@ -0,0 +1,108 @@
+import matplotlib
+import matplotlib.pyplot as plt
+import geopandas as gpd
+import shapely
+import hashlib
+import json
+import time
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from data_access_functions import load_states, load_tracts
+from download_functions import get_file_checksum, get_layer_checksum
+from instrumentation import stage, record_storm_time
+
+# per-storm exposure maps
+# each map job is a dictionary with the storm year/number, peak point location,
+# and the index labels of the tracts (per radius) and states it touches, so
+# maps are drawn without any spatial joins. Each map's inputs are hashed and
+# recorded in a manifest next to the images - maps whose hash has not
+# changed (and whose image exists) are not drawn again
+
+# tract and state layers shared by each worker process
+# (set once per process by init_render_worker)
+_worker_tracts = None
+_worker_states = None
+
+def init_render_worker(tract_path, state_path, epsg, file_backend = True):
+  # workers draw straight to file (no interactive windows)
+  global _worker_tracts, _worker_states
+  if file_backend:
+    matplotlib.use('Agg', force = True)
+  _worker_tracts = load_tracts(columns = ['Population', 'geometry'], tract_path = tract_path)
+  _worker_states = load_states(epsg = epsg, state_path = state_path)
+
+def get_map_name(map_job):
+  return 'hurricane_' + str(map_job['year']) + '_' + str(map_job['storm']) + '.png'
+
+def get_map_hash(map_job, layer_checksums):
+  # hash of everything that is drawn on a storm map
+  map_hash = hashlib.sha256(json.dumps(map_job, sort_keys = True).encode('utf-8'))
+  for layer_checksum in layer_checksums:
+    map_hash.update(layer_checksum.encode('utf-8'))
+  return map_hash.hexdigest()
+
+def render_storm_map(map_job, output_dir):
+  # 2 x 2 figure of exposed tracts (one radius per axis) over the nearby states
+  # returns the map name and the time taken to draw it
+  start_time = time.perf_counter()
+  point_geom = shapely.Point(map_job['x'], map_job['y'])
+  exposed_states = _worker_states.iloc[map_job['states']]
+  fig, ax = plt.subplots(2,2)
+  x_cnt = 0 # keep track of plot axis (row)
+  y_cnt = 0 # keep track of plot axis (column)
+  for buffer_radius, exposed_ids in zip(map_job['radii'], map_job['tracts']):
+    gdf_point_buffer = gpd.GeoDataFrame([0,], crs = _worker_tracts.crs, geometry = [point_geom.buffer(buffer_radius),])
+    exposed_tracts = _worker_tracts.loc[exposed_ids]
+    exposed_states.plot(ax = ax[x_cnt][y_cnt], facecolor = 'steelblue', alpha = 0.2) # plot states in background
+    # plot tracts as a cholorpleth
+    exposed_tracts.plot(ax = ax[x_cnt][y_cnt], column='Population', legend = True, cmap = 'inferno', vmin = 0, vmax = 10000)
+    # show location of hurricane radius area
+    gdf_point_buffer.plot(ax = ax[x_cnt][y_cnt], facecolor = 'none', linewidth = 1.0, edgecolor = 'black')
+    # remove axis ticks/labels
+    ax[x_cnt][y_cnt].set_xticks([])
+    ax[x_cnt][y_cnt].set_yticks([])
+    ax[x_cnt][y_cnt].set_xticklabels('')
+    ax[x_cnt][y_cnt].set_yticklabels('')
+    x_cnt += 1
+    if x_cnt == 2:
+      y_cnt += 1
+      x_cnt = 0
+  fig.savefig(os.path.join(output_dir, get_map_name(map_job)))
+  plt.close(fig)
+  return get_map_name(map_job), time.perf_counter() - start_time
+
+def render_storm_maps(map_jobs, tract_path, state_path, output_dir, epsg = 32618, max_workers = None):
+  # draw maps for storms that are new or whose inputs have changed
+  # returns the names of the maps that were drawn
+  manifest_path = os.path.join(output_dir, 'render_manifest.json')
+  render_manifest = {}
+  if os.path.exists(manifest_path):
+    with open(manifest_path) as manifest_file:
+      render_manifest = json.load(manifest_file)
+  layer_checksums = [get_file_checksum(tract_path), get_layer_checksum(state_path), str(epsg)]
+  map_hashes = {get_map_name(map_job): get_map_hash(map_job, layer_checksums) for map_job in map_jobs}
+  draw_jobs = [map_job for map_job in map_jobs if render_manifest.get(get_map_name(map_job)) != map_hashes[get_map_name(map_job)]
+               or not os.path.exists(os.path.join(output_dir, get_map_name(map_job)))]
+  drawn_maps = []
+  os.makedirs(output_dir, exist_ok = True)
+  if len(draw_jobs) > 0:
+    with stage('render storm maps') as timer:
+      # draw maps in parallel (max_workers = 1 draws them one at a time)
+      if max_workers == 1:
+        init_render_worker(tract_path, state_path, epsg, file_backend = False)
+        drawn_results = [render_storm_map(map_job, output_dir) for map_job in draw_jobs]
+      else:
+        with ProcessPoolExecutor(max_workers = max_workers, initializer = init_render_worker,
+                                 initargs = (tract_path, state_path, epsg)) as pool:
+          drawn_results = list(pool.map(render_storm_map, draw_jobs, [output_dir,] * len(draw_jobs)))
+      timer.rows = len(drawn_results)
+    for map_name, draw_time in drawn_results:
+      drawn_maps.append(map_name)
+      record_storm_time('render storm map', draw_time)
+  # record the inputs of every map (all maps are now up to date)
+  for map_name in map_hashes:
+    render_manifest[map_name] = map_hashes[map_name]
+  with open(manifest_path, 'w') as manifest_file:
+    json.dump(render_manifest, manifest_file, indent = 1, sort_keys = True)
+  return drawn_maps
@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import os
+
+from pipeline_functions import run_pipeline
+from track_functions import combine_event_tracks, build_storm_summary, update_storm_summary
+from track_functions import get_combined_track_dir, read_combined_tracks
+from tract_functions import read_tract_population, get_state_tract_shapefiles, read_state_tract_files
+from tract_functions import write_population_tracts, read_population_tracts
+from parcel_functions import read_parcels
+from exposure_functions import calculate_radius_exposure, exposure_column_name
+from landfall_functions import count_state_landfalls, count_state_exceedances
+
+# this code runs the track combining, state hazard, and exposure steps
+# as one pipeline (run read_nhc_api.py and read_census_tract_api.py first)
+# every intermediate layer and table is cached in 'pipeline_cache' under a hash
+# of its inputs and settings, so re-running only repeats the steps whose
+# inputs have changed (e.g. changing buffer_radii only re-runs the exposure steps)
+# and steps that don't depend on each other run at the same time
+
+# settings
+cache_dir = 'pipeline_cache'
+buffer_radii = [200000.0, 150000.0, 100000.0, 50000.0]
+# 'intersects' counts a tract's whole population if any part of it is within the radius,
+# 'area' only counts the share of the tract's area that is within the radius
+exposure_weighting = 'intersects'
+landfall_years = list(range(2010, 2025))
+knot_vals = list(np.arange(1, 31) * 5.0)
+parcel_files = [os.path.join('Parcels', 'nc_' + nc_county + '_parcels_pt.shp') for nc_county in ['brunswick', 'newhanover']]
+state_path = os.path.join('cb_2018_us_state_500k', 'cb_2018_us_state_500k.shp')
+# only the downloaded tract shapefiles are inputs (the CensusTracts folder also holds
+# files written by estimate_hurricane_exposure.py, which should not re-run the tract stages)
+tract_shapefiles = get_state_tract_shapefiles('CensusTracts') if os.path.isdir('CensusTracts') else []
+
+# stage functions - each one reads its inputs and writes one output file
+def combine_tracks_stage(input_paths, params, output_path):
+  # combined tracks (and the storm summary) are also kept up to date in combined_tracks
+  # (read only new or changed events)
+  os.makedirs(params['combined_dir'], exist_ok = True)
+  changed_seasons, read_events = combine_event_tracks(input_paths['events'], params['combined_dir'], params['dt'],
+                                                      params['ender'], epsg = params['epsg'])
+  if params['dt'] == 'points':
+    update_storm_summary(params['combined_dir'], changed_seasons)
+  read_combined_tracks(get_combined_track_dir(params['combined_dir'], params['dt'])).to_parquet(output_path)
+
+def project_layer_stage(input_paths, params, output_path):
+  gpd.read_file(input_paths['layer']).to_crs(epsg = params['epsg']).to_parquet(output_path)
+
+def storm_summary_stage(input_paths, params, output_path):
+  build_storm_summary(gpd.read_parquet(input_paths['points'])).to_crs(epsg = params['epsg']).to_parquet(output_path)
+
+def population_tracts_stage(input_paths, params, output_path):
+  tract_population = read_tract_population(input_paths['population'])
+  tract_shapefiles = [input_paths[input_name] for input_name in sorted(input_paths) if input_name.startswith('tracts_')]
+  population_tracts_gdf, unmatched_tracts = read_state_tract_files(tract_shapefiles, tract_population, epsg = params['epsg'])
+  if len(unmatched_tracts.index) > 0:
+    print('No pop data for ' + str(len(unmatched_tracts.index)) + ' tracts')
+  write_population_tracts(population_tracts_gdf, output_path)
+
+def inland_storm_peaks_stage(input_paths, params, output_path):
+  # peak of every storm among the track points that fall inside a census tract
+  hurricane_points = gpd.read_parquet(input_paths['points']).to_crs(epsg = params['epsg'])
+  population_tracts_gdf = read_population_tracts(input_paths['tracts'], columns = ['geometry'])
+  inland_points = gpd.sjoin(hurricane_points, population_tracts_gdf, how = 'inner', predicate = 'intersects')
+  build_storm_summary(inland_points).to_parquet(output_path)
+
+def parcels_stage(input_paths, params, output_path):
+  parcels = read_parcels([input_paths[input_name] for input_name in sorted(input_paths)], columns = [params['column'],])
+  parcels.to_crs(epsg = params['epsg']).to_parquet(output_path)
+
+def radius_exposure_stage(input_paths, params, output_path):
+  # exposure table in the same format as get_hurricane_exposure
+  exposure_gdf = gpd.read_parquet(input_paths['exposure'], columns = [params['column'], 'geometry'])
+  storm_peaks = gpd.read_parquet(input_paths['storms'])
+  radius_exposure = calculate_radius_exposure(exposure_gdf, params['column'], storm_peaks, params['buffer_radii'],
+                                              weighting = params['weighting'])
+  hurricane_classification_df = pd.DataFrame(index = np.arange(len(storm_peaks.index)))
+  hurricane_classification_df['Year'] = storm_peaks['TCYR'].to_numpy(dtype = float)
+  hurricane_classification_df['HurricaneNo'] = storm_peaks['STORMNUM'].to_numpy(dtype = float)
+  hurricane_classification_df['Name'] = storm_peaks['STORMNAME'].to_numpy()
+  hurricane_classification_df['Landfall Windspeed'] = storm_peaks['INTENSITY'].to_numpy(dtype = float) * 1.15
+  for buffer_radius in params['buffer_radii']:
+    hurricane_classification_df[exposure_column_name(params['label'], buffer_radius)] = radius_exposure[float(buffer_radius)].to_numpy()
+  hurricane_classification_df.to_csv(output_path)
+
+def state_landfalls_stage(input_paths, params, output_path):
+  hurricane_rates = count_state_landfalls(gpd.read_parquet(input_paths['lines']), gpd.read_parquet(input_paths['states']),
+                                          params['years'])
+  hurricane_rates.to_csv(output_path)
+
+def state_exceedances_stage(input_paths, params, output_path):
+  state_hours = count_state_exceedances(gpd.read_parquet(input_paths['points']), gpd.read_parquet(input_paths['states']),
+                                        params['knot_vals'], params['hours_per_point'], min_points = params['min_points'],
+                                        other_hours_per_point = params['other_hours_per_point'])
+  state_hours.to_csv(output_path)
+
+# stages (inputs are file/folder paths or the names of other stages)
+pipeline_stages = {
+  'combined_points': {'function': combine_tracks_stage, 'inputs': {'events': 'nhd_tracks'}, 'output': '.parquet',
+                      'params': {'combined_dir': 'combined_tracks', 'dt': 'points', 'ender': ['position', 'pts'], 'epsg': 3857}},
+  'combined_lines': {'function': combine_tracks_stage, 'inputs': {'events': 'nhd_tracks'}, 'output': '.parquet',
+                     'params': {'combined_dir': 'combined_tracks', 'dt': 'lines', 'ender': ['lin', 'track'], 'epsg': 3857}},
+  'states_3857': {'function': project_layer_stage, 'inputs': {'layer': state_path}, 'output': '.parquet',
+                  'params': {'epsg': 3857}},
+  'storm_summary': {'function': storm_summary_stage, 'inputs': {'points': 'combined_points'}, 'output': '.parquet',
+                    'params': {'epsg': 32618}},
+  'population_tracts': {'function': population_tracts_stage, 'output': '.parquet',
+                        'inputs': dict({'population': 'ACSDT5Y2023.B01003-Data.csv'},
+                                       **{'tracts_' + os.path.basename(os.path.dirname(tract_shapefile)): tract_shapefile
+                                          for tract_shapefile in tract_shapefiles}),
+                        'params': {'epsg': 32618}},
+  'inland_storm_peaks': {'function': inland_storm_peaks_stage, 'inputs': {'points': 'combined_points', 'tracts': 'population_tracts'},
+                         'output': '.parquet', 'params': {'epsg': 32618}},
+  'population_exposure': {'function': radius_exposure_stage, 'inputs': {'exposure': 'population_tracts', 'storms': 'inland_storm_peaks'},
+                          'output': '.csv', 'params': {'column': 'Population', 'label': 'Population', 'buffer_radii': buffer_radii,
+                                                       'weighting': exposure_weighting}},
+  'state_landfalls': {'function': state_landfalls_stage, 'inputs': {'lines': 'combined_lines', 'states': 'states_3857'},
+                      'output': '.csv', 'params': {'years': landfall_years}},
+  'state_exceedances': {'function': state_exceedances_stage, 'inputs': {'points': 'combined_points', 'states': 'states_3857'},
+                        'output': '.csv', 'params': {'knot_vals': knot_vals, 'hours_per_point': 6.0 / 15.0,
+                                                     'min_points': 21, 'other_hours_per_point': 0.25}},
+}
+# parcel exposure only runs if the parcel files have been downloaded
+if all(os.path.exists(parcel_file) for parcel_file in parcel_files):
+  pipeline_stages['parcels'] = {'function': parcels_stage, 'output': '.parquet',
+                                'inputs': {'parcels_' + str(file_num): parcel_file for file_num, parcel_file in enumerate(parcel_files)},
+                                'params': {'column': 'IMPROVVAL', 'epsg': 32618}}
+  pipeline_stages['parcel_exposure'] = {'function': radius_exposure_stage, 'inputs': {'exposure': 'parcels', 'storms': 'storm_summary'},
+                                        'output': '.csv', 'params': {'column': 'IMPROVVAL', 'label': 'structure_value',
+                                                                     'buffer_radii': buffer_radii, 'weighting': 'intersects'}}
+
+if __name__ == '__main__':
+  output_paths = run_pipeline(pipeline_stages, cache_dir, max_workers = None)
+  for stage_name, output_path in output_paths.items():
+    print(stage_name.ljust(28) + ' ' + output_path)
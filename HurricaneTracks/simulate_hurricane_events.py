@@ -0,0 +1,66 @@
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from simulation_functions import get_landfall_rates, get_state_storm_peaks, get_state_samples
+from simulation_functions import make_exposure_grids, simulate_annual_losses, get_exceedance_curves
+from simulation_functions import default_ring_edges
+from data_access_functions import load_states, load_track_points, load_tracts
+from instrumentation import stage
+
+# this code simulates a large set of hurricane years from the observed
+# landfall rates (run explore_hurricane_tracks.py and estimate_hurricane_exposure.py first)
+# and writes annual exposure / loss for every simulated year and the
+# exceedance probability curves
+
+# settings
+num_years = 1000000
+seed = 0
+years_per_shard = 50000
+jitter_distance = 50000.0 # standard deviation (meters) added to resampled peak locations
+cell_size = 5000.0 # exposure grid cell size (meters)
+exposure_column = 'Population'
+exposure_label = 'Population'
+
+if __name__ == '__main__':
+  # mean annual landfalls in each state
+  with stage('read landfall rates') as timer:
+    state_rates = get_landfall_rates(pd.read_csv('hurricane_landfall_timeseries.csv', index_col = 0))
+    timer.rows = len(state_rates.index)
+  # observed peak intensity / location of each storm in each state
+  with stage('state storm peaks') as timer:
+    track_points = load_track_points(epsg = 32618)
+    us_states = load_states(epsg = 32618)
+    state_samples = get_state_samples(state_rates, get_state_storm_peaks(track_points, us_states))
+    timer.rows = len(state_samples['intensity'])
+  missing_states = [state_name for state_name in state_rates.index if state_name not in state_samples['states']]
+  if len(missing_states) > 0:
+    print('No track points inside ' + ', '.join(missing_states) + ' (not simulated)')
+
+  # exposure in each distance ring around every grid cell
+  with stage('exposure grids') as timer:
+    exposure_gdf = load_tracts(columns = [exposure_column, 'geometry'])
+    exposure_grids = make_exposure_grids(exposure_gdf, exposure_column, ring_edges = default_ring_edges, cell_size = cell_size)
+    timer.rows = len(exposure_gdf.index)
+
+  with stage('simulate years') as timer:
+    annual_losses = simulate_annual_losses(state_samples, exposure_grids, num_years, seed = seed,
+                                           years_per_shard = years_per_shard, jitter_distance = jitter_distance)
+    timer.rows = num_years
+  annual_losses.to_parquet('simulated_annual_' + exposure_label + '.parquet')
+  exceedance_curves = get_exceedance_curves(annual_losses)
+  exceedance_curves.to_csv('exceedance_curves_' + exposure_label + '.csv')
+  print(exceedance_curves)
+
+  # plot exceedance probability curves
+  fig, ax = plt.subplots(1, 2, figsize = (16, 6))
+  for curve_name in ['AEP Loss', 'OEP Loss']:
+    ax[0].plot(exceedance_curves.index, exceedance_curves[curve_name], label = curve_name, linewidth = 2.5)
+  ax[1].plot(exceedance_curves.index, exceedance_curves['AEP Exposure'], color = 'black', linewidth = 2.5)
+  for panel in ax:
+    panel.set_xscale('log')
+    panel.set_xlabel('Return Period (years)', fontsize = 18)
+  ax[0].set_ylabel('Annual Loss (' + exposure_label + ')', fontsize = 18)
+  ax[1].set_ylabel('Exposed ' + exposure_label + ' per Year', fontsize = 18)
+  ax[0].legend(fontsize = 14)
+  plt.savefig('exceedance_curves_' + exposure_label + '.png', bbox_inches = 'tight', dpi = 150)
+  plt.close()
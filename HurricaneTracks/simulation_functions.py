@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy.signal import fftconvolve
+from concurrent.futures import ProcessPoolExecutor
+
+from windfield_functions import rankine_wind_speed
+from grid_functions import rasterize_exposure
+
+# stochastic event set built from the observed landfall rates
+# for every simulated year and state, the number of storms is drawn from a poisson
+# distribution with the state's mean annual landfalls, each storm gets an intensity
+# from the state's observed peak intensities, and a peak location from the state's
+# observed peak locations (moved by a random jitter)
+# exposure near each simulated storm is read from precomputed grids: exposure is
+# summed into grid cells once, and an fft convolution with a ring kernel gives the
+# exposure in each distance ring around every cell, so each storm only needs
+# a grid lookup. Winds in each ring come from a modified rankine vortex and losses
+# from an emanuel (2011) style damage function
+# years are simulated in shards (each with its own random stream) in a process pool
+
+# distance rings (meters) around the storm peak location used for exposure and losses
+default_ring_edges = [0.0, 25000.0, 50000.0, 100000.0, 150000.0, 200000.0]
+
+def get_landfall_rates(hurricane_rates):
+  # mean annual landfalls in each state from the year x state table
+  # written by explore_hurricane_tracks.py (hurricane_landfall_timeseries.csv)
+  state_rates = hurricane_rates.drop(columns = ['Total',], errors = 'ignore').mean()
+  return state_rates[state_rates > 0.0]
+
+def get_state_storm_peaks(hurricane_points, us_states, storm_keys = ['TCYR', 'STORMNUM']):
+  # strongest track point of every storm in every state it passed through
+  # (one sjoin of all points against all states, then a grouped idxmax)
+  state_points = gpd.sjoin(hurricane_points[storm_keys + ['INTENSITY', 'geometry']], us_states[['NAME', 'geometry']],
+                           how = 'inner', predicate = 'within').reset_index(drop = True)
+  peak_index = state_points.groupby(storm_keys + ['NAME',], sort = False)['INTENSITY'].idxmax()
+  state_peaks = state_points.loc[peak_index.to_numpy(), storm_keys + ['NAME', 'INTENSITY', 'geometry']]
+  return state_peaks.reset_index(drop = True)
+
+def get_state_samples(state_rates, state_peaks):
+  # observed peak intensities and locations of each state, stored as one set of
+  # arrays with the start and size of each state's block (for vectorized sampling)
+  # states with a landfall rate but no observed peak points are dropped
+  state_peaks = state_peaks[state_peaks['NAME'].isin(state_rates.index)]
+  state_names = [state_name for state_name in state_rates.index if state_name in set(state_peaks['NAME'])]
+  state_codes = pd.Categorical(state_peaks['NAME'], categories = state_names).codes
+  peak_order = np.argsort(state_codes, kind = 'stable')
+  sample_sizes = np.bincount(state_codes, minlength = len(state_names))
+  state_samples = {'states': state_names,
+                   'rates': state_rates.loc[state_names].to_numpy(dtype = float),
+                   'starts': np.r_[0, np.cumsum(sample_sizes)[:-1]],
+                   'sizes': sample_sizes,
+                   'intensity': state_peaks['INTENSITY'].to_numpy(dtype = float)[peak_order],
+                   'x': state_peaks.geometry.x.to_numpy()[peak_order],
+                   'y': state_peaks.geometry.y.to_numpy()[peak_order]}
+  return state_samples
+
+def make_ring_kernel(cell_size, inner_radius, outer_radius):
+  # 1 for the grid cells whose centers are in the ring [inner_radius, outer_radius)
+  half_width = int(np.ceil(outer_radius / cell_size))
+  cell_offsets = np.arange(-half_width, half_width + 1) * cell_size
+  cell_distances = np.hypot(cell_offsets[np.newaxis, :], cell_offsets[:, np.newaxis])
+  return ((cell_distances >= inner_radius) & (cell_distances < outer_radius)).astype(float)
+
+def make_exposure_grids(exposure_gdf, exposure_column, ring_edges = default_ring_edges, cell_size = 5000.0):
+  # exposure in each distance ring around the center of every grid cell
+  # exposure is placed at a representative point of each geometry, and the grid is
+  # padded by the largest ring so storms just outside the exposure still reach it
+  # returns a dictionary with the grids (ring x row x column) and the grid origin / cell size
+  ring_edges = np.asarray(ring_edges, dtype = float)
+  cell_exposure, x_origin, y_origin = rasterize_exposure(exposure_gdf, exposure_column, cell_size,
+                                                         padding = ring_edges[-1] + cell_size)
+  num_rows, num_columns = cell_exposure.shape
+  ring_grids = np.zeros((len(ring_edges) - 1, num_rows, num_columns), dtype = np.float32)
+  for ring_num, (inner_radius, outer_radius) in enumerate(zip(ring_edges[:-1], ring_edges[1:])):
+    ring_grid = fftconvolve(cell_exposure, make_ring_kernel(cell_size, inner_radius, outer_radius), mode = 'same')
+    # fft round-off can leave tiny negative values
+    ring_grids[ring_num] = np.maximum(ring_grid, 0.0)
+  return {'grids': ring_grids, 'x_origin': x_origin, 'y_origin': y_origin, 'cell_size': cell_size,
+          'ring_edges': ring_edges}
+
+def emanuel_damage_fraction(wind_speed, threshold_wind = 50.0, half_damage_wind = 145.0):
+  # fraction of value lost at each wind speed (emanuel, 2011)
+  # defaults are in knots (25.7 m/s threshold, 74.7 m/s for half damage)
+  scaled_wind = np.maximum(wind_speed - threshold_wind, 0.0) / (half_damage_wind - threshold_wind)
+  return scaled_wind ** 3 / (1.0 + scaled_wind ** 3)
+
+# state samples and exposure grids shared by each worker process
+# (set once per process by init_simulation_worker)
+_worker_samples = None
+_worker_grids = None
+
+def init_simulation_worker(state_samples, exposure_grids):
+  global _worker_samples, _worker_grids
+  _worker_samples = state_samples
+  _worker_grids = exposure_grids
+
+def simulate_events(rng, num_years, state_samples, jitter_distance):
+  # year, state, intensity, and peak location of every storm in num_years simulated years
+  storm_counts = rng.poisson(state_samples['rates'], size = (num_years, len(state_samples['rates'])))
+  storm_year = np.repeat(np.arange(num_years), storm_counts.sum(axis = 1))
+  # counts are year-major, so repeating the state numbers gives each storm's state in the same order
+  storm_state = np.repeat(np.tile(np.arange(len(state_samples['rates'])), num_years), storm_counts.ravel())
+  sample_sizes = state_samples['sizes'][storm_state]
+  # intensity and location are drawn separately from the state's observed peaks
+  intensity_idx = state_samples['starts'][storm_state] + (rng.random(len(storm_state)) * sample_sizes).astype(int)
+  location_idx = state_samples['starts'][storm_state] + (rng.random(len(storm_state)) * sample_sizes).astype(int)
+  storm_x = state_samples['x'][location_idx] + rng.normal(0.0, jitter_distance, len(storm_state))
+  storm_y = state_samples['y'][location_idx] + rng.normal(0.0, jitter_distance, len(storm_state))
+  return storm_year, storm_state, state_samples['intensity'][intensity_idx], storm_x, storm_y
+
+def get_event_exposure(storm_intensity, storm_x, storm_y, exposure_grids, exposure_wind = 64.0,
+                       rmax = 40000.0, decay_exponent = 0.5):
+  # exposure with winds above exposure_wind (knots) and losses for every storm
+  # winds in each ring are taken at the middle of the ring
+  ring_grids = exposure_grids['grids']
+  ring_edges = exposure_grids['ring_edges']
+  storm_columns = np.floor((storm_x - exposure_grids['x_origin']) / exposure_grids['cell_size']).astype(np.int64)
+  storm_rows = np.floor((storm_y - exposure_grids['y_origin']) / exposure_grids['cell_size']).astype(np.int64)
+  # storms off the grid are too far from any exposure to reach it
+  on_grid = (storm_columns >= 0) & (storm_columns < ring_grids.shape[2]) & (storm_rows >= 0) & (storm_rows < ring_grids.shape[1])
+  ring_exposure = np.zeros((len(ring_edges) - 1, len(storm_x)))
+  ring_exposure[:, on_grid] = ring_grids[:, storm_rows[on_grid], storm_columns[on_grid]]
+  ring_distances = 0.5 * (ring_edges[:-1] + ring_edges[1:])
+  ring_wind = rankine_wind_speed(ring_distances[:, np.newaxis], storm_intensity[np.newaxis, :], rmax, decay_exponent)
+  event_exposure = np.sum(ring_exposure * (ring_wind >= exposure_wind), axis = 0)
+  event_loss = np.sum(ring_exposure * emanuel_damage_fraction(ring_wind), axis = 0)
+  return event_exposure, event_loss
+
+def simulate_shard(seed_sequence, num_years, jitter_distance, exposure_wind, rmax, decay_exponent):
+  # annual storm count, exposure, loss, and largest single-storm loss for one shard of years
+  rng = np.random.default_rng(seed_sequence)
+  storm_year, storm_state, storm_intensity, storm_x, storm_y = simulate_events(rng, num_years, _worker_samples, jitter_distance)
+  event_exposure, event_loss = get_event_exposure(storm_intensity, storm_x, storm_y, _worker_grids, exposure_wind,
+                                                  rmax, decay_exponent)
+  max_event_loss = np.zeros(num_years)
+  np.maximum.at(max_event_loss, storm_year, event_loss)
+  return np.column_stack([np.bincount(storm_year, minlength = num_years),
+                          np.bincount(storm_year, weights = event_exposure, minlength = num_years),
+                          np.bincount(storm_year, weights = event_loss, minlength = num_years),
+                          max_event_loss])
+
+def simulate_annual_losses(state_samples, exposure_grids, num_years, seed = 0, years_per_shard = 50000,
+                           jitter_distance = 50000.0, exposure_wind = 64.0, rmax = 40000.0, decay_exponent = 0.5,
+                           max_workers = None):
+  # annual storm count, exposure, and loss for num_years simulated years
+  # each shard gets its own random stream spawned from seed, so results only
+  # depend on seed and years_per_shard (not on the number of workers)
+  # max_workers = 1 runs every shard in this process
+  shard_years = [years_per_shard,] * (num_years // years_per_shard)
+  if num_years % years_per_shard > 0:
+    shard_years.append(num_years % years_per_shard)
+  seed_sequences = np.random.SeedSequence(seed).spawn(len(shard_years))
+  shard_args = [(seed_sequence, shard_size, jitter_distance, exposure_wind, rmax, decay_exponent)
+                for seed_sequence, shard_size in zip(seed_sequences, shard_years)]
+  if max_workers == 1:
+    init_simulation_worker(state_samples, exposure_grids)
+    shard_results = [simulate_shard(*shard_arg) for shard_arg in shard_args]
+  else:
+    with ProcessPoolExecutor(max_workers = max_workers, initializer = init_simulation_worker,
+                             initargs = (state_samples, exposure_grids)) as pool:
+      shard_results = list(pool.map(simulate_shard, *zip(*shard_args)))
+  annual_losses = pd.DataFrame(np.concatenate(shard_results), columns = ['Storms', 'Exposure', 'Loss', 'Max Event Loss'])
+  annual_losses['Storms'] = annual_losses['Storms'].astype(int)
+  annual_losses.index.name = 'Year'
+  return annual_losses
+
+def get_exceedance_curves(annual_losses, return_periods = [2, 5, 10, 25, 50, 100, 250, 500, 1000]):
+  # value exceeded with an annual probability of 1 / return period
+  # aggregate (AEP) curves for total annual exposure and loss, and the
+  # occurrence (OEP) curve for the largest single-storm loss in a year
+  return_periods = np.asarray(return_periods, dtype = float)
+  exceedance_probability = 1.0 / return_periods
+  exceedance_curves = pd.DataFrame(index = pd.Index(return_periods, name = 'Return Period'))
+  exceedance_curves['Exceedance Probability'] = exceedance_probability
+  for curve_name, column_name in [('AEP Exposure', 'Exposure'), ('AEP Loss', 'Loss'), ('OEP Loss', 'Max Event Loss')]:
+    exceedance_curves[curve_name] = np.quantile(annual_losses[column_name].to_numpy(), 1.0 - exceedance_probability)
+  return exceedance_curves
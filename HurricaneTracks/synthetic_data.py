@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import os
+
+# synthetic stand-ins for the nhc tracks, census tracts, tract population,
+# states, and parcels, written with the same folder layout, file names, and
+# columns as the real downloads (so the pipeline functions can be run on them
+# offline). Everything is made from one seeded random generator, so the same
+# settings always give the same files
+
+# area covered by the synthetic data (lon/lat)
+synthetic_bounds = [-100.0, 24.0, -66.0, 45.0]
+storm_names = ['ALPHA', 'BRAVO', 'CHARLIE', 'DELTA', 'ECHO', 'FOXTROT', 'GOLF', 'HOTEL', 'INDIA', 'JULIETT',
+               'KILO', 'LIMA', 'MIKE', 'NOVEMBER', 'OSCAR', 'PAPA', 'QUEBEC', 'ROMEO', 'SIERRA', 'TANGO']
+
+def make_synthetic_states(rng, num_states = 12):
+  # land area with a wavy gulf and atlantic coastline, split into states from west to east
+  xmin, ymin, xmax, ymax = synthetic_bounds
+  gulf_x = np.linspace(xmin, -80.0, 120)
+  gulf_y = 29.0 + 1.5 * np.sin(gulf_x / 2.0) + rng.normal(0.0, 0.15, len(gulf_x))
+  atlantic_y = np.linspace(gulf_y[-1], ymax, 120)
+  atlantic_x = -80.0 + 10.0 * (atlantic_y - atlantic_y[0]) / (ymax - atlantic_y[0]) + 1.0 * np.sin(atlantic_y) + rng.normal(0.0, 0.15, len(atlantic_y))
+  coast_coords = np.vstack([np.column_stack([gulf_x, gulf_y]), np.column_stack([atlantic_x, atlantic_y])[1:]])
+  land_geom = shapely.Polygon(np.vstack([coast_coords, [[xmin, ymax], [xmin, gulf_y[0]]]]))
+  state_edges = np.linspace(xmin, shapely.bounds(land_geom)[2], num_states + 1)
+  state_geoms = shapely.intersection(land_geom, shapely.box(state_edges[:-1], ymin, state_edges[1:], ymax))
+  state_fips = [str(state_num + 1).zfill(2) for state_num in range(num_states)]
+  return gpd.GeoDataFrame({'STATEFP': state_fips, 'NAME': ['State ' + state_fp for state_fp in state_fips]},
+                          geometry = state_geoms, crs = 'EPSG:4326')
+
+def make_synthetic_tracks(rng, start_year = 2010, num_years = 5, storms_per_year = 15, points_per_storm = 40):
+  # storm track points (one row per 6-hourly fix) that start over the ocean
+  # to the southeast and drift northwest before turning northeast
+  all_points = []
+  for year_use in range(start_year, start_year + num_years):
+    for storm_num in range(1, storms_per_year + 1):
+      start_x = rng.uniform(-85.0, -60.0)
+      start_y = rng.uniform(15.0, 25.0)
+      turn_point = rng.integers(points_per_storm // 3, points_per_storm)
+      step_x = np.where(np.arange(points_per_storm) < turn_point, -0.5, 0.6) + rng.normal(0.0, 0.2, points_per_storm)
+      step_y = 0.35 + rng.normal(0.0, 0.15, points_per_storm)
+      fix_hours = np.arange(points_per_storm, dtype = np.int64) * 6
+      intensity = np.clip(np.cumsum(rng.normal(2.0, 8.0, points_per_storm)) + 30.0, 15.0, 160.0)
+      storm_points = pd.DataFrame({'STORMNAME': storm_names[(storm_num - 1) % len(storm_names)],
+                                   'DTG': year_use * 1000000 + 80000 + (fix_hours // 24 + 1) * 100 + fix_hours % 24,
+                                   'STORMNUM': float(storm_num),
+                                   'INTENSITY': np.round(intensity / 5.0).astype(int) * 5})
+      storm_points['EVENT'] = 'al' + str(storm_num).zfill(2) + str(year_use)
+      storm_points['geometry'] = shapely.points(start_x + np.cumsum(step_x), start_y + np.cumsum(step_y))
+      all_points.append(storm_points)
+  return gpd.GeoDataFrame(pd.concat(all_points, ignore_index = True), geometry = 'geometry', crs = 'EPSG:4326')
+
+def write_synthetic_events(track_points, output_dir):
+  # one folder per event, with a points file and a lines file (as extracted from the nhc zip files)
+  for hurricane_event, event_points in track_points.groupby('EVENT', sort = False):
+    event_dir = os.path.join(output_dir, hurricane_event)
+    os.makedirs(event_dir, exist_ok = True)
+    event_points = event_points.drop(columns = ['EVENT'])
+    event_points.to_file(os.path.join(event_dir, hurricane_event + '_pts.shp'))
+    event_line = gpd.GeoDataFrame(event_points[['STORMNAME', 'STORMNUM']].iloc[:1], crs = event_points.crs,
+                                  geometry = [shapely.linestrings(shapely.get_coordinates(event_points.geometry.values))])
+    event_line.to_file(os.path.join(event_dir, hurricane_event + '_lin.shp'))
+
+def sample_land_points(rng, land_geom, num_points):
+  # random points inside the land area
+  xmin, ymin, xmax, ymax = shapely.bounds(land_geom)
+  shapely.prepare(land_geom)
+  sample_x = []
+  sample_y = []
+  num_found = 0
+  while num_found < num_points:
+    try_x = rng.uniform(xmin, xmax, num_points)
+    try_y = rng.uniform(ymin, ymax, num_points)
+    on_land = shapely.contains_xy(land_geom, try_x, try_y)
+    sample_x.append(try_x[on_land])
+    sample_y.append(try_y[on_land])
+    num_found += np.sum(on_land)
+  return np.concatenate(sample_x)[:num_points], np.concatenate(sample_y)[:num_points]
+
+def make_synthetic_tracts(rng, us_states, num_tracts = 5000, counties_per_state = 20):
+  # voronoi cells around random points on land, split along state borders
+  # returns tract shapes (STATEFP/COUNTYFP/TRACTCE) and a census population table
+  land_geom = shapely.union_all(us_states.geometry.values)
+  seed_x, seed_y = sample_land_points(rng, land_geom, num_tracts)
+  tract_cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(np.column_stack([seed_x, seed_y]))))
+  tract_cells = gpd.GeoDataFrame(geometry = tract_cells, crs = us_states.crs)
+  state_tracts = gpd.overlay(tract_cells, us_states[['STATEFP', 'geometry']], how = 'intersection', keep_geom_type = True)
+  state_tracts['COUNTYFP'] = (rng.integers(0, counties_per_state, len(state_tracts.index)) * 2 + 1).astype(str)
+  state_tracts['COUNTYFP'] = state_tracts['COUNTYFP'].str.zfill(3)
+  state_tracts['TRACTCE'] = (state_tracts.groupby('STATEFP').cumcount() * 100 + 100).astype(str).str.zfill(6)
+  state_tracts = state_tracts[['STATEFP', 'COUNTYFP', 'TRACTCE', 'geometry']]
+  tract_id = state_tracts['STATEFP'] + state_tracts['COUNTYFP'] + state_tracts['TRACTCE']
+  tract_population = pd.DataFrame({'GEO_ID': '1400000US' + tract_id, 'NAME': 'Census Tract ' + tract_id,
+                                   'Estimate!!Total': rng.integers(500, 8000, len(tract_id.index))})
+  return state_tracts, tract_population
+
+def make_synthetic_parcels(rng, us_states, num_parcels = 100000):
+  # parcel points on land with a structure value
+  land_geom = shapely.union_all(us_states.geometry.values)
+  parcel_x, parcel_y = sample_land_points(rng, land_geom, num_parcels)
+  return gpd.GeoDataFrame({'IMPROVVAL': np.round(rng.lognormal(12.0, 1.0, num_parcels), 0)},
+                          geometry = shapely.points(parcel_x, parcel_y), crs = 'EPSG:4326')
+
+def write_synthetic_data(data_dir, seed = 0, start_year = 2010, num_years = 5, storms_per_year = 15,
+                         points_per_storm = 40, num_states = 12, num_tracts = 5000, num_parcels = 100000):
+  # write a full set of synthetic inputs to data_dir:
+  #   nhd_tracks/<event>/<event>_pts.shp and _lin.shp  (as written by read_nhc_api.py)
+  #   CensusTracts/tl_2024_<state>/tl_2024_<state>_tract.shp  (as written by read_census_tract_api.py)
+  #   ACSDT5Y2023.B01003-Data.csv  (tract population)
+  #   cb_2018_us_state_500k/cb_2018_us_state_500k.shp
+  #   Parcels/synthetic_parcels_pt.shp
+  # returns the paths of each input
+  rng = np.random.default_rng(seed)
+  us_states = make_synthetic_states(rng, num_states = num_states)
+  state_path = os.path.join(data_dir, 'cb_2018_us_state_500k', 'cb_2018_us_state_500k.shp')
+  os.makedirs(os.path.dirname(state_path), exist_ok = True)
+  us_states.to_file(state_path)
+
+  track_points = make_synthetic_tracks(rng, start_year = start_year, num_years = num_years,
+                                       storms_per_year = storms_per_year, points_per_storm = points_per_storm)
+  write_synthetic_events(track_points, os.path.join(data_dir, 'nhd_tracks'))
+
+  state_tracts, tract_population = make_synthetic_tracts(rng, us_states, num_tracts = num_tracts)
+  tract_folder = os.path.join(data_dir, 'CensusTracts')
+  for state_fp, state_tract in state_tracts.groupby('STATEFP'):
+    tract_dir = os.path.join(tract_folder, 'tl_2024_' + state_fp)
+    os.makedirs(tract_dir, exist_ok = True)
+    state_tract.to_file(os.path.join(tract_dir, 'tl_2024_' + state_fp + '_tract.shp'))
+  population_path = os.path.join(data_dir, 'ACSDT5Y2023.B01003-Data.csv')
+  tract_population.to_csv(population_path, index = False)
+
+  parcels = make_synthetic_parcels(rng, us_states, num_parcels = num_parcels)
+  parcel_path = os.path.join(data_dir, 'Parcels', 'synthetic_parcels_pt.shp')
+  os.makedirs(os.path.dirname(parcel_path), exist_ok = True)
+  parcels.to_file(parcel_path)
+  return {'states': state_path, 'tracks': os.path.join(data_dir, 'nhd_tracks'), 'tracts': tract_folder,
+          'population': population_path, 'parcels': parcel_path}
@@ -0,0 +1,194 @@
+import http.server
+import threading
+import zipfile
+import io
+import os
+
+import pytest
+
+from download_functions import make_session, fetch_cached, download_to_file
+
+# download functions against a local http server that serves fixture zip files
+# the server answers conditional requests (ETag / Last-Modified -> 304),
+# Range requests (with If-Range), can fail the first requests with a 503,
+# and can drop the connection part way through a file
+# run with: python -m pytest -q (from the HurricaneTracks directory)
+
+def make_fixture_zip(file_text, num_bytes = 0):
+  # zip with one small file (plus an optional stored file to make it num_bytes bigger)
+  zip_buffer = io.BytesIO()
+  with zipfile.ZipFile(zip_buffer, 'w') as fixture_zip:
+    fixture_zip.writestr('al012020_pts.txt', file_text)
+    if num_bytes > 0:
+      fixture_zip.writestr('padding.bin', os.urandom(num_bytes), compress_type = zipfile.ZIP_STORED)
+  return zip_buffer.getvalue()
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+  # files: {path: {'content': bytes, 'ETag': str or None, 'Last-Modified': str or None}}
+  # failures: {path: number of 503 responses before the file is served}
+  # drop_after: {path: number of bytes sent before the connection is dropped (once)}
+  # wrong_range: paths whose Range responses start at the wrong byte
+  files = {}
+  failures = {}
+  drop_after = {}
+  wrong_range = set()
+  requests = []
+
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    FixtureHandler.requests.append((self.path, dict(self.headers)))
+    if FixtureHandler.failures.get(self.path, 0) > 0:
+      FixtureHandler.failures[self.path] -= 1
+      self.send_response(503)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    if self.path not in FixtureHandler.files:
+      self.send_response(404)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    fixture = FixtureHandler.files[self.path]
+    validators = [fixture.get('ETag'), fixture.get('Last-Modified')]
+    if ((fixture.get('ETag') and self.headers.get('If-None-Match') == fixture['ETag'])
+        or (fixture.get('Last-Modified') and self.headers.get('If-Modified-Since') == fixture['Last-Modified'])):
+      self.send_response(304)
+      self.end_headers()
+      return
+    content = fixture['content']
+    range_start = 0
+    if self.headers.get('Range') and (self.headers.get('If-Range') is None or self.headers.get('If-Range') in validators):
+      range_start = int(self.headers['Range'].split('=')[1].split('-')[0])
+      if self.path in FixtureHandler.wrong_range:
+        range_start = max(range_start - 10, 0)
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes ' + str(range_start) + '-' + str(len(content) - 1) + '/' + str(len(content)))
+    else:
+      self.send_response(200)
+    for header_name in ['ETag', 'Last-Modified']:
+      if fixture.get(header_name):
+        self.send_header(header_name, fixture[header_name])
+    self.send_header('Content-Length', str(len(content) - range_start))
+    self.end_headers()
+    if self.path in FixtureHandler.drop_after:
+      # send part of the file and close the connection
+      self.wfile.write(content[range_start:range_start + FixtureHandler.drop_after.pop(self.path)])
+      self.wfile.flush()
+      self.close_connection = True
+      return
+    self.wfile.write(content[range_start:])
+
+@pytest.fixture
+def fixture_server():
+  FixtureHandler.files = {}
+  FixtureHandler.failures = {}
+  FixtureHandler.drop_after = {}
+  FixtureHandler.wrong_range = set()
+  FixtureHandler.requests = []
+  server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+  server_thread = threading.Thread(target = server.serve_forever, daemon = True)
+  server_thread.start()
+  yield 'http://127.0.0.1:' + str(server.server_address[1])
+  server.shutdown()
+  server.server_close()
+
+def test_fetch_cached_revalidates_with_etag(fixture_server, tmp_path):
+  FixtureHandler.files['/al012020_best_track.zip'] = {'content': make_fixture_zip('first'), 'ETag': '"v1"'}
+  session = make_session(backoff_factor = 0.0)
+  storm_url = fixture_server + '/al012020_best_track.zip'
+  status, content = fetch_cached(session, storm_url, str(tmp_path))
+  assert status == 'downloaded'
+  assert zipfile.ZipFile(io.BytesIO(content)).read('al012020_pts.txt') == b'first'
+  # unchanged on the server -> 304, content comes from the cache
+  status, content = fetch_cached(session, storm_url, str(tmp_path))
+  assert status == 'cached'
+  assert FixtureHandler.requests[-1][1].get('If-None-Match') == '"v1"'
+  assert zipfile.ZipFile(io.BytesIO(content)).read('al012020_pts.txt') == b'first'
+  # changed on the server -> downloaded again
+  FixtureHandler.files['/al012020_best_track.zip'] = {'content': make_fixture_zip('second'), 'ETag': '"v2"'}
+  status, content = fetch_cached(session, storm_url, str(tmp_path))
+  assert status == 'downloaded'
+  assert zipfile.ZipFile(io.BytesIO(content)).read('al012020_pts.txt') == b'second'
+
+def test_fetch_cached_revalidates_with_last_modified(fixture_server, tmp_path):
+  last_modified = 'Wed, 01 Jan 2025 00:00:00 GMT'
+  FixtureHandler.files['/al022020_best_track.zip'] = {'content': make_fixture_zip('storm'), 'Last-Modified': last_modified}
+  session = make_session(backoff_factor = 0.0)
+  storm_url = fixture_server + '/al022020_best_track.zip'
+  assert fetch_cached(session, storm_url, str(tmp_path))[0] == 'downloaded'
+  assert fetch_cached(session, storm_url, str(tmp_path))[0] == 'cached'
+  assert FixtureHandler.requests[-1][1].get('If-Modified-Since') == last_modified
+
+def test_fetch_cached_missing_storm(fixture_server, tmp_path):
+  session = make_session(backoff_factor = 0.0)
+  assert fetch_cached(session, fixture_server + '/al312020_best_track.zip', str(tmp_path)) == ('missing', None)
+
+def test_fetch_cached_retries_server_errors(fixture_server, tmp_path):
+  FixtureHandler.files['/al032020_best_track.zip'] = {'content': make_fixture_zip('storm'), 'ETag': '"v1"'}
+  FixtureHandler.failures['/al032020_best_track.zip'] = 2
+  session = make_session(retries = 3, backoff_factor = 0.0)
+  assert fetch_cached(session, fixture_server + '/al032020_best_track.zip', str(tmp_path))[0] == 'downloaded'
+  assert len(FixtureHandler.requests) == 3
+  # more failures than retries
+  FixtureHandler.failures['/al032020_best_track.zip'] = 5
+  session = make_session(retries = 2, backoff_factor = 0.0)
+  assert fetch_cached(session, fixture_server + '/al032020_best_track.zip', str(tmp_path / 'other'))[0] == 'error'
+
+def test_download_to_file(fixture_server, tmp_path):
+  tract_zip = make_fixture_zip('tracts', num_bytes = 100000)
+  FixtureHandler.files['/tl_2024_37_tract.zip'] = {'content': tract_zip, 'ETag': '"v1"'}
+  session = make_session(backoff_factor = 0.0)
+  output_path = str(tmp_path / 'tl_2024_37_tract.zip')
+  assert download_to_file(session, fixture_server + '/tl_2024_37_tract.zip', output_path) == 'downloaded'
+  with open(output_path, 'rb') as output_file:
+    assert output_file.read() == tract_zip
+  assert not os.path.exists(output_path + '.part')
+  assert not os.path.exists(output_path + '.part.json')
+  assert download_to_file(session, fixture_server + '/tl_2024_99_tract.zip', output_path) == 'missing'
+
+def test_download_to_file_resumes(fixture_server, tmp_path):
+  # the first request is dropped part way through, the second asks for the rest
+  tract_zip = make_fixture_zip('tracts', num_bytes = 100000)
+  FixtureHandler.files['/tl_2024_37_tract.zip'] = {'content': tract_zip, 'ETag': '"v1"'}
+  FixtureHandler.drop_after['/tl_2024_37_tract.zip'] = 40000
+  session = make_session(backoff_factor = 0.0)
+  output_path = str(tmp_path / 'tl_2024_37_tract.zip')
+  assert download_to_file(session, fixture_server + '/tl_2024_37_tract.zip', output_path, chunk_size = 1024) == 'downloaded'
+  with open(output_path, 'rb') as output_file:
+    assert output_file.read() == tract_zip
+  # (the end of the dropped request can be lost, so the range starts at or before byte 40000)
+  assert len(FixtureHandler.requests) == 2
+  range_start = int(FixtureHandler.requests[-1][1]['Range'].split('=')[1].split('-')[0])
+  assert 0 < range_start <= 40000
+  assert FixtureHandler.requests[-1][1].get('If-Range') == '"v1"'
+
+def test_download_to_file_restarts_changed_file(fixture_server, tmp_path):
+  # the file changes on the server after the first (dropped) request,
+  # so If-Range fails and the whole new file is sent
+  FixtureHandler.files['/tl_2024_37_tract.zip'] = {'content': make_fixture_zip('old', num_bytes = 100000), 'ETag': '"v1"'}
+  FixtureHandler.drop_after['/tl_2024_37_tract.zip'] = 40000
+  session = make_session(backoff_factor = 0.0)
+  output_path = str(tmp_path / 'tl_2024_37_tract.zip')
+  part_status = download_to_file(session, fixture_server + '/tl_2024_37_tract.zip', output_path, chunk_size = 1024, attempts = 1)
+  assert part_status == 'error'
+  assert 0 < os.path.getsize(output_path + '.part') <= 40000
+  new_zip = make_fixture_zip('new', num_bytes = 100000)
+  FixtureHandler.files['/tl_2024_37_tract.zip'] = {'content': new_zip, 'ETag': '"v2"'}
+  assert download_to_file(session, fixture_server + '/tl_2024_37_tract.zip', output_path) == 'downloaded'
+  with open(output_path, 'rb') as output_file:
+    assert output_file.read() == new_zip
+  assert zipfile.ZipFile(output_path).read('al012020_pts.txt') == b'new'
+
+def test_download_to_file_checks_range_start(fixture_server, tmp_path):
+  # a 206 that does not start at the end of the partial file is not appended
+  tract_zip = make_fixture_zip('tracts', num_bytes = 100000)
+  FixtureHandler.files['/tl_2024_37_tract.zip'] = {'content': tract_zip, 'ETag': '"v1"'}
+  FixtureHandler.drop_after['/tl_2024_37_tract.zip'] = 40000
+  FixtureHandler.wrong_range.add('/tl_2024_37_tract.zip')
+  session = make_session(backoff_factor = 0.0)
+  output_path = str(tmp_path / 'tl_2024_37_tract.zip')
+  assert download_to_file(session, fixture_server + '/tl_2024_37_tract.zip', output_path, chunk_size = 1024) == 'downloaded'
+  with open(output_path, 'rb') as output_file:
+    assert output_file.read() == tract_zip
@@ -0,0 +1,69 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+import pytest
+
+from grid_functions import build_summed_area_table, query_rectangles, query_discs, rasterize_exposure
+
+# grid queries against a brute-force sum over cell centers, with rectangles and
+# disc centers on, next to, and far off every edge of the grid
+# run with: python -m pytest -q (from the HurricaneTracks directory)
+
+def make_test_grid(num_rows = 100, num_columns = 80, cell_size = 10.0, seed = 0):
+  rng = np.random.default_rng(seed)
+  cell_exposure = rng.integers(0, 5, size = (num_rows, num_columns)).astype(float)
+  exposure_grid = {'cell_size': cell_size, 'x_origin': 500.0, 'y_origin': -200.0,
+                   'num_rows': num_rows, 'num_columns': num_columns,
+                   'sat': build_summed_area_table(cell_exposure)}
+  center_x = exposure_grid['x_origin'] + (np.arange(num_columns) + 0.5) * cell_size
+  center_y = exposure_grid['y_origin'] + (np.arange(num_rows) + 0.5) * cell_size
+  return exposure_grid, cell_exposure, center_x, center_y
+
+def get_test_points(exposure_grid, num_points, rng):
+  # points from one grid width/height below the grid to one above it
+  width = exposure_grid['num_columns'] * exposure_grid['cell_size']
+  height = exposure_grid['num_rows'] * exposure_grid['cell_size']
+  point_x = exposure_grid['x_origin'] + rng.uniform(-width, 2.0 * width, num_points)
+  point_y = exposure_grid['y_origin'] + rng.uniform(-height, 2.0 * height, num_points)
+  return point_x, point_y
+
+def test_query_rectangles():
+  exposure_grid, cell_exposure, center_x, center_y = make_test_grid()
+  rng = np.random.default_rng(1)
+  x_min, y_min = get_test_points(exposure_grid, 300, rng)
+  x_max = x_min + rng.uniform(0.0, 400.0, 300)
+  y_max = y_min + rng.uniform(0.0, 400.0, 300)
+  expected = np.array([cell_exposure[np.ix_((center_y >= y_low) & (center_y <= y_high), (center_x >= x_low) & (center_x <= x_high))].sum()
+                       for x_low, y_low, x_high, y_high in zip(x_min, y_min, x_max, y_max)])
+  assert np.allclose(query_rectangles(exposure_grid, x_min, y_min, x_max, y_max), expected)
+
+def test_query_discs():
+  exposure_grid, cell_exposure, center_x, center_y = make_test_grid()
+  rng = np.random.default_rng(2)
+  disc_x, disc_y = get_test_points(exposure_grid, 300, rng)
+  radius = rng.uniform(0.0, 300.0, 300)
+  cell_distance = lambda x, y: np.hypot(center_x[np.newaxis, :] - x, center_y[:, np.newaxis] - y)
+  expected = np.array([cell_exposure[cell_distance(x, y) <= r].sum() for x, y, r in zip(disc_x, disc_y, radius)])
+  assert np.allclose(query_discs(exposure_grid, disc_x, disc_y, radius), expected)
+  # the same discs in small batches
+  assert np.allclose(query_discs(exposure_grid, disc_x, disc_y, radius, max_strips = 50), expected)
+
+def test_queries_off_grid():
+  # queries entirely past each edge of the grid find no exposure
+  exposure_grid, cell_exposure, center_x, center_y = make_test_grid()
+  x_edges = [center_x[0] - 1000.0, center_x[-1] + 1000.0]
+  y_edges = [center_y[0] - 1000.0, center_y[-1] + 1000.0]
+  query_x = np.array(x_edges + [center_x.mean(),] * 2)
+  query_y = np.array([center_y.mean(),] * 2 + y_edges)
+  assert np.all(query_rectangles(exposure_grid, query_x - 50.0, query_y - 50.0, query_x + 50.0, query_y + 50.0) == 0.0)
+  assert np.all(query_discs(exposure_grid, query_x, query_y, 50.0) == 0.0)
+
+def test_rasterize_exposure():
+  exposure_gdf = gpd.GeoDataFrame({'Population': [1.0, 2.0, 4.0]}, geometry = shapely.points([0.0, 15.0, 1000.0], [0.0, 5.0, 1000.0]))
+  cell_exposure, x_origin, y_origin = rasterize_exposure(exposure_gdf, 'Population', 10.0)
+  assert cell_exposure.shape == (100, 100)
+  assert (x_origin, y_origin) == (0.0, 0.0)
+  assert cell_exposure[0, 0] == 1.0 and cell_exposure[0, 1] == 2.0 and cell_exposure[-1, -1] == 4.0
+  # grids over the memory limit are refused before anything is allocated
+  with pytest.raises(ValueError):
+    rasterize_exposure(exposure_gdf, 'Population', 10.0, max_build_mb = 0.1)
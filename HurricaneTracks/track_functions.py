@@ -0,0 +1,184 @@
+import pandas as pd
+import geopandas as gpd
+import hashlib
+import json
+import os
+
+def get_event_fingerprint(event_directory):
+  # name, size, and modification time of every file in an event folder
+  # (changes whenever nhc files are re-downloaded and extracted)
+  fingerprint = hashlib.sha256()
+  for file_name in sorted(os.listdir(event_directory)):
+    file_stat = os.stat(os.path.join(event_directory, file_name))
+    fingerprint.update((file_name + ' ' + str(file_stat.st_size) + ' ' + str(file_stat.st_mtime_ns) + '\n').encode('utf-8'))
+  return fingerprint.hexdigest()
+
+def read_event_tracks(output_dir, hurricane_event, ender, dissolve = False):
+  # filenames can change over the course of the simulation
+  # loop through each potential name - the last one that exists is used
+  hurricane_path = None
+  for shp_end in ender:
+    shp_path = os.path.join(output_dir, hurricane_event, hurricane_event + '_' + shp_end + '.shp')
+    if os.path.exists(shp_path):
+      # read single-event data
+      hurricane_path = gpd.read_file(shp_path)
+  if hurricane_path is None:
+    return None
+  # combine each line or windswath into a
+  # single geometry for each event
+  # points/radii are left as multiple geometries
+  if dissolve:
+    hurricane_path = hurricane_path.dissolve()
+  # add in a data column for the year of the event
+  # (extracted from event name) and the event name
+  hurricane_path['TCYR'] = float(hurricane_event[4:8])
+  hurricane_path['EVENT'] = hurricane_event
+  return hurricane_path
+
+def get_event_season(hurricane_event):
+  # year of the event (from the event name)
+  return int(hurricane_event[4:8])
+
+def get_combined_track_dir(combined_dir, dt):
+  # combined tracks are stored as one GeoParquet file per season
+  # (combined_tracks/combined_tracks_points/2024.parquet), with a manifest
+  # of the event files each season includes
+  return os.path.join(combined_dir, 'combined_tracks_' + dt)
+
+def read_combined_tracks(track_dir, seasons = None, columns = None):
+  # combined tracks from the season files in track_dir (all seasons if seasons is None)
+  # in order of year, then event name; returns None if there are no season files
+  # each season is read on its own, since columns can change between seasons
+  season_paths = [os.path.join(track_dir, file_name) for file_name in sorted(os.listdir(track_dir))
+                  if file_name.endswith('.parquet') and (seasons is None or int(file_name[:-8]) in seasons)]
+  if len(season_paths) == 0:
+    return None
+  season_tracks = [gpd.read_parquet(season_path, columns = columns) for season_path in season_paths]
+  return gpd.GeoDataFrame(pd.concat(season_tracks, ignore_index = True), crs = season_tracks[0].crs)
+
+def combine_event_tracks(output_dir, combined_dir, dt, ender, epsg = 3857):
+  # combine single-event track files into one GeoParquet file per season
+  # only events that are new or changed since the last run are read, and only
+  # the seasons they (or deleted events) belong to are rewritten, so a run takes
+  # time in proportion to the new data, not to the whole archive
+  # returns the seasons that were rewritten and the events that were read
+  track_dir = get_combined_track_dir(combined_dir, dt)
+  manifest_path = os.path.join(track_dir, 'manifest.json')
+  event_manifest = {}
+  if os.path.exists(manifest_path):
+    with open(manifest_path) as manifest_file:
+      track_manifest = json.load(manifest_file)
+    # a different projection rewrites every season
+    if track_manifest.get('epsg') == epsg:
+      event_manifest = track_manifest['events']
+  # loop through all event folders
+  # each folder contains nhd data from a single event
+  current_manifest = {}
+  for hurricane_event in sorted(os.listdir(output_dir)):
+    if os.path.isdir(os.path.join(output_dir, hurricane_event)):
+      current_manifest[hurricane_event] = get_event_fingerprint(os.path.join(output_dir, hurricane_event))
+  read_events = [hurricane_event for hurricane_event in current_manifest
+                 if event_manifest.get(hurricane_event) != current_manifest[hurricane_event]]
+  deleted_events = [hurricane_event for hurricane_event in event_manifest if hurricane_event not in current_manifest]
+  if len(event_manifest) == 0 and os.path.isdir(track_dir):
+    # nothing from an earlier run can be kept
+    deleted_seasons = [int(file_name[:-8]) for file_name in os.listdir(track_dir) if file_name.endswith('.parquet')]
+  else:
+    deleted_seasons = [get_event_season(hurricane_event) for hurricane_event in deleted_events]
+  changed_seasons = sorted(set([get_event_season(hurricane_event) for hurricane_event in read_events] + deleted_seasons))
+  os.makedirs(track_dir, exist_ok = True)
+  for season in changed_seasons:
+    season_path = os.path.join(track_dir, str(season) + '.parquet')
+    season_tracks = []
+    # keep rows from events that have not changed (drops changed and deleted events)
+    if len(event_manifest) > 0 and os.path.exists(season_path):
+      old_tracks = gpd.read_parquet(season_path)
+      season_tracks.append(old_tracks[old_tracks['EVENT'].isin(current_manifest) & ~old_tracks['EVENT'].isin(read_events)])
+    for hurricane_event in read_events:
+      if get_event_season(hurricane_event) == season:
+        hurricane_path = read_event_tracks(output_dir, hurricane_event, ender, dissolve = dt in ['shape', 'lines'])
+        if hurricane_path is None:
+          print('no data ' + hurricane_event + ' ' + dt) # make note if data reads an error
+        else:
+          season_tracks.append(hurricane_path.to_crs(epsg = epsg))
+    season_tracks = [event_tracks for event_tracks in season_tracks if len(event_tracks.index) > 0]
+    if len(season_tracks) == 0:
+      if os.path.exists(season_path):
+        os.remove(season_path)
+      continue
+    # order events by name
+    season_tracks = gpd.GeoDataFrame(pd.concat(season_tracks, ignore_index = True), crs = 'EPSG:' + str(epsg))
+    season_tracks = season_tracks.sort_values('EVENT', kind = 'stable', ignore_index = True)
+    season_tracks.to_parquet(season_path + '.part')
+    os.replace(season_path + '.part', season_path)
+  # record which event files are included (written last, so events from an
+  # interrupted run are read again)
+  with open(manifest_path + '.part', 'w') as manifest_file:
+    json.dump({'epsg': epsg, 'events': current_manifest}, manifest_file, indent = 1, sort_keys = True)
+  os.replace(manifest_path + '.part', manifest_path)
+  return changed_seasons, read_events
+
+def build_storm_summary(hurricane_points):
+  # one row per storm (year + storm number), in the order storms appear,
+  # made in a single grouped pass over the track points:
+  # peak INTENSITY and STORMNAME/geometry at the peak point (ties go to the earliest point),
+  # NAMES = every name the storm was called ('; ' separated),
+  # FIRST_DTG/LAST_DTG = first and last time, POINTS = number of track points
+  storm_keys = ['TCYR', 'STORMNUM']
+  hurricane_points = hurricane_points.reset_index(drop = True)
+  storm_groups = hurricane_points.groupby(storm_keys, sort = False)
+  peak_index = storm_groups['INTENSITY'].idxmax()
+  peak_columns = storm_keys + [column for column in ['EVENT', 'STORMNAME', 'INTENSITY'] if column in hurricane_points.columns]
+  storm_summary = hurricane_points.loc[peak_index.values, peak_columns + ['geometry',]].reset_index(drop = True)
+  storm_order = pd.MultiIndex.from_frame(storm_summary[storm_keys])
+  # list of unique names for each storm (blank names are skipped)
+  storm_names = hurricane_points[storm_keys + ['STORMNAME',]].dropna()
+  storm_names = storm_names[storm_names['STORMNAME'].astype(str).str.strip() != ''].drop_duplicates()
+  storm_names = storm_names.groupby(storm_keys, sort = False)['STORMNAME'].agg('; '.join)
+  storm_summary['NAMES'] = storm_names.reindex(storm_order).fillna('').to_numpy()
+  if 'DTG' in hurricane_points.columns:
+    storm_summary['FIRST_DTG'] = storm_groups['DTG'].min().reindex(storm_order).to_numpy()
+    storm_summary['LAST_DTG'] = storm_groups['DTG'].max().reindex(storm_order).to_numpy()
+  storm_summary['POINTS'] = storm_groups.size().reindex(storm_order).to_numpy()
+  return gpd.GeoDataFrame(storm_summary, geometry = 'geometry', crs = hurricane_points.crs)
+
+def write_storm_summary(hurricane_points, combined_dir):
+  # storm summary is stored next to the combined tracks
+  storm_summary = build_storm_summary(hurricane_points)
+  storm_summary.to_parquet(os.path.join(combined_dir, 'storm_summary.parquet'))
+  return storm_summary
+
+def update_storm_summary(combined_dir, changed_seasons):
+  # storms never span seasons, so only the storms of changed seasons are rebuilt
+  # (from those seasons' combined points), the rest are kept from the last summary
+  summary_path = os.path.join(combined_dir, 'storm_summary.parquet')
+  track_dir = get_combined_track_dir(combined_dir, 'points')
+  if not os.path.exists(summary_path):
+    return write_storm_summary(read_combined_tracks(track_dir), combined_dir)
+  storm_summary = gpd.read_parquet(summary_path)
+  season_summaries = [storm_summary[~storm_summary['TCYR'].isin(changed_seasons)]]
+  season_points = read_combined_tracks(track_dir, seasons = changed_seasons)
+  if season_points is not None:
+    season_summaries.append(build_storm_summary(season_points).to_crs(storm_summary.crs))
+  storm_summary = gpd.GeoDataFrame(pd.concat(season_summaries, ignore_index = True), crs = storm_summary.crs)
+  storm_summary = storm_summary.sort_values('TCYR', kind = 'stable', ignore_index = True)
+  storm_summary.to_parquet(summary_path + '.part')
+  os.replace(summary_path + '.part', summary_path)
+  return storm_summary
+
+def read_storm_summary(combined_dir, epsg = None):
+  # load the storm summary written by combine_nhc_tracks.py
+  # (built from the combined points file if it has not been written yet)
+  summary_path = os.path.join(combined_dir, 'storm_summary.parquet')
+  if os.path.exists(summary_path):
+    storm_summary = gpd.read_parquet(summary_path)
+  else:
+    track_dir = get_combined_track_dir(combined_dir, 'points')
+    combined_points = read_combined_tracks(track_dir) if os.path.isdir(track_dir) else None
+    if combined_points is None:
+      raise FileNotFoundError('no storm summary or combined track points in ' + combined_dir
+                              + ', run combine_nhc_tracks.py first')
+    storm_summary = build_storm_summary(combined_points)
+  if epsg is not None:
+    storm_summary = storm_summary.to_crs(epsg = epsg)
+  return storm_summary
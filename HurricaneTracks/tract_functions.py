@@ -0,0 +1,85 @@
+import pandas as pd
+import geopandas as gpd
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+def read_tract_population(population_path):
+  # load census tract population data
+  # from https://data.census.gov
+  population_data = pd.read_csv(population_path, header = 0, usecols = ['GEO_ID', 'Estimate!!Total'])
+  # we want to read the part of the GEO_ID that
+  # comes after the letters 'US' - the 11-digit tract id
+  # (2-digit state, 3-digit county, 6-digit tract FIPS code)
+  tract_population = pd.DataFrame()
+  tract_population['GEOID'] = population_data['GEO_ID'].str.split('US').str[1].str[:11]
+  tract_population['Population'] = population_data['Estimate!!Total'].astype(int)
+  # keep the first row if a tract id is listed twice
+  return tract_population.drop_duplicates('GEOID').set_index('GEOID')
+
+def attach_tract_population(state_tract, tract_population):
+  # join population onto census tract shapes using the full tract id
+  tract_id = state_tract['STATEFP'] + state_tract['COUNTYFP'] + state_tract['TRACTCE']
+  population = tract_population['Population'].reindex(tract_id.to_numpy())
+  # tracts without population data are given a population of 0
+  # and returned separately so they can be reported as one table
+  no_population = population.isna().to_numpy()
+  unmatched_tracts = state_tract.loc[no_population, ['STATEFP', 'COUNTYFP', 'TRACTCE']].copy()
+  unmatched_tracts['GEOID'] = tract_id[no_population]
+  population_tracts_gdf = gpd.GeoDataFrame({'Population': population.fillna(0.0).to_numpy(dtype = float)},
+                                           index = pd.Index(tract_id.to_numpy()),
+                                           crs = state_tract.crs, geometry = state_tract.geometry.values)
+  return population_tracts_gdf, unmatched_tracts
+
+# population table shared by each worker process
+# (set once per process by init_tract_worker)
+_worker_population = None
+
+def init_tract_worker(tract_population):
+  global _worker_population
+  _worker_population = tract_population
+
+def read_state_tracts(tract_shapefile, epsg = 32618):
+  # read state-level tract data, reproject, and join population
+  state_tract = gpd.read_file(tract_shapefile, columns = ['STATEFP', 'COUNTYFP', 'TRACTCE'])
+  state_tract = state_tract.to_crs(epsg = epsg)
+  return attach_tract_population(state_tract, _worker_population)
+
+def get_state_tract_shapefiles(shapefile_folder):
+  # find all state-level census tract shapefiles
+  # (each state is stored in its own folder, e.g. CensusTracts/tl_2024_37/tl_2024_37_tract.shp)
+  tract_shapefiles = []
+  for census_tract in sorted(os.listdir(shapefile_folder)):
+    tract_path = os.path.join(shapefile_folder, census_tract)
+    if os.path.isdir(tract_path):
+      tract_shapefiles.append(os.path.join(tract_path, census_tract + '_tract.shp'))
+  return tract_shapefiles
+
+def read_all_state_tracts(shapefile_folder, tract_population, epsg = 32618, max_workers = None):
+  return read_state_tract_files(get_state_tract_shapefiles(shapefile_folder), tract_population, epsg = epsg,
+                                max_workers = max_workers)
+
+def read_state_tract_files(tract_shapefiles, tract_population, epsg = 32618, max_workers = None):
+  # read and reproject states in parallel (max_workers = 1 reads them one at a time)
+  if max_workers == 1:
+    init_tract_worker(tract_population)
+    state_results = [read_state_tracts(tract_shapefile, epsg) for tract_shapefile in tract_shapefiles]
+  else:
+    with ProcessPoolExecutor(max_workers = max_workers, initializer = init_tract_worker, 
+                             initargs = (tract_population,)) as pool:
+      state_results = list(pool.map(read_state_tracts, tract_shapefiles, [epsg,] * len(tract_shapefiles)))
+  # combine all states at once
+  population_tracts_gdf = gpd.GeoDataFrame(pd.concat([state_result[0] for state_result in state_results]), 
+                                           crs = 'EPSG:' + str(epsg))
+  unmatched_tracts = pd.concat([state_result[1] for state_result in state_results])
+  return population_tracts_gdf, unmatched_tracts
+
+def write_population_tracts(population_tracts_gdf, parquet_path):
+  # GeoParquet keeps full column names and can be read back
+  # one column at a time (the tract id is stored as the 'GEOID' column)
+  population_tracts_gdf.rename_axis('GEOID').reset_index().to_parquet(parquet_path)
+
+def read_population_tracts(parquet_path, columns = ['Population', 'geometry']):
+  # read only the requested columns from the tract GeoParquet file
+  read_columns = ['GEOID',] + [column for column in columns if column != 'GEOID']
+  population_tracts_gdf = gpd.read_parquet(parquet_path, columns = read_columns)
+  return population_tracts_gdf.set_index('GEOID').rename_axis(None)
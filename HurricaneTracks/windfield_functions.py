@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from exposure_functions import find_storm_exposure_pairs
+from data_access_functions import load_track_points, load_storm_summary
+
+# parametric wind-field exposure
+# instead of a circle around the peak point, winds are estimated at every
+# exposure location from every 6-hourly track point with a modified rankine
+# vortex: wind rises linearly to the peak (INTENSITY) at the radius of maximum
+# winds, then falls off as (rmax / r) ** decay_exponent
+# each location keeps the highest wind it sees during a storm, and exposure
+# is reported by wind-speed band (saffir-simpson categories by default)
+
+# sustained wind (mph) at the bottom of each band
+saffir_simpson_edges = [39.0, 74.0, 96.0, 111.0, 130.0, 157.0]
+saffir_simpson_labels = ['Tropical Storm', 'Category 1', 'Category 2', 'Category 3', 'Category 4', 'Category 5']
+
+def rankine_wind_speed(distances, peak_wind, rmax = 40000.0, decay_exponent = 0.5):
+  # modified rankine vortex wind speed at each distance (same units as rmax) from the storm center
+  distances = np.asarray(distances, dtype = float)
+  relative_distance = distances / rmax
+  return peak_wind * np.where(relative_distance <= 1.0, relative_distance,
+                              np.maximum(relative_distance, 1.0) ** (-decay_exponent))
+
+def get_cutoff_radius(peak_wind, min_wind, rmax = 40000.0, decay_exponent = 0.5):
+  # distance beyond which winds from a track point are below min_wind
+  # (0 for track points that never reach min_wind)
+  peak_wind = np.asarray(peak_wind, dtype = float)
+  wind_ratio = np.maximum(peak_wind, min_wind) / min_wind
+  return np.where(peak_wind >= min_wind, rmax * wind_ratio ** (1.0 / decay_exponent), 0.0)
+
+def get_point_chunks(storm_codes, max_points_per_chunk):
+  # split track points (sorted by storm) into chunks of whole storms
+  # with about max_points_per_chunk points each
+  if len(storm_codes) == 0:
+    return []
+  storm_starts = np.flatnonzero(np.r_[True, storm_codes[1:] != storm_codes[:-1]])
+  chunk_starts = [0,]
+  for storm_start in storm_starts[1:]:
+    if storm_start - chunk_starts[-1] >= max_points_per_chunk:
+      chunk_starts.append(storm_start)
+  return list(zip(chunk_starts, chunk_starts[1:] + [len(storm_codes),]))
+
+def calculate_windfield_exposure(exposure_gdf, exposure_column, track_points, storm_keys = ['TCYR', 'STORMNUM'],
+                                 rmax = 40000.0, decay_exponent = 0.5, gust_factor = 1.3,
+                                 band_edges = saffir_simpson_edges, band_labels = saffir_simpson_labels,
+                                 max_points_per_chunk = 200, max_locations_per_chunk = 100000):
+  # total exposure in each wind band for every storm, and the highest
+  # gust at each exposure location over all storms
+  # track points need INTENSITY (knots) and storm_keys columns; distances are in
+  # the units of the track point crs (rmax default is 40 km for a crs in meters)
+  # pairs of (track point, exposure location) farther apart than the distance where
+  # winds drop below the lowest band are never made - each track point's search
+  # radius depends on its intensity, and points below the lowest band are skipped
+  # track points are handled in chunks of whole storms, and exposure locations in
+  # chunks of max_locations_per_chunk rows, so the pairs made at one time are bounded
+  # (at most max_points_per_chunk * max_locations_per_chunk, plus one storm's extra points)
+  if exposure_gdf.crs != track_points.crs:
+    exposure_gdf = exposure_gdf.to_crs(track_points.crs)
+  band_edges = np.asarray(band_edges, dtype = float)
+  storm_codes = track_points.groupby(storm_keys, sort = False).ngroup().to_numpy()
+  storm_index = pd.MultiIndex.from_frame(track_points[storm_keys].drop_duplicates())
+  peak_wind = track_points['INTENSITY'].to_numpy(dtype = float) * 1.15
+  cutoff_radius = get_cutoff_radius(peak_wind, band_edges[0], rmax, decay_exponent)
+  # order track points by storm and drop points that are too weak to reach the lowest band
+  point_order = np.argsort(storm_codes, kind = 'stable')
+  point_order = point_order[cutoff_radius[point_order] > 0.0]
+  track_points = track_points.iloc[point_order]
+  storm_codes = storm_codes[point_order]
+  peak_wind = peak_wind[point_order]
+  cutoff_radius = cutoff_radius[point_order]
+
+  exposure_values = exposure_gdf[exposure_column].to_numpy(dtype = float)
+  band_exposure = np.zeros((len(storm_index), len(band_edges)))
+  location_max_wind = np.zeros(len(exposure_values))
+  # highest wind at each location during the current storm, and the position of
+  # one pair for each location (both only touched at the locations a storm reaches)
+  storm_max_wind = np.zeros(len(exposure_values))
+  location_pair = np.zeros(len(exposure_values), dtype = np.int64)
+  point_chunks = get_point_chunks(storm_codes, max_points_per_chunk)
+  for location_start in range(0, len(exposure_values), max_locations_per_chunk):
+    # (each location chunk gets its own spatial index, built once and reused for every point chunk)
+    location_chunk = exposure_gdf.iloc[location_start:location_start + max_locations_per_chunk]
+    for chunk_start, chunk_end in point_chunks:
+      point_idx, exposure_idx, distances = find_storm_exposure_pairs(location_chunk, track_points.iloc[chunk_start:chunk_end],
+                                                                     cutoff_radius[chunk_start:chunk_end])
+      point_idx += chunk_start
+      exposure_idx += location_start
+      # pairs are put in track point order (points are sorted by storm), so each
+      # storm's pairs are together (the spatial index doesn't promise an order)
+      if np.any(point_idx[1:] < point_idx[:-1]):
+        pair_order = np.argsort(point_idx, kind = 'stable')
+        point_idx, exposure_idx, distances = point_idx[pair_order], exposure_idx[pair_order], distances[pair_order]
+      pair_wind = rankine_wind_speed(distances, peak_wind[point_idx], rmax, decay_exponent)
+      chunk_codes = np.unique(storm_codes[chunk_start:chunk_end])
+      storm_bounds = np.searchsorted(storm_codes[point_idx], np.r_[chunk_codes, chunk_codes[-1] + 1])
+      for storm_code, pair_start, pair_end in zip(chunk_codes, storm_bounds[:-1], storm_bounds[1:]):
+        storm_locations = exposure_idx[pair_start:pair_end]
+        np.maximum.at(storm_max_wind, storm_locations, pair_wind[pair_start:pair_end])
+        # keep each location once (the last pair written for it)
+        location_pair[storm_locations] = np.arange(len(storm_locations))
+        storm_locations = storm_locations[location_pair[storm_locations] == np.arange(len(storm_locations))]
+        storm_location_wind = storm_max_wind[storm_locations]
+        storm_max_wind[storm_locations] = 0.0
+        # add exposure to the band each location's highest wind falls in
+        band_idx = np.searchsorted(band_edges, storm_location_wind, side = 'right') - 1
+        in_band = band_idx >= 0
+        band_exposure[storm_code] += np.bincount(band_idx[in_band], weights = exposure_values[storm_locations[in_band]],
+                                                 minlength = len(band_edges))
+        location_max_wind[storm_locations] = np.maximum(location_max_wind[storm_locations], storm_location_wind)
+  storm_band_exposure = pd.DataFrame(band_exposure, index = storm_index,
+                                     columns = band_labels)
+  location_max_gust = pd.Series(location_max_wind * gust_factor, index = exposure_gdf.index, name = 'Max Gust')
+  return storm_band_exposure, location_max_gust
+
+def get_hurricane_wind_exposure(exposure_gdf, exposure_column, exposure_label, rmax = 40000.0,
+                                decay_exponent = 0.5, gust_factor = 1.3, max_points_per_chunk = 200,
+                                max_locations_per_chunk = 100000, write_outputs = True):
+  # wind-field version of get_hurricane_exposure: exposure in each saffir-simpson
+  # band for every storm (written to hurricane_wind_exposed_<label>.csv) and the
+  # highest gust at every exposure location (max_gust_<label>.parquet)
+  # (write_outputs = False only returns them)
+  if isinstance(exposure_gdf, str):
+    exposure_gdf = gpd.read_parquet(exposure_gdf, columns = [exposure_column, 'geometry'])
+  track_points = load_track_points(epsg = 32618)
+  storm_band_exposure, location_max_gust = calculate_windfield_exposure(exposure_gdf, exposure_column, track_points,
+                                                                        rmax = rmax, decay_exponent = decay_exponent,
+                                                                        gust_factor = gust_factor,
+                                                                        max_points_per_chunk = max_points_per_chunk,
+                                                                        max_locations_per_chunk = max_locations_per_chunk)
+  # storm names and peak winds from the storm summary
+  storm_peaks = load_storm_summary().set_index(['TCYR', 'STORMNUM'])
+  hurricane_classification_df = pd.DataFrame(index = np.arange(len(storm_band_exposure.index)))
+  hurricane_classification_df['Year'] = storm_band_exposure.index.get_level_values('TCYR').to_numpy(dtype = float)
+  hurricane_classification_df['HurricaneNo'] = storm_band_exposure.index.get_level_values('STORMNUM').to_numpy(dtype = float)
+  hurricane_classification_df['Name'] = storm_peaks['STORMNAME'].reindex(storm_band_exposure.index).to_numpy()
+  hurricane_classification_df['Peak Windspeed'] = storm_peaks['INTENSITY'].reindex(storm_band_exposure.index).to_numpy(dtype = float) * 1.15
+  for band_label in storm_band_exposure.columns:
+    hurricane_classification_df['Exposed ' + exposure_label + ' ' + band_label] = storm_band_exposure[band_label].to_numpy()
+  if write_outputs:
+    hurricane_classification_df.to_csv('hurricane_wind_exposed_' + exposure_label + '.csv')
+    location_max_gust.to_frame().to_parquet('max_gust_' + exposure_label + '.parquet')
+  return hurricane_classification_df, location_max_gust